@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""
+Synthetic HDC data in the HDCFiles layout, for the benchmarks.
+
+    python benchmarks/generate.py ./bench-data --hospitals 50 --persons 2000 --years 2
+
+Writes under the base directory:
+
+    storage/{year}/t_person_db/t_person_db__all__{year}.parquet
+    storage/{year}/s_bench/s_bench__all__{year}.parquet
+    lookup/chospital.parquet
+    config.ini                  storage and lookup of the built scripts
+"""
+
+import os
+import sys
+from datetime import date
+
+import click
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hdcutil.hdcfile import ALL_HOSPCODE, HDCFiles  # noqa: E402
+
+# hospitals of other provinces in chospital, filtered out by get_chospital
+OTHER_PROVINCE_RATIO: float = 0.5
+
+
+def make_cid(rng: np.random.Generator, n: int) -> np.ndarray:
+    """
+    Returns 13-digit CIDs with a valid mod 11 check digit, the first digit is 1-8.
+
+    Args:
+        rng (np.random.Generator): The random generator.
+        n (int): Number of CIDs.
+
+    Returns:
+        np.ndarray: The CIDs as strings.
+    """
+    digits: np.ndarray = rng.integers(0, 10, size=(n, 12))
+    digits[:, 0] = rng.integers(1, 9, size=n)
+    weights: np.ndarray = np.arange(13, 1, -1)
+    check: np.ndarray = (11 - (digits * weights).sum(axis=1) % 11) % 10
+    cid: np.ndarray = np.concatenate([digits, check[:, None]], axis=1)
+    return np.array(["".join(map(str, row)) for row in cid])
+
+
+def make_hospcodes(n: int, start: int = 10000) -> list[str]:
+    return [f"{start + i:05}" for i in range(n)]
+
+
+def make_chospital(
+    rng: np.random.Generator, hospcodes: list[str], province_code: str
+) -> pa.Table:
+    """
+    Returns the chospital lookup: the hospitals of the province and as many of other provinces.
+    """
+    n_other: int = int(
+        len(hospcodes) * OTHER_PROVINCE_RATIO / (1 - OTHER_PROVINCE_RATIO)
+    )
+    others: list[str] = make_hospcodes(n_other, start=20000)
+    chw_other: list[str] = [
+        f"{c:02}"
+        for c in rng.choice(
+            [c for c in range(10, 97) if f"{c:02}" != province_code], n_other
+        )
+    ]
+    all_hospcodes: list[str] = hospcodes + others
+    n: int = len(all_hospcodes)
+    return pa.table(
+        dict(
+            HOSPCODE=all_hospcodes,
+            HOSNAME=[f"hospital {h}" for h in all_hospcodes],
+            HOSTYPE=[f"{t:02}" for t in rng.choice([3, 5, 7, 18], n)],
+            CHW_CODE=[province_code] * len(hospcodes) + chw_other,
+            AMP_CODE=[f"{a:02}" for a in rng.integers(1, 20, n)],
+            TMB_CODE=[f"{t:02}" for t in rng.integers(1, 15, n)],
+            # a few closed hospitals
+            STATUS=(rng.random(n) > 0.05).astype("int64"),
+        )
+    )
+
+
+def make_person(
+    rng: np.random.Generator, hospcodes: list[str], persons: int, year: int
+) -> pa.Table:
+    """
+    Returns the t_person_db of a budget year with `persons` rows per hospital.
+    """
+    n: int = len(hospcodes) * persons
+    birth_days: np.ndarray = rng.integers(0, 100 * 365, n)
+    birth: np.ndarray = np.datetime64(date(year, 1, 1)) - birth_days.astype(
+        "timedelta64[D]"
+    )
+    return pa.table(
+        dict(
+            HOSPCODE=np.repeat(hospcodes, persons),
+            PID=np.tile(np.arange(1, persons + 1), len(hospcodes)).astype("str"),
+            CID=make_cid(rng, n),
+            # 1 is a valid CID, 0 foreigners and invalid CIDs
+            CK_CID=(rng.random(n) > 0.03).astype("int64"),
+            SEX=rng.choice(["1", "2"], n),
+            BIRTH=birth,
+            TYPEAREA=rng.choice(
+                ["1", "2", "3", "4", "5"], n, p=[0.5, 0.1, 0.3, 0.05, 0.05]
+            ),
+            NATION=rng.choice(["099", "048", "056"], n, p=[0.95, 0.03, 0.02]),
+            DISCHARGE=rng.choice(["9", "1", "2", "3"], n, p=[0.9, 0.04, 0.03, 0.03]),
+            D_UPDATE=np.datetime64(f"{year - 1}-10-01")
+            + rng.integers(0, 365, n).astype("timedelta64[D]"),
+        )
+    )
+
+
+def make_summary(rng: np.random.Generator, hospcodes: list[str], year: int) -> pa.Table:
+    """
+    Returns an s_ summary table, one row per hospital and village.
+    """
+    villages: int = 10
+    n: int = len(hospcodes) * villages
+    target: np.ndarray = rng.integers(0, 500, n)
+    return pa.table(
+        dict(
+            HOSPCODE=np.repeat(hospcodes, villages),
+            AREACODE=[f"14{a:06}" for a in rng.integers(0, 10**6, n)],
+            D_COM=[f"{year}-01-01T00:00:00"] * n,
+            B_YEAR=[str(year)] * n,
+            TARGET=target,
+            RESULT=(target * rng.random(n)).astype("int64"),
+        )
+    )
+
+
+def generate(
+    base_dir: str,
+    hospitals: int = 50,
+    persons: int = 2000,
+    years: int = 1,
+    budget_year: int = 2024,
+    province_code: str = "14",
+    seed: int = 0,
+) -> dict:
+    """
+    Writes the synthetic data of `years` budget years ending at budget_year.
+
+    Args:
+        base_dir (str): The base directory.
+        hospitals (int, optional): Number of hospitals of the province. Defaults to 50.
+        persons (int, optional): Number of persons per hospital. Defaults to 2000.
+        years (int, optional): Number of budget years. Defaults to 1.
+        budget_year (int, optional): The last budget year. Defaults to 2024.
+        province_code (str, optional): The province code. Defaults to "14".
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        dict: The paths and the scale of the data.
+    """
+    rng: np.random.Generator = np.random.default_rng(seed)
+    storage: str = os.path.join(base_dir, "storage")
+    lookup: str = os.path.join(base_dir, "lookup")
+    os.makedirs(lookup, exist_ok=True)
+    hospcodes: list[str] = make_hospcodes(hospitals)
+
+    pq.write_table(
+        make_chospital(rng, hospcodes, province_code),
+        os.path.join(lookup, "chospital.parquet"),
+    )
+    budget_years: list[int] = list(range(budget_year - years + 1, budget_year + 1))
+    for year in budget_years:
+        hdcfile = HDCFiles(storage, year)
+        for pname, table in [
+            ("t_person_db", make_person(rng, hospcodes, persons, year)),
+            ("s_bench", make_summary(rng, hospcodes, year)),
+        ]:
+            path: str = hdcfile.get_path(pname=pname, hospcode=ALL_HOSPCODE)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            pq.write_table(table, path)
+
+    config_file: str = os.path.join(base_dir, "config.ini")
+    with open(config_file, "w") as f:
+        f.write(f"[storage]\nbase = {os.path.abspath(storage)}\n\n")
+        f.write(f"[s3_lookup]\ndsn = file://{os.path.abspath(lookup)}\n")
+    return dict(
+        base_dir=os.path.abspath(base_dir),
+        storage=os.path.abspath(storage),
+        lookup=os.path.abspath(lookup),
+        config=os.path.abspath(config_file),
+        hospitals=hospitals,
+        persons=persons,
+        budget_years=budget_years,
+        province_code=province_code,
+        seed=seed,
+    )
+
+
+@click.command()
+@click.argument("base_dir")
+@click.option("--hospitals", default=50, help="Number of hospitals of the province")
+@click.option("--persons", default=2000, help="Number of persons per hospital")
+@click.option("--years", default=1, help="Number of budget years")
+@click.option("--budget-year", default=2024, help="The last budget year")
+@click.option("--province-code", default="14", help="The province code")
+@click.option("--seed", default=0, help="The random seed")
+def main(
+    base_dir: str,
+    hospitals: int,
+    persons: int,
+    years: int,
+    budget_year: int,
+    province_code: str,
+    seed: int,
+):
+    info: dict = generate(
+        base_dir, hospitals, persons, years, budget_year, province_code, seed
+    )
+    for k, v in info.items():
+        print(f"{k:14}: {v}")
+
+
+if __name__ == "__main__":
+    main()
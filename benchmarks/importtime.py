@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Start-up benchmark of `hdcli build` and `hdcli convert` with `python -X importtime`.
+
+Runs each command on a small notebook and fails when the total import time is over
+the budget or when a heavy module (pandas, pyarrow, ...) is imported.
+
+    python benchmarks/importtime.py --budget-ms 200
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import click
+
+BASE_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HDCLI: str = os.path.join(BASE_DIR, "hdcli.py")
+
+# modules only the built scripts need, never imported by the cli start-up
+__HEAVY_MODULES__ = ["pandas", "numpy", "pyarrow", "sqlalchemy", "s3fs", "dacutil"]
+
+NOTEBOOK: dict = dict(
+    cells=[
+        dict(
+            cell_type="code",
+            metadata=dict(tags=["parameters"]),
+            source=["output_filename: str = 's_bench'\n"],
+        ),
+        dict(
+            cell_type="code",
+            metadata=dict(tags=["process"]),
+            source=["df = DataFrame()\n"],
+        ),
+    ],
+    metadata=dict(),
+    nbformat=4,
+    nbformat_minor=5,
+)
+
+
+def importtime(args: list[str], cwd: str) -> tuple[int, dict[str, int]]:
+    """
+    Runs a command with `-X importtime`.
+
+    Args:
+        args (list[str]): The arguments after `python -X importtime`.
+        cwd (str): The working directory.
+
+    Returns:
+        tuple[int, dict[str, int]]: The total import time in microseconds,
+            and the cumulative time of every imported module.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=cwd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        env=dict(os.environ, PYTHONPATH=BASE_DIR),
+    )
+    if result.returncode != 0:
+        raise click.ClickException(f"{' '.join(args)} failed:\n{result.stderr}")
+    total: int = 0
+    modules: dict[str, int] = dict()
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        modules[name.strip()] = int(cumulative)
+        if not name.startswith("  "):
+            total += int(cumulative)
+    return total, modules
+
+
+@click.command()
+@click.option("--budget-ms", default=200, help="Budget of the import time of each command")
+@click.option("--repeat", "-r", default=5, help="Runs of each command, the best is kept")
+def main(budget_ms: int, repeat: int):
+    failed: bool = False
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(os.path.join(tmp_dir, "s_bench.ipynb"), "w") as f:
+            json.dump(NOTEBOOK, f)
+        commands: dict[str, list[str]] = {
+            "import hdcutil": ["-c", "import hdcutil"],
+            "hdcli --help": [HDCLI, "--help"],
+            "hdcli convert": [HDCLI, "convert", "s_bench.ipynb", "-d", "convert"],
+            "hdcli build": [HDCLI, "build", "s_bench.ipynb", "-d", "build", "-j", "1", "--force"],
+        }
+        for name, args in commands.items():
+            runs = [importtime(args, tmp_dir) for _ in range(max(repeat, 1))]
+            total, modules = min(runs, key=lambda run: run[0])
+            heavy: list[str] = [m for m in __HEAVY_MODULES__ if m in modules]
+            status: str = "ok"
+            if total > budget_ms * 1000 or len(heavy) > 0:
+                status = "FAILED"
+                failed = True
+            print(f"{name:16} {total / 1000:8.1f}ms / {budget_ms}ms {status}")
+            if len(heavy) > 0:
+                print(f"{'':16} heavy modules imported: {', '.join(heavy)}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the hot paths of hdcutil on synthetic data, see generate.py.
+
+    python benchmarks/run.py --hospitals 50 --persons 2000 -o results-0.4.8.json
+    python benchmarks/run.py -o results-dev.json --compare results-0.4.8.json
+
+Every case is timed `--repeat` times, the results are written as JSON with the
+versions and the scale of the data so runs of different releases can be compared.
+A case that fails is recorded with its error and the other cases still run,
+the exit status is 1 when any case failed.
+"""
+
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+import click
+
+BASE_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HDCLI: str = os.path.join(BASE_DIR, "hdcli.py")
+sys.path.insert(0, BASE_DIR)
+
+from generate import generate  # noqa: E402
+from hdcutil import CoLookup, HDCFiles  # noqa: E402
+from hdcutil.build_process import get_version  # noqa: E402
+
+# the notebook of the by_hospcode and build benchmarks, its output is named by the file
+NOTEBOOK: dict = dict(
+    cells=[
+        dict(
+            cell_type="code",
+            metadata=dict(tags=["parameters"]),
+            source=[
+                "df_person = hdcfile.read_person_cid(columns=['HOSPCODE', 'CID', 'SEX', 'TYPEAREA'])\n",
+            ],
+        ),
+        dict(
+            cell_type="code",
+            metadata=dict(tags=["process"]),
+            source=[
+                "df = df_person.loc[(df_person['HOSPCODE'] == hospcode) & (df_person['TYPEAREA'].isin(['1', '3']))]\n",
+                "df = df.groupby(['HOSPCODE', 'SEX'], as_index=False).agg(TARGET=('CID', 'count'))\n",
+                "df['AREACODE'] = conf.PROVINCE_CODE\n",
+            ],
+        ),
+    ],
+    metadata=dict(),
+    nbformat=4,
+    nbformat_minor=5,
+)
+
+
+def measure(fn: Callable[[], object], repeat: int) -> dict:
+    """
+    Times a function.
+
+    Args:
+        fn (Callable[[], object]): The function.
+        repeat (int): Number of runs.
+
+    Returns:
+        dict: The min, median and mean seconds of the runs.
+    """
+    times: list[float] = []
+    for _ in range(max(repeat, 1)):
+        start: float = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return dict(
+        status="ok",
+        repeat=len(times),
+        min=round(min(times), 6),
+        median=round(statistics.median(times), 6),
+        mean=round(statistics.mean(times), 6),
+    )
+
+
+def run_case(results: dict, name: str, fn: Callable[[], dict]):
+    try:
+        results[name] = fn()
+    except Exception as e:
+        results[name] = dict(status="error", error=f"{type(e).__name__}: {e}")
+    r: dict = results[name]
+    if r["status"] == "ok":
+        print(
+            f"{name:28} {r['min'] * 1000:10.1f}ms min {r['median'] * 1000:10.1f}ms median",
+            file=sys.stderr,
+        )
+    else:
+        print(f"{name:28} {r['status']}: {r.get('error', '')}", file=sys.stderr)
+
+
+def start_s3(
+    lookup_dir: str, endpoint: Optional[str]
+) -> tuple[Optional[str], Optional[object]]:
+    """
+    Uploads chospital to an s3 stand-in, the given endpoint or a moto server when moto is installed.
+
+    Returns:
+        tuple[str | None, object | None]: The CoLookup uri, None without s3, and the moto server to stop.
+    """
+    server = None
+    if endpoint is None:
+        try:
+            from moto.server import ThreadedMotoServer
+        except ImportError:
+            return None, None
+        # the request log of the server would hide the results
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+        server.start()
+        host, port = server.get_host_and_port()
+        endpoint = f"http://{host}:{port}"
+    from s3fs import S3FileSystem
+
+    fs = S3FileSystem(key="bench", secret="bench", endpoint_url=endpoint)
+    if not fs.exists("bench"):
+        fs.mkdir("bench")
+    fs.put_file(
+        os.path.join(lookup_dir, "chospital.parquet"), "bench/lookup/chospital.parquet"
+    )
+    host_port: str = endpoint.split("://", 1)[1]
+    use_ssl: str = "true" if endpoint.startswith("https") else "false"
+    return f"s3://bench:bench@{host_port}/bench/lookup?use_ssl={use_ssl}", server
+
+
+def run_script(args: list[str], env: dict):
+    result = subprocess.run(
+        [sys.executable, *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        env=dict(os.environ, PYTHONPATH=BASE_DIR, **env),
+    )
+    if result.returncode != 0:
+        raise Exception(
+            f"exit code {result.returncode}: {result.stdout.strip().splitlines()[-1:]}"
+        )
+
+
+def compare(results: dict, baseline: dict):
+    print(f"{'':28} {'baseline':>12} {'current':>12} {'ratio':>8}", file=sys.stderr)
+    for name, r in results["results"].items():
+        b: Optional[dict] = baseline["results"].get(name)
+        if r["status"] != "ok" or b is None or b["status"] != "ok":
+            continue
+        ratio: float = r["min"] / b["min"] if b["min"] > 0 else float("inf")
+        print(
+            f"{name:28} {b['min'] * 1000:10.1f}ms {r['min'] * 1000:10.1f}ms {ratio:8.2f}",
+            file=sys.stderr,
+        )
+
+
+@click.command()
+@click.option(
+    "--data-dir",
+    default=None,
+    help="Directory of the synthetic data, default a temporary directory",
+)
+@click.option("--hospitals", default=50, help="Number of hospitals of the province")
+@click.option("--persons", default=2000, help="Number of persons per hospital")
+@click.option("--years", default=1, help="Number of budget years")
+@click.option("--repeat", "-r", default=5, help="Runs of each case")
+@click.option(
+    "--notebooks", default=20, help="Number of notebooks of the build benchmark"
+)
+@click.option(
+    "--s3-endpoint",
+    default=None,
+    help="Endpoint of a local s3 stand-in, default a moto server if installed",
+)
+@click.option("--output", "-o", default=None, help="JSON file of the results")
+@click.option(
+    "--compare",
+    "baseline_file",
+    default=None,
+    help="JSON results of a previous run to compare with",
+)
+def main(
+    data_dir: Optional[str],
+    hospitals: int,
+    persons: int,
+    years: int,
+    repeat: int,
+    notebooks: int,
+    s3_endpoint: Optional[str],
+    output: Optional[str],
+    baseline_file: Optional[str],
+):
+    tmp_dir: str = tempfile.mkdtemp(prefix="hdcutil-bench-")
+    try:
+        data: dict = generate(
+            data_dir or os.path.join(tmp_dir, "data"), hospitals, persons, years
+        )
+        budget_year: str = str(data["budget_years"][-1])
+        province_code: str = data["province_code"]
+        hdcfile = HDCFiles(data["storage"], budget_year)
+        hospcode: str = "10000"
+        results: dict = dict()
+
+        # HDCFiles reads
+        run_case(
+            results,
+            "read_data",
+            lambda: measure(lambda: hdcfile.read_data("t_person_db"), repeat),
+        )
+        run_case(
+            results,
+            "read_data_columns_filters",
+            lambda: measure(
+                lambda: hdcfile.read_data(
+                    "t_person_db",
+                    columns=["HOSPCODE", "CID", "SEX"],
+                    filters=[("HOSPCODE", "=", hospcode)],
+                ),
+                repeat,
+            ),
+        )
+        run_case(
+            results,
+            "read_person_cid",
+            lambda: measure(
+                lambda: hdcfile.read_person_cid(columns=["HOSPCODE", "CID"]), repeat
+            ),
+        )
+
+        # CoLookup, a new instance every call so get_chospital is not memoized in the process
+        lookup_uri: str = f"file://{data['lookup']}"
+        run_case(
+            results,
+            "get_chospital_file",
+            lambda: measure(
+                lambda: CoLookup(lookup_uri).get_chospital(
+                    province_code=province_code, columns=["STATUS", "HOSPCODE"]
+                ),
+                repeat,
+            ),
+        )
+        # the result memoized on disk by a previous process
+        memo_dir: str = os.path.join(tmp_dir, "colookup")
+        run_case(
+            results,
+            "get_chospital_memo",
+            lambda: measure(
+                lambda: CoLookup(lookup_uri, cache_dir=memo_dir).get_chospital(
+                    province_code=province_code, columns=["STATUS", "HOSPCODE"]
+                ),
+                repeat,
+            ),
+        )
+
+        def bench_s3() -> dict:
+            uri, server = start_s3(data["lookup"], s3_endpoint)
+            if uri is None:
+                return dict(
+                    status="skipped", error="no --s3-endpoint and moto is not installed"
+                )
+            try:
+                return measure(
+                    lambda: CoLookup(uri).get_chospital(
+                        province_code=province_code, columns=["STATUS", "HOSPCODE"]
+                    ),
+                    repeat,
+                )
+            finally:
+                if server is not None:
+                    server.stop()
+
+        run_case(results, "get_chospital_s3", bench_s3)
+
+        # summary table helpers, fill_column changes its input
+        df_summary = hdcfile.read_data("s_bench").drop(columns=["D_COM", "B_YEAR"])
+        run_case(
+            results,
+            "fill_column_verify_df",
+            lambda: measure(
+                lambda: hdcfile.verify_df(hdcfile.fill_column(df_summary.copy())),
+                repeat,
+            ),
+        )
+
+        # notebooks
+        dir_notebook: str = os.path.join(tmp_dir, "notebooks")
+        os.makedirs(dir_notebook)
+        for i in range(max(notebooks, 1)):
+            with open(os.path.join(dir_notebook, f"s_bench_{i:03}.ipynb"), "w") as f:
+                json.dump(NOTEBOOK, f)
+
+        dir_script: str = os.path.join(tmp_dir, "scripts")
+        run_case(
+            results,
+            "hdcli_build",
+            lambda: dict(
+                measure(
+                    lambda: run_script(
+                        [
+                            HDCLI,
+                            "build",
+                            os.path.join(dir_notebook, "*.ipynb"),
+                            "-d",
+                            dir_script,
+                            "--force",
+                        ],
+                        {},
+                    ),
+                    repeat,
+                ),
+                notebooks=max(notebooks, 1),
+            ),
+        )
+
+        env: dict = dict(
+            CONFIG_URI=data["config"],
+            BUDGET_YEAR=budget_year,
+            PROVINCE_CODE=province_code,
+        )
+
+        def bench_by_hospcode() -> dict:
+            notebook: str = os.path.join(dir_notebook, "s_bench_000.ipynb")
+            dir_by_hospcode: str = os.path.join(tmp_dir, "by_hospcode")
+            run_script([HDCLI, "build", notebook, "-d", dir_by_hospcode], {})
+            script: str = os.path.join(dir_by_hospcode, "s_bench_000.py")
+            return dict(
+                measure(lambda: run_script([script], env), max(repeat // 2, 1)),
+                hospcodes=hospitals,
+            )
+
+        run_case(results, "by_hospcode", bench_by_hospcode)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    import pandas
+    import pyarrow
+
+    report: dict = dict(
+        meta=dict(
+            hdcutil=get_version(),
+            python=platform.python_version(),
+            pandas=pandas.__version__,
+            pyarrow=pyarrow.__version__,
+            platform=platform.platform(),
+            cpu_count=os.cpu_count(),
+            timestamp=datetime.now().isoformat(),
+            repeat=repeat,
+            data=dict(
+                hospitals=hospitals,
+                persons=persons,
+                years=years,
+                rows_person=hospitals * persons,
+            ),
+        ),
+        results=results,
+    )
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results: {output}", file=sys.stderr)
+    if baseline_file is not None:
+        with open(baseline_file, "r") as f:
+            compare(report, json.load(f))
+    # a failing case must not pass as a benchmark run, skipped cases are optional
+    failed: list[str] = [k for k, r in results.items() if r["status"] == "error"]
+    if failed:
+        print(f"Failed: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,16 @@
 
 from datetime import datetime, timedelta
 import click
+import json
 import sys
 import os
-from hdcutil import build_process
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING, Callable, Optional
 from glob import glob
-from dacutil import worker
+
+# hdcutil modules are imported by the command using them, `hdcli --help` stays fast
+if TYPE_CHECKING:
+    from hdcutil import runner, tracking
 
 
 @click.group()
@@ -18,8 +23,29 @@ def cli():
 @click.command()
 @click.argument("files", nargs=-1)
 @click.option("--directory", "-d", default="./output", help="Directory output")
-@click.option("--template", "-t", default="by_hospcode", help="Template name")
-def build(files, directory: str, template: str = "by_hospcode"):
+@click.option(
+    "--template",
+    "-t",
+    default=None,
+    help="Template name (by_hospcode, by_hospcode_parallel, by_province), default by the notebook cell tag",
+)
+@click.option("--jobs", "-j", default=0, help="Number of parallel builds, 0 is cpu count")
+@click.option("--force", is_flag=True, help="Rebuild notebooks that did not change")
+@click.option(
+    "--bytecode", is_flag=True, help="Write the compiled .pyc next to each .py"
+)
+def build(
+    files,
+    directory: str,
+    template: Optional[str] = None,
+    jobs: int = 0,
+    force: bool = False,
+    bytecode: bool = False,
+):
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from hdcutil import build_process
+    from hdcutil.errors import BuildError
+
     filenames = []
     for filename in files:
         # if our shell does not do filename globbing
@@ -31,20 +57,49 @@ def build(files, directory: str, template: str = "by_hospcode"):
         print("Error: no files found", file=sys.stderr)
         sys.exit(1)
     os.makedirs(directory, exist_ok=True)
+    notebooks: list[str] = []
     for filename in filenames:
         if filename.endswith(".ipynb") is False:
             print(f"not support file: {filename}", file=sys.stderr)
             continue
-        s: str = build_process.build(filename=filename, template_name=template)
-        name: str = os.path.basename(filename)
-        if s != "":
-            path: str = os.path.join(directory, name.split(".ipynb")[0] + ".py")
-            with open(path, "w+") as f:
-                f.write(s)
-            print(f"Success: build process success, file: {path}", file=sys.stderr)
-        else:
-            print(f"Error: build process failed, file: {name}", file=sys.stderr)
-            sys.exit(1)
+        notebooks.append(filename)
+
+    # notebooks whose tagged cells, template and hdcutil version did not change are skipped
+    manifest: dict = build_process.read_manifest(directory)
+    failed: bool = False
+    with ProcessPoolExecutor(jobs or None) as pool:
+        futures = dict()
+        for filename in notebooks:
+            name: str = os.path.basename(filename).split(".ipynb")[0] + ".py"
+            future = pool.submit(
+                build_process.build_file,
+                filename,
+                directory,
+                template_name=template,
+                known_hash=None if force else manifest.get(name),
+                bytecode=bytecode,
+            )
+            futures[future] = filename
+        for future in as_completed(futures):
+            name: str = os.path.basename(futures[future])
+            try:
+                status, path, build_hash = future.result()
+            except BuildError as e:
+                print(f"Error: build process failed, {str(e)}", file=sys.stderr)
+                failed = True
+                continue
+            if status == "success":
+                manifest[os.path.basename(path)] = build_hash
+                print(f"Success: build process success, file: {path}", file=sys.stderr)
+            elif status == "skipped":
+                print(f"Skipped: build is up to date, file: {path}", file=sys.stderr)
+            else:
+                manifest.pop(os.path.basename(path), None)
+                print(f"Error: build process failed, file: {name}", file=sys.stderr)
+                failed = True
+    build_process.write_manifest(directory, manifest)
+    if failed:
+        sys.exit(1)
 
 
 @click.command("convert")
@@ -52,6 +107,8 @@ def build(files, directory: str, template: str = "by_hospcode"):
 @click.option("--directory", "-d", default="./toutput", help="Directory output")
 @click.option("--clear", is_flag=True, help="Clear directory output")
 def convert(files, directory: str, clear: bool = False):
+    from hdcutil import build_process
+
     # print(file_glob)
     filenames = []
     for filename in files:
@@ -88,7 +145,57 @@ def convert(files, directory: str, clear: bool = False):
 @click.command("run")
 @click.argument("files", nargs=-1)
 @click.option("workers", "-w", default=1, help="Number of workers")
-def run(files, workers: int = 1):
+@click.option(
+    "--warm",
+    is_flag=True,
+    help="Run scripts forked from warm workers with heavy modules imported once",
+)
+@click.option(
+    "--log-dir", default=None, help="Directory to capture stdout/stderr of each script"
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Skip scripts whose inputs and content did not change since their last run",
+)
+@click.option(
+    "--state-file", default=".hdcli-run.json", help="State file of --incremental"
+)
+@click.option(
+    "--metrics-dir",
+    default=None,
+    help="Directory of the metrics of each script, aggregated to report.json in a directory per run",
+)
+@click.option(
+    "--shared-cache-dir",
+    default=None,
+    help="Local directory of the memory-mapped input tables shared by the scripts, requires --shared-cache-pnames",
+)
+@click.option(
+    "--shared-cache-pnames",
+    default=None,
+    help="Comma separated pname of the tables in --shared-cache-dir, e.g. t_person_db,t_home; "
+    "they are mapped whole and filtered in memory, cache the tables most scripts read whole",
+)
+@click.option(
+    "--checkpoint-dir",
+    default=None,
+    help="Directory of the per-hospcode checkpoints, a rerun resumes the hospcodes a failed run completed",
+)
+def run(
+    files,
+    workers: int = 1,
+    warm: bool = False,
+    log_dir: Optional[str] = None,
+    incremental: bool = False,
+    state_file: str = ".hdcli-run.json",
+    metrics_dir: Optional[str] = None,
+    shared_cache_dir: Optional[str] = None,
+    shared_cache_pnames: Optional[str] = None,
+    checkpoint_dir: Optional[str] = None,
+):
+    from hdcutil import metrics, runner, scheduler, tracking
+
     filenames = []
     for filename in files:
         # if our shell does not do filename globbing
@@ -99,23 +206,119 @@ def run(files, workers: int = 1):
     if len(filenames) == 0:
         print("Error: no files found", file=sys.stderr)
         sys.exit(1)
-    if workers == 1:
-        for file in filenames:
-            executable_py(file)
-    else:
-        args = []
-        for file in filenames:
-            args.append({"filename": file})
-        worker(workers, executable_py, args)
+    # scripts reading the output_filename of other scripts run after them
+    try:
+        graph = scheduler.build_graph(filenames)
+    except Exception as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+    # the metrics of this run, the files of earlier runs are never aggregated
+    run_id: str = metrics.new_run_id()
+    os.environ[metrics.RUN_ID_ENV] = run_id
+    if metrics_dir is not None:
+        metrics_dir = os.path.join(metrics_dir, run_id)
+    if shared_cache_dir is not None:
+        # tables are cached uncompressed, only the tables named are cached to bound the disk used
+        pnames: list[str] = [
+            p.strip() for p in (shared_cache_pnames or "").split(",") if p.strip()
+        ]
+        if len(pnames) == 0:
+            raise click.BadParameter(
+                "--shared-cache-dir requires the tables to cache, e.g. --shared-cache-pnames t_person_db",
+                param_hint="--shared-cache-pnames",
+            )
+        # read by the templates, inherited by every script and warm worker
+        os.environ["HDCFILES_SHARED_CACHE_DIR"] = os.path.abspath(shared_cache_dir)
+        os.environ["HDCFILES_SHARED_CACHE_PNAMES"] = ",".join(pnames)
+    if checkpoint_dir is not None:
+        # read by the templates, see hdcutil.checkpoint.CHECKPOINT_ENV
+        os.environ["HDCUTIL_CHECKPOINT_DIR"] = os.path.abspath(checkpoint_dir)
+    state: Optional["tracking.RunState"] = None
+    if incremental:
+        state = tracking.RunState(state_file, get_etag=get_lookup_etag)
+    # warm workers are forked before the scheduler starts its threads
+    pool: Optional["runner.WarmPool"] = runner.WarmPool(workers) if warm else None
+    try:
+        results = scheduler.run_graph(
+            graph,
+            partial(
+                executable_py,
+                run_script=runner.run_script if pool is None else pool.run_script,
+                log_dir=log_dir,
+                state=state,
+                metrics_dir=metrics_dir,
+            ),
+            workers=workers,
+        )
+    finally:
+        if pool is not None:
+            pool.close()
+    for filename, exit_code in results.items():
+        if exit_code is None:
+            print(f"Skipped Filename: {filename}, dependency failed", file=sys.stderr)
+
+    if metrics_dir is not None:
+        # None is a script skipped because a dependency failed
+        exit_codes: dict = {
+            get_metrics_file(f, metrics_dir): code for f, code in results.items()
+        }
+        report: dict = metrics.aggregate(
+            [p for p in exit_codes if os.path.exists(p)], run_id=run_id
+        )
+        for run_record in report["runs"]:
+            run_record["exit_code"] = exit_codes[run_record["metrics_file"]]
+        report_path: str = os.path.join(metrics_dir, "report.json")
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        totals: dict = report["totals"]
+        print(
+            f"Metrics: {report_path}, scripts: {totals['scripts']}, "
+            f"hospcodes: {totals['hospcodes']}, error: {totals['error']}, "
+            f"rows: {totals['rows_in']:,} in / {totals['rows_out']:,} out, "
+            f"output: {totals['output_bytes'] / 1024 / 1024:.2f}MB",
+            file=sys.stderr,
+        )
 
     sys.exit(0)
 
 
-def executable_py(filename: str):
+def get_metrics_file(filename: str, metrics_dir: str) -> str:
+    name: str = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(metrics_dir, f"{name}.metrics.jsonl")
+
+
+def executable_py(
+    filename: str,
+    run_script: Optional[Callable[..., int]] = None,
+    log_dir: Optional[str] = None,
+    state: Optional["tracking.RunState"] = None,
+    metrics_dir: Optional[str] = None,
+) -> int:
+    from hdcutil import metrics, runner, tracking
+
+    if run_script is None:
+        run_script = runner.run_script
+    env: Optional[dict] = None
+    if metrics_dir is not None:
+        os.makedirs(metrics_dir, exist_ok=True)
+        env = {metrics.METRICS_ENV: os.path.abspath(get_metrics_file(filename, metrics_dir))}
+    if state is not None:
+        # checked when the script is due, after the scripts it depends on ran
+        must_run, reason = state.check(filename)
+        if not must_run:
+            print(f"Up-to-date Filename: {filename}, {reason}", file=sys.stderr)
+            return 0
+        print(f"Outdated Filename: {filename}, {reason}", file=sys.stderr)
+        key: str = tracking.script_key(filename)
+        trace_file: str = state.new_trace_file()
+        env = dict(env or {}, **{tracking.TRACE_ENV: trace_file})
+
     dt: datetime = datetime.now()
     print(f"Starting Filename: {filename}", file=sys.stderr)
     print(f"{sys.executable} {filename}", file=sys.stderr)
-    exit_code: int = os.system(f"{sys.executable} {filename}")
+    exit_code: int = run_script(filename, log_dir=log_dir, env=env)
+    if state is not None:
+        state.update(filename, key, trace_file, exit_code)
 
     deltatime: timedelta = datetime.now() - dt
     if exit_code == 0:
@@ -125,6 +328,22 @@ def executable_py(filename: str):
             f"Failed[{exit_code}] Filename: {filename}, Dulation: {deltatime}",
             file=sys.stderr,
         )
+    return exit_code
+
+
+@lru_cache(maxsize=None)
+def _get_colookup():
+    # the lookup storage of the built scripts, see the template
+    from dacutil import get_config
+    from hdcutil import CoLookup
+
+    conf = get_config(os.getenv("CONFIG_URI", "config.ini"))
+    return CoLookup(conf.s3_lookup.dsn)
+
+
+def get_lookup_etag(path: str) -> str:
+    info: dict = _get_colookup().fs.info(path, refresh=True)
+    return str(info.get("ETag", "")).strip('"')
 
 
 cli.add_command(build)
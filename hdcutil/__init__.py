@@ -1,7 +1,32 @@
-from .colookup import CoLookup
-from .hdcfile import HDCFiles, init_pandas_options, ALL_HOSPCODE
+from importlib import import_module
+from typing import TYPE_CHECKING, Any
+
 from .errors import IgnoreEmptyDataFrame, EmptyDataFrame
 
+if TYPE_CHECKING:
+    from .colookup import CoLookup
+    from .hdcfile import HDCFiles, init_pandas_options, ALL_HOSPCODE
+
+# attributes importing pandas/pyarrow, loaded on first access (PEP 562)
+__LAZY_ATTRIBUTES__ = {
+    "init_pandas_options": ".hdcfile",
+    "CoLookup": ".colookup",
+    "HDCFiles": ".hdcfile",
+    "ALL_HOSPCODE": ".hdcfile",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name in __LAZY_ATTRIBUTES__:
+        value = getattr(import_module(__LAZY_ATTRIBUTES__[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> list[str]:
+    return sorted(list(globals().keys()) + list(__LAZY_ATTRIBUTES__.keys()))
+
 
 __all__ = [
     "init_pandas_options",
@@ -1,8 +1,18 @@
+import ast
+import hashlib
 import json
 import os
+import re
 import shutil
+import tempfile
+import py_compile
+from functools import lru_cache
+from types import CodeType
+from typing import Optional
 from click import FileError
 
+from .errors import BuildError
+
 
 __IGNORED_PARAMETERS__ = [
     "budget_year",
@@ -17,38 +27,200 @@ __IGNORED_PARAMETERS__ = [
 ]
 
 
-def build(filename: str, *, template_name: str = "by_hospcode") -> str:
-    jpy: dict = read_ipynb(filename)
+# notebook cell tag of processing code -> template used when no template is given
+__PROCESS_TAGS__ = {
+    "process": "by_hospcode",
+    "province": "by_province",
+}
+
+
+def build(filename: str, *, template_name: Optional[str] = None) -> str:
     name: str = filename.split(".ipynb")[0]
     name = os.path.basename(name)
+    data, tag_template = read_cells(filename)
+    if len(data["process"]) == 0:
+        return ""
+    # if len(data["parameters"]) == 0:
+
+    data["parameters"] = filter_parameter(data["parameters"], name)
+    template: Template = load_template(template_name or tag_template)
+    pyscript, origins = template.render(data)
+    compile_script(pyscript, origins, filename)
+    return pyscript
+
+
+def read_cells(filename: str) -> tuple[dict, str]:
+    """
+    Reads the tagged code cells of a notebook.
+
+    Args:
+        filename (str): The notebook.
+
+    Returns:
+        tuple[dict, str]: The sources of the "parameters" and "process" cells,
+            and the template of the process cell tag.
+    """
+    jpy: dict = read_ipynb(filename)
     data = dict(parameters=[], process=[])
+    tag_template: str = "by_hospcode"
     for i, v in enumerate(jpy["cells"]):
         if v["cell_type"] == "code":
             if "tags" in v["metadata"]:
                 tags = v["metadata"]["tags"]
-                if "process" in tags:
+                source = v["source"]
+                if isinstance(source, str):
+                    source = source.splitlines(keepends=True)
+                # remember the cell and line of every line to report build errors
+                source = [SourceLine(line, i + 1, n + 1) for n, line in enumerate(source)]
+                process_tags = [t for t in tags if t in __PROCESS_TAGS__]
+                if len(process_tags) > 0:
                     # print(i, "process")
-                    data["process"] += v["source"]
+                    data["process"] += source
+                    tag_template = __PROCESS_TAGS__[process_tags[0]]
                 elif True in [t in ["parameters", "param", "params"] for t in tags]:
                     # print(i, "parameters")
-                    data["parameters"] += v["source"]
-    if len(data["process"]) == 0:
-        return ""
-    # if len(data["parameters"]) == 0:
+                    data["parameters"] += source
+    return data, tag_template
+
+
+def build_file(
+    filename: str,
+    directory: str,
+    *,
+    template_name: Optional[str] = None,
+    known_hash: Optional[str] = None,
+    bytecode: bool = False,
+) -> tuple[str, str, str]:
+    """
+    Builds a notebook to `{directory}/{name}.py`, skipped when the hash of its tagged cells,
+    template and hdcutil version equals known_hash and the output exists.
+    The output is validated, written to a temporary file and renamed into place.
+
+    Args:
+        filename (str): The notebook.
+        directory (str): The output directory.
+        template_name (str, optional): The template name. Defaults to None is by the cell tag.
+        known_hash (str, optional): The hash of the previous build. Defaults to None is always build.
+        bytecode (bool, optional): Also write the compiled `{name}.pyc` next to the output. Defaults to False.
+
+    Raises:
+        BuildError: If the built script has a syntax error.
 
+    Returns:
+        tuple[str, str, str]: The status ("success", "skipped" or "failed"), the output path and the build hash.
+    """
+    name: str = os.path.basename(filename.split(".ipynb")[0])
+    path: str = os.path.join(directory, name + ".py")
+    path_pyc: str = os.path.join(directory, name + ".pyc")
+    data, tag_template = read_cells(filename)
+    template: Template = load_template(template_name or tag_template)
+
+    h = hashlib.sha256()
+    h.update(get_version().encode())
+    h.update(json.dumps(data, sort_keys=True).encode())
+    h.update(template.text.encode())
+    build_hash: str = h.hexdigest()
+    if (
+        build_hash == known_hash
+        and os.path.exists(path)
+        and (not bytecode or os.path.exists(path_pyc))
+    ):
+        return "skipped", path, build_hash
+
+    if len(data["process"]) == 0:
+        return "failed", path, build_hash
     data["parameters"] = filter_parameter(data["parameters"], name)
-    template: list[str] = get_template_lines(template_name)
-    pyscript: str = format_template(template, data)
-    return pyscript
+    pyscript, origins = template.render(data)
+    compile_script(pyscript, origins, filename)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(pyscript)
+    os.chmod(tmp_path, get_file_mode())
+    os.replace(tmp_path, path)
+    if bytecode:
+        py_compile.compile(path, cfile=path_pyc, doraise=True)
+    elif os.path.exists(path_pyc):
+        os.remove(path_pyc)
+    return "success", path, build_hash
+
+
+@lru_cache(maxsize=None)
+def get_file_mode() -> int:
+    """
+    Returns the mode of a new file under the umask, mkstemp creates its files 0600.
+    """
+    umask: int = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+__MANIFEST_FILENAME__ = ".hdcli-build.json"
+
+
+def read_manifest(directory: str) -> dict:
+    """
+    Reads the build manifest of an output directory.
+
+    Args:
+        directory (str): The output directory.
+
+    Returns:
+        dict: The build hash of each output file name, empty if there is no manifest.
+    """
+    try:
+        with open(os.path.join(directory, __MANIFEST_FILENAME__), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def write_manifest(directory: str, manifest: dict):
+    """
+    Writes the build manifest of an output directory atomically.
+
+    Args:
+        directory (str): The output directory.
+        manifest (dict): The build hash of each output file name.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.chmod(tmp_path, get_file_mode())
+    os.replace(tmp_path, os.path.join(directory, __MANIFEST_FILENAME__))
+
+
+def get_version() -> str:
+    # importlib.metadata is slow to import, only needed when building
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("hdcutil")
+    except PackageNotFoundError:
+        return "dev"
 
 
 def get_template_lines(template_name: str = "by_hospcode") -> list[str]:
+    return load_template(template_name).lines
+
+
+@lru_cache(maxsize=None)
+def load_template(template_name: str = "by_hospcode") -> "Template":
+    """
+    Reads and parses a template once per process.
+
+    Args:
+        template_name (str, optional): The template name, by_hospcode if not found. Defaults to "by_hospcode".
+
+    Returns:
+        Template: The parsed template.
+    """
     base_dir: str = os.path.dirname(os.path.abspath(__file__))
     template_file: str = base_dir + f"/template/{template_name}.py"
     if os.path.exists(template_file) is False:
         template_file: str = base_dir + "/template/by_hospcode.py"
     with open(template_file, "r") as f:
-        return f.readlines()
+        return Template(f.readlines())
 
 
 def read_ipynb(filename: str) -> dict:
@@ -58,38 +230,290 @@ def read_ipynb(filename: str) -> dict:
         return json.load(f)
 
 
+class SourceLine(str):
+    """
+    A line of a notebook cell that remembers its cell and line number (1-based).
+    """
+
+    def __new__(cls, value: str, cell: int, line: int):
+        obj = str.__new__(cls, value)
+        obj.cell = cell
+        obj.line = line
+        return obj
+
+
+# placeholder in the template -> key of the code in data
+__TEMPLATE_SLOTS__ = {
+    "__PYSCRIPT_PARAMETERS__": "parameters",
+    "__PROCESSING_CODE__": "process",
+}
+
+
+class Template:
+    def __init__(self, lines: list[str]):
+        """
+        A template parsed into text segments and code slots.
+
+        Args:
+            lines (list[str]): The lines of the template.
+
+        Returns:
+            None
+        """
+        self.lines: list[str] = list(lines)
+        self.text: str = "".join(lines)
+        # (slot or None, text, indent of the slot, first template line number)
+        self.segments: list[tuple[Optional[str], str, str, int]] = []
+        chunk: list[str] = []
+        chunk_start: int = 1
+        for n, line in enumerate(lines, start=1):
+            placeholder = next((p for p in __TEMPLATE_SLOTS__ if p in line), None)
+            if placeholder is None:
+                if len(chunk) == 0:
+                    chunk_start = n
+                chunk.append(line)
+                continue
+            if len(chunk) > 0:
+                self.segments.append((None, "".join(chunk), "", chunk_start))
+                chunk = []
+            indent: str = line[: line.index(placeholder)]
+            self.segments.append((__TEMPLATE_SLOTS__[placeholder], line, indent, n))
+        if len(chunk) > 0:
+            self.segments.append((None, "".join(chunk), "", chunk_start))
+
+    def render(self, data: dict) -> tuple[str, list[str]]:
+        """
+        Fills the code slots, the code is indented as its placeholder.
+
+        Args:
+            data (dict): The lines of each slot, "parameters" and "process".
+
+        Returns:
+            tuple[str, list[str]]: The script and the origin of each of its lines,
+                "cell C line L" or "template line N".
+        """
+        parts: list[str] = []
+        origins: list[str] = []
+
+        def add(text: str, origin: str):
+            parts.append(text)
+            origins.extend([origin] * text.count("\n"))
+
+        for slot, text, indent, start in self.segments:
+            if slot is None:
+                parts.append(text)
+                origins.extend(
+                    f"template line {start + k}" for k in range(text.count("\n"))
+                )
+                continue
+            add(text + "\n", f"template line {start}")
+            for line in data[slot]:
+                if isinstance(line, SourceLine):
+                    origin: str = f"cell {line.cell} line {line.line}"
+                else:
+                    origin = f"generated {slot}"
+                add(indent + line if line.endswith("\n") else indent + line + "\n", origin)
+            add("\n\n", f"template line {start}")
+        return "".join(parts), origins
+
+
 def format_template(template: list[str], data: dict) -> str:
-    s: str = ""
-    for line in template:
-        if "__PYSCRIPT_PARAMETERS__" in line:
-            line += "\n"
-            pos_index: int = line.index("__PYSCRIPT_PARAMETERS__")
-            spaces: str = ""
-            if pos_index > 0:
-                spaces: str = line[:pos_index]
-            line += format_lines(data["parameters"], spaces)
-            line += "\n"
-        if "__PROCESSING_CODE__" in line:
-            line += "\n"
-            pos_index: int = line.index("__PROCESSING_CODE__")
-            spaces: str = ""
-            if pos_index > 0:
-                spaces: str = line[:pos_index]
-            line += format_lines(data["process"], spaces)
-            line += "\n"
-
-        s = s + line
-    return s
-
-
-def format_lines(list_line: list[str], spaces: str = "") -> str:
-    strs: str = ""
-    for line in list_line:
-        strs += spaces + line
-        if not line.endswith("\n"):
-            strs += "\n"
-    strs += "\n"
-    return strs
+    return Template(template).render(data)[0]
+
+
+def compile_script(source: str, origins: list[str], filename: str) -> CodeType:
+    """
+    Compiles a built script to validate it. When the processing code runs in the function
+    of a parallel template, code that only works in the loop of by_hospcode is rejected, see check_process_function.
+
+    Args:
+        source (str): The script.
+        origins (list[str]): The origin of each line, see Template.render.
+        filename (str): The notebook, for the error message.
+
+    Raises:
+        BuildError: If the script has a syntax error or unsupported processing code, with the notebook cell and line.
+
+    Returns:
+        CodeType: The compiled code.
+    """
+
+    def where(lineno: int) -> str:
+        if 0 < lineno <= len(origins):
+            return origins[lineno - 1]
+        return f"line {lineno}"
+
+    try:
+        tree: ast.Module = ast.parse(source, filename)
+    except SyntaxError as e:
+        raise BuildError(
+            f"{filename}: {where(e.lineno or 0)}: {e.msg}: {(e.text or '').strip()}"
+        )
+    for lineno, msg in check_process_function(tree, origins):
+        raise BuildError(f"{filename}: {where(lineno)}: {msg}")
+    try:
+        return compile(tree, filename, "exec", dont_inherit=True)
+    except SyntaxError as e:
+        raise BuildError(
+            f"{filename}: {where(e.lineno or 0)}: {e.msg}: {(e.text or '').strip()}"
+        )
+
+
+# the function of by_hospcode_parallel running the processing code of one hospcode
+__PROCESS_FUNCTION__ = "_process_hospcode"
+# methods changing their object in place
+__MUTATING_METHODS__ = [
+    "append",
+    "extend",
+    "insert",
+    "update",
+    "add",
+    "setdefault",
+    "remove",
+    "discard",
+    "clear",
+    "popitem",
+]
+
+
+def check_process_function(
+    tree: ast.Module, origins: list[str]
+) -> list[tuple[int, str]]:
+    """
+    Finds processing code that works in the for loop of by_hospcode but not in the
+    function of by_hospcode_parallel, which runs every hospcode in a forked worker:
+
+    - `continue` and `break` outside a loop of the processing code, a SyntaxError in a function.
+    - `global` and `nonlocal`, the changes stay in the worker.
+    - assigning a module-level name, an UnboundLocalError or a local variable in a function.
+    - changing a module-level object, e.g. `results.append(df)`, the changes stay in the worker
+      so nothing is accumulated across hospcodes.
+
+    Args:
+        tree (ast.Module): The built script.
+        origins (list[str]): The origin of each line, see Template.render.
+
+    Returns:
+        list[tuple[int, str]]: The line and the message of every unsupported statement, empty for other templates.
+    """
+    function: Optional[ast.FunctionDef] = next(
+        (
+            node
+            for node in tree.body
+            if isinstance(node, ast.FunctionDef) and node.name == __PROCESS_FUNCTION__
+        ),
+        None,
+    )
+    if function is None:
+        return []
+
+    def is_process(node: ast.AST) -> bool:
+        # processing code comes from a notebook cell, the rest of the function from the template
+        lineno: int = getattr(node, "lineno", 0)
+        return 0 < lineno <= len(origins) and origins[lineno - 1].startswith("cell")
+
+    module_names: set[str] = set()
+    for stmt in tree.body:
+        if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            module_names.add(stmt.name)
+            continue
+        for node in ast.walk(stmt):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+                module_names.add(node.id)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                module_names.update(
+                    (a.asname or a.name).split(".")[0] for a in node.names
+                )
+    # names of the function assigned by the template are local before the processing code runs
+    local_names: set[str] = {a.arg for a in function.args.args}
+    for node in ast.walk(function):
+        if (
+            isinstance(node, ast.Name)
+            and isinstance(node.ctx, ast.Store)
+            and not is_process(node)
+        ):
+            local_names.add(node.id)
+    shared: set[str] = module_names - local_names
+
+    def base_name(node: ast.AST) -> Optional[str]:
+        while isinstance(node, (ast.Attribute, ast.Subscript)):
+            node = node.value
+        return node.id if isinstance(node, ast.Name) else None
+
+    errors: list[tuple[int, str]] = []
+    template: str = "the by_hospcode_parallel template"
+
+    def visit(node: ast.AST, in_loop: bool):
+        if isinstance(
+            node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)
+        ):
+            return
+        if is_process(node):
+            if isinstance(node, (ast.Continue, ast.Break)) and not in_loop:
+                keyword: str = "continue" if isinstance(node, ast.Continue) else "break"
+                errors.append(
+                    (
+                        node.lineno,
+                        f"'{keyword}' is not supported by {template}, raise IgnoreEmptyDataFrame to skip a hospcode",
+                    )
+                )
+            elif isinstance(node, (ast.Global, ast.Nonlocal)):
+                errors.append(
+                    (
+                        node.lineno,
+                        f"'{', '.join(node.names)}' can not be shared across hospcodes by {template}",
+                    )
+                )
+            elif (
+                isinstance(node, ast.Name)
+                and isinstance(node.ctx, (ast.Store, ast.Del))
+                and node.id in shared
+            ):
+                errors.append(
+                    (
+                        node.lineno,
+                        f"'{node.id}' is defined outside the processing code and can not be assigned by {template}, use a new name",
+                    )
+                )
+            elif (
+                isinstance(node, (ast.Attribute, ast.Subscript))
+                and isinstance(node.ctx, (ast.Store, ast.Del))
+                and base_name(node) in shared
+            ):
+                errors.append(
+                    (
+                        node.lineno,
+                        f"'{base_name(node)}' is defined outside the processing code and can not be changed by {template}",
+                    )
+                )
+            elif (
+                isinstance(node, ast.Call)
+                and isinstance(node.func, ast.Attribute)
+                and node.func.attr in __MUTATING_METHODS__
+                and isinstance(node.func.value, ast.Name)
+                and node.func.value.id in shared
+            ):
+                errors.append(
+                    (
+                        node.lineno,
+                        f"'{node.func.value.id}.{node.func.attr}' changes an object defined outside the processing code, "
+                        f"the change is not shared across hospcodes by {template}",
+                    )
+                )
+        loop: bool = in_loop or isinstance(node, (ast.For, ast.AsyncFor, ast.While))
+        for child in ast.iter_child_nodes(node):
+            # the else of a loop is not in the loop
+            if (
+                isinstance(node, (ast.For, ast.AsyncFor, ast.While))
+                and child in node.orelse
+            ):
+                visit(child, in_loop)
+            else:
+                visit(child, loop)
+
+    for stmt in function.body:
+        visit(stmt, False)
+    return sorted(errors)
 
 
 def filter_parameter(parameters: list, name: str):
@@ -110,6 +534,79 @@ def filter_parameter(parameters: list, name: str):
     return params
 
 
+# HDCFiles methods reading a pname given as the first argument
+__READ_METHODS__ = ["read_data", "read_table", "read_grouped", "iter_batches"]
+# HDCFiles methods reading a fixed pname
+__READ_PERSON_METHODS__ = ["read_person_db", "read_person_cid"]
+# HDCFiles methods reading a list of pname or (pname, hospcode, budget_year) given as the first argument
+__READ_MANY_METHODS__ = ["read_many", "read_many_table"]
+# HDCFiles methods reading the pname named in the sql given as the first argument, or in pnames
+__QUERY_METHODS__ = ["query"]
+__QUERY_TABLE_PATTERN__ = re.compile(
+    r"\b(?:FROM|JOIN)\s+\"?([A-Za-z_][A-Za-z0-9_]*)\"?", flags=re.IGNORECASE
+)
+
+
+def read_dependencies(source: str) -> tuple[str, set[str]]:
+    """
+    Finds the output and the inputs of a built script from its source.
+
+    Args:
+        source (str): The source of the built script.
+
+    Returns:
+        tuple[str, set[str]]: The output_filename and the set of pname read with HDCFiles,
+            only pname given as string literals are found.
+    """
+    output_filename: str = ""
+    inputs: set[str] = set()
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            names = [t.id for t in targets if isinstance(t, ast.Name)]
+            if "output_filename" in names and isinstance(node.value, ast.Constant):
+                # the parameters cell is after the template default
+                if node.value.value != "filename_not_define":
+                    output_filename = str(node.value.value)
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            if node.func.attr in __READ_PERSON_METHODS__:
+                inputs.add("t_person_db")
+            elif node.func.attr in __READ_METHODS__:
+                args = list(node.args[:1]) + [
+                    k.value for k in node.keywords if k.arg == "pname"
+                ]
+                for arg in args:
+                    if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                        inputs.add(arg.value)
+            elif node.func.attr in __READ_MANY_METHODS__:
+                args = list(node.args[:1]) + [
+                    k.value for k in node.keywords if k.arg == "sources"
+                ]
+                for arg in args:
+                    if not isinstance(arg, (ast.List, ast.Tuple)):
+                        continue
+                    for source in arg.elts:
+                        if isinstance(source, ast.Tuple) and len(source.elts) > 0:
+                            source = source.elts[0]
+                        if isinstance(source, ast.Constant) and isinstance(
+                            source.value, str
+                        ):
+                            inputs.add(source.value)
+            elif node.func.attr in __QUERY_METHODS__:
+                for arg in node.args[:1]:
+                    if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                        inputs.update(__QUERY_TABLE_PATTERN__.findall(arg.value))
+                for k in node.keywords:
+                    if k.arg == "pnames" and isinstance(k.value, (ast.List, ast.Tuple)):
+                        inputs.update(
+                            e.value
+                            for e in k.value.elts
+                            if isinstance(e, ast.Constant) and isinstance(e.value, str)
+                        )
+    inputs.discard(output_filename)
+    return output_filename, inputs
+
+
 def remove_all(folder: str):
     for filename in os.listdir(folder):
         file_path = os.path.join(folder, filename)
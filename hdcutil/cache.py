@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+from collections import OrderedDict
+from glob import glob
+from threading import Lock
+from typing import Any, Callable, Hashable, List, Optional, Tuple
+
+import pyarrow as pa
+
+# not available on windows, concurrent processes may then build the same file
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class LRUCache:
+    def __init__(self, max_bytes: int):
+        """
+        Initializes a memory-bounded LRU cache.
+
+        Args:
+            max_bytes (int): The byte budget of the cache, least recently used items are evicted above it.
+
+        Returns:
+            None
+        """
+        self.MAX_BYTES = int(max_bytes)
+        self._items: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock = Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Returns the cached value for a key and marks it as recently used.
+
+        Args:
+            key (Hashable): The cache key.
+
+        Returns:
+            Any: The cached value, None if the key is not cached.
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value: Any, nbytes: int) -> bool:
+        """
+        Stores a value and evicts the least recently used items until the budget fits.
+
+        Args:
+            key (Hashable): The cache key.
+            value (Any): The value to store.
+            nbytes (int): The size of the value in bytes.
+
+        Returns:
+            bool: True if the value is cached, False if it is larger than the budget.
+        """
+        if nbytes > self.MAX_BYTES:
+            return False
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key)[1]
+            while self._items and self.nbytes + nbytes > self.MAX_BYTES:
+                _, (_, size) = self._items.popitem(last=False)
+                self.nbytes -= size
+                self.evictions += 1
+                self.evicted_bytes += size
+            self._items[key] = (value, nbytes)
+            self.nbytes += nbytes
+        return True
+
+    def clear(self):
+        """
+        Removes all items from the cache, counters are kept.
+        """
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+    def info(self) -> dict:
+        """
+        Returns the counters of the cache.
+
+        Returns:
+            dict: hits, misses, evictions, evicted_bytes, items, nbytes and max_bytes.
+        """
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                evicted_bytes=self.evicted_bytes,
+                items=len(self._items),
+                nbytes=self.nbytes,
+                max_bytes=self.MAX_BYTES,
+            )
+
+
+class SharedTableCache:
+    def __init__(self, cache_dir: str):
+        """
+        Initializes a cache of tables shared by processes through memory-mapped Arrow IPC files.
+        A table is decoded once into an uncompressed file, every process then maps it zero-copy
+        and the OS page cache holds a single copy for all of them.
+
+        Args:
+            cache_dir (str): The local directory of the cached files.
+
+        Returns:
+            None
+        """
+        self.CACHE_DIR = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self,
+        name: str,
+        sources: List[Tuple[str, int, int]],
+        load: Callable[[], pa.Table],
+    ) -> pa.Table:
+        """
+        Returns the memory-mapped table of name, built with load when the sources changed.
+
+        Args:
+            name (str): The name of the table, e.g. "t_person_db__all__2024".
+            sources (List[Tuple[str, int, int]]): The path, mtime_ns and size of the source files.
+            load (Callable[[], pa.Table]): Reads the table from its sources.
+
+        Returns:
+            pa.Table: The table, its buffers are backed by the mapped file.
+        """
+        name = re.sub(r"[^0-9A-Za-z_.-]", "_", name)
+        key: str = hashlib.sha1(json.dumps(sources).encode()).hexdigest()[:16]
+        path: str = os.path.join(self.CACHE_DIR, f"{name}.{key}.arrow")
+        # opened first, the file can be removed by another process at any time
+        try:
+            table: pa.Table = self._open(path)
+            with self._lock:
+                self.hits += 1
+            return table
+        except FileNotFoundError:
+            pass
+
+        with open(os.path.join(self.CACHE_DIR, f"{name}.lock"), "w") as lock_file:
+            # one process builds the file, the others wait and map it
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                table = self._open(path)
+                with self._lock:
+                    self.hits += 1
+                return table
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self.misses += 1
+            self._write(path, load())
+            # previous versions, processes mapping them keep their pages until they exit
+            for old_path in glob(os.path.join(self.CACHE_DIR, f"{name}.*.arrow")):
+                if old_path != path:
+                    try:
+                        os.remove(old_path)
+                    except OSError:
+                        pass
+            # versions are only removed under the lock, the new file is still there
+            return self._open(path)
+
+    def _write(self, path: str, table: pa.Table):
+        fd, tmp_path = tempfile.mkstemp(dir=self.CACHE_DIR, suffix=".tmp")
+        os.close(fd)
+        try:
+            # uncompressed, so the mapped buffers are used as is
+            with pa.OSFile(tmp_path, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _open(self, path: str) -> pa.Table:
+        # the buffers keep the mapping alive after the file object is gone
+        return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+    def clear(self):
+        """
+        Removes the cached files, tables already mapped stay readable.
+        """
+        for path in glob(os.path.join(self.CACHE_DIR, "*.arrow")):
+            os.remove(path)
+
+    def info(self) -> dict:
+        """
+        Returns the counters of the cache.
+
+        Returns:
+            dict: hits, misses, files and nbytes of the cache directory.
+        """
+        paths: List[str] = glob(os.path.join(self.CACHE_DIR, "*.arrow"))
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                files=len(paths),
+                nbytes=sum(os.path.getsize(p) for p in paths if os.path.exists(p)),
+                cache_dir=self.CACHE_DIR,
+            )
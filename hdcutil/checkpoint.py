@@ -0,0 +1,159 @@
+import hashlib
+import os
+import re
+import shutil
+import sys
+from logging import warning
+from typing import Dict, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas import ArrowDtype, DataFrame
+
+# set by `hdcli run --checkpoint-dir`, the directory of the checkpoints of the templates
+CHECKPOINT_ENV = "HDCUTIL_CHECKPOINT_DIR"
+
+
+def get_script_hash(path: str) -> str:
+    """
+    Returns the sha1 of the content of a script.
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Checkpoint:
+    def __init__(
+        self,
+        base_dir: str,
+        output_filename: str,
+        budget_year: str,
+        province_code: str,
+        script: Optional[str] = None,
+    ):
+        """
+        Spills the result of every completed hospcode of a per-hospcode script, so a rerun after
+        a crash skips the completed hospcodes. The run directory is keyed by the output, the budget
+        year, the province and the hash of the content of the script, a changed script starts again
+        from the first hospcode. It is removed when the output is complete.
+
+            {base_dir}/{output_filename}_{budget_year}_{province_code}_{script_hash}/{hospcode}.parquet
+            {base_dir}/{output_filename}_{budget_year}_{province_code}_{script_hash}/{hospcode}.ignore
+
+        Args:
+            base_dir (str): The directory of the run directories.
+            output_filename (str): The output_filename of the script.
+            budget_year (str): The budget year of the run.
+            province_code (str): The province of the run.
+            script (str, optional): The path of the running script. Defaults to None is sys.argv[0].
+
+        Returns:
+            None
+        """
+        self.SCRIPT_HASH: str = get_script_hash(script or sys.argv[0])[:16]
+        name: str = f"{output_filename}_{budget_year}_{province_code}"
+        self.RUN_DIR: str = os.path.join(base_dir, f"{name}_{self.SCRIPT_HASH}")
+        os.makedirs(base_dir, exist_ok=True)
+        # the parts of other versions of the script are never resumed
+        pattern = re.compile(re.escape(name) + r"_[0-9a-f]{16}")
+        for path_dir in os.listdir(base_dir):
+            if pattern.fullmatch(path_dir) and path_dir != os.path.basename(
+                self.RUN_DIR
+            ):
+                shutil.rmtree(os.path.join(base_dir, path_dir), ignore_errors=True)
+        os.makedirs(self.RUN_DIR, exist_ok=True)
+
+        # status of the hospcodes completed by previous runs
+        self.done: Dict[str, str] = dict()
+        for filename in os.listdir(self.RUN_DIR):
+            hospcode, ext = os.path.splitext(filename)
+            if ext == ".parquet":
+                self.done[hospcode] = "success"
+            elif ext == ".ignore":
+                self.done[hospcode] = "ignore"
+
+    @classmethod
+    def from_env(
+        cls, hdcfile, output_filename: str, province_code: str
+    ) -> Optional["Checkpoint"]:
+        """
+        Returns the checkpoint of a script in the directory of HDCUTIL_CHECKPOINT_DIR, None if it is not set.
+
+        Args:
+            hdcfile (HDCFiles): The storage of the output.
+            output_filename (str): The output_filename of the script.
+            province_code (str): The province of the run.
+
+        Returns:
+            Checkpoint | None: The checkpoint.
+        """
+        base_dir: Optional[str] = os.environ.get(CHECKPOINT_ENV)
+        if not base_dir:
+            return None
+        return cls(base_dir, output_filename, hdcfile.BUDGET_YEAR, province_code)
+
+    def status(self, hospcode: str) -> Optional[str]:
+        """
+        Returns "success" or "ignore" for a hospcode completed by a previous run, None otherwise.
+        """
+        return self.done.get(hospcode)
+
+    def save(self, hospcode: str, df: Optional[DataFrame] = None) -> bool:
+        """
+        Spills the result of a completed hospcode, None or an empty DataFrame for an ignored hospcode.
+        The file is moved into place when it is complete, a crash never leaves a partial part.
+        A failed save only loses the resume of the hospcode, it is logged and not raised.
+
+        Args:
+            hospcode (str): The hospital code.
+            df (DataFrame, optional): The result. Defaults to None.
+
+        Returns:
+            bool: True if the checkpoint is saved.
+        """
+        status: str = "ignore" if df is None or df.empty else "success"
+        path: str = os.path.join(
+            self.RUN_DIR, hospcode + (".parquet" if status == "success" else ".ignore")
+        )
+        tmp_path: str = f"{path}.tmp-{os.getpid()}"
+        try:
+            if status == "success":
+                pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path)
+            else:
+                open(tmp_path, "w").close()
+            os.replace(tmp_path, path)
+        except (OSError, pa.ArrowException) as e:
+            warning(
+                f"checkpoint of {hospcode} is not saved, a rerun processes it again: {e}"
+            )
+            return False
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.done[hospcode] = status
+        return True
+
+    def load(self, hospcode: str) -> DataFrame:
+        """
+        Reads the result of a hospcode completed by a previous run.
+
+        Args:
+            hospcode (str): The hospital code.
+
+        Returns:
+            DataFrame: The result.
+        """
+        table: pa.Table = pq.read_table(
+            os.path.join(self.RUN_DIR, hospcode + ".parquet")
+        )
+        return table.to_pandas(types_mapper=ArrowDtype)
+
+    def clear(self):
+        """
+        Removes the run directory, called once the output is complete.
+        """
+        shutil.rmtree(self.RUN_DIR, ignore_errors=True)
+        self.done = dict()
@@ -1,9 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
 from logging import warning
 from urllib.parse import urlparse, ParseResult, parse_qs
-from typing import Optional, List
+from typing import Any, Dict, Optional, List, Tuple
+from glob import glob
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
 
 from pandas import DataFrame, read_parquet
 
+from .tracking import TRACE_ENV, record_input
+
+# pyarrow DNF filters, like hdcutil.hdcfile.Filters
+Filters = List[Tuple[str, str, Any]]
+
 
 _BOOLEAN_STR_LIST_: list[str] = [
     "true",
@@ -20,7 +33,13 @@ _BOOLEAN_STR_LIST_: list[str] = [
 
 
 class CoLookup:
-    def __init__(self, uri: str):
+    def __init__(
+        self,
+        uri: str,
+        cache_dir: Optional[str] = None,
+        cache_ttl: int = 0,
+        max_pool_connections: int = 32,
+    ):
         """
         Initializes the class with the provided URI.
 
@@ -30,6 +49,9 @@ class CoLookup:
                         s3://key:secret@host:port/bucket/path/to/file?use_ssl=true&anon=false
                             use_ssl (default: true)
                             anon (default: false)
+            cache_dir (str, optional): Local directory to cache s3 objects. Defaults to None is no cache.
+            cache_ttl (int, optional): Seconds a cached object is reused without revalidating its ETag. Defaults to 0 is always revalidate.
+            max_pool_connections (int, optional): Size of the keep-alive HTTP connection pool of the s3 filesystem. Defaults to 32.
 
         Returns:
             None
@@ -37,6 +59,12 @@ class CoLookup:
         self.STORAGE_TYPE = "file"
         self.BASE_PATH = "./"
         self.STORAGE_OPTIONS = dict()
+        self.CACHE_DIR: Optional[str] = cache_dir
+        self.CACHE_TTL: int = cache_ttl
+        self.MAX_POOL_CONNECTIONS: int = max_pool_connections
+        self._fs = None
+        # results of get_chospital by (name, ext, province_code, columns)
+        self._memo: Dict[tuple, DataFrame] = dict()
         try:
             o: ParseResult = urlparse(uri)
 
@@ -83,7 +111,11 @@ class CoLookup:
                 self.BASE_PATH: str = uri.replace(o.scheme + "://", "")
 
     def read_pq(
-        self, name: str, columns: Optional[List[str]] = None, ext: str = ".parquet"
+        self,
+        name: str,
+        columns: Optional[List[str]] = None,
+        ext: str = ".parquet",
+        filters: Optional[Filters] = None,
     ) -> DataFrame:
         """
         Reads a parquet file from the specified path and returns a DataFrame.
@@ -92,20 +124,33 @@ class CoLookup:
             name (str): The name of the parquet file.
             columns (Optional[List[str]], optional): A list of column names to read from the parquet file. Defaults to None to read all columns.
             ext (str, optional): The file extension of the parquet file. Defaults to "parquet".
+            filters (Filters, optional): Row filters pushed down to pyarrow, e.g. [("CHW_CODE", "==", "14")]. Defaults to None is All rows.
 
         Returns:
             DataFrame: The DataFrame read from the parquet file. if error return empty DataFrame
 
 
         """
+        self._record_input(name + ext)
         try:
-            if self.STORAGE_TYPE == "s3":
+            if self.STORAGE_TYPE == "s3" and self.CACHE_DIR is not None:
                 return read_parquet(
-                    path=f"s3://{self.BASE_PATH}/{name}{ext}",
+                    path=self.fetch_cache(name + ext),
                     engine="pyarrow",
                     dtype_backend="pyarrow",
-                    storage_options=self.STORAGE_OPTIONS,
                     columns=columns,
+                    filters=filters,
+                )
+            elif self.STORAGE_TYPE == "s3":
+                # pre_buffer coalesces the footer and column chunks into parallel ranged reads
+                return read_parquet(
+                    path=f"{self.BASE_PATH}/{name}{ext}",
+                    engine="pyarrow",
+                    dtype_backend="pyarrow",
+                    filesystem=self.fs,
+                    columns=columns,
+                    filters=filters,
+                    pre_buffer=True,
                 )
             else:
                 return read_parquet(
@@ -113,11 +158,158 @@ class CoLookup:
                     engine="pyarrow",
                     dtype_backend="pyarrow",
                     columns=columns,
+                    filters=filters,
                 )
         except Exception as e:
             warning(str(e))
             return DataFrame()
 
+    def read_many(
+        self,
+        names: List[str],
+        columns: Optional[Dict[str, List[str]]] = None,
+        ext: str = ".parquet",
+        max_workers: Optional[int] = None,
+    ) -> Dict[str, DataFrame]:
+        """
+        Reads several lookup tables concurrently over the shared s3 client,
+        the time is bounded by the slowest table instead of the sum of all of them.
+
+        Args:
+            names (List[str]): The names of the parquet files, e.g. ["chospital", "cchangwat"].
+            columns (Dict[str, List[str]], optional): The columns to read of each name. Defaults to None to read all columns.
+            ext (str, optional): The file extension of the parquet files. Defaults to ".parquet".
+            max_workers (int, optional): Number of concurrent reads. Defaults to None is one per name, at most max_pool_connections.
+
+        Returns:
+            Dict[str, DataFrame]: The DataFrame of each name in the order of names, an empty DataFrame for a table that failed.
+        """
+        names = list(dict.fromkeys(names))
+        if len(names) == 0:
+            return dict()
+        if self.STORAGE_TYPE == "s3":
+            # create the client once before the threads share it
+            self.fs
+        workers: int = max_workers or min(len(names), self.MAX_POOL_CONNECTIONS)
+        columns = columns or dict()
+        with ThreadPoolExecutor(max(workers, 1)) as pool:
+            futures = [
+                pool.submit(self.read_pq, name=name, columns=columns.get(name), ext=ext)
+                for name in names
+            ]
+            # read_pq returns an empty DataFrame with a warning on failure
+            return {name: future.result() for name, future in zip(names, futures)}
+
+    def _record_input(self, filename: str):
+        # provenance is best-effort, a failed lookup of the ETag never fails the read
+        if not os.environ.get(TRACE_ENV):
+            return
+        try:
+            if self.STORAGE_TYPE == "s3":
+                s3_path: str = f"{self.BASE_PATH}/{filename}"
+                etag: str = str(self.fs.info(s3_path).get("ETag", "")).strip('"')
+                record_input(f"s3://{s3_path}", etag=etag)
+            else:
+                record_input(f"{self.BASE_PATH}/{filename}")
+        except Exception as e:
+            warning(f"provenance of {filename} is not recorded: {e}")
+
+    @property
+    def fs(self):
+        """
+        The long-lived s3 filesystem of this instance, created on first use and shared by all reads
+        so connections and TLS sessions are reused through its keep-alive pool.
+
+        Returns:
+            S3FileSystem: The s3fs filesystem.
+        """
+        if self._fs is None:
+            from s3fs import S3FileSystem
+
+            options: dict = dict(self.STORAGE_OPTIONS)
+            options["config_kwargs"] = dict(
+                max_pool_connections=self.MAX_POOL_CONNECTIONS,
+                tcp_keepalive=True,
+            )
+            self._fs = S3FileSystem(**options)
+        return self._fs
+
+    def fetch_cache(self, filename: str) -> str:
+        """
+        Returns the local path of an s3 object in the cache directory, downloading it when
+        the cached copy is missing or its ETag changed. Safe with concurrent processes:
+        objects are stored by ETag and published with an atomic rename.
+
+        Args:
+            filename (str): The object name under the base path, e.g. "chospital.parquet".
+
+        Returns:
+            str: The path of the local copy.
+        """
+        s3_path: str = f"{self.BASE_PATH}/{filename}"
+        endpoint: str = self.STORAGE_OPTIONS.get("endpoint_url", "")
+        cache_key: str = hashlib.sha1(f"{endpoint}/{s3_path}".encode()).hexdigest()
+        cache_dir: str = os.path.join(self.CACHE_DIR, cache_key[:16])
+        os.makedirs(cache_dir, exist_ok=True)
+        meta_file: str = os.path.join(cache_dir, filename + ".json")
+
+        meta: dict = dict()
+        try:
+            with open(meta_file, "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            pass
+        local_file: str = os.path.join(cache_dir, meta.get("file", filename))
+        has_local: bool = "etag" in meta and os.path.exists(local_file)
+        if has_local and time.time() - meta.get("checked_at", 0) < self.CACHE_TTL:
+            return local_file
+
+        fs = self.fs
+        try:
+            etag: str = str(fs.info(s3_path, refresh=True).get("ETag", "")).strip('"')
+        except Exception as e:
+            if has_local:
+                # s3 unreachable, serve the stale copy
+                warning(f"revalidate {s3_path} failed, use cache: {e}")
+                return local_file
+            raise e
+
+        if not has_local or etag == "" or etag != meta["etag"]:
+            name, ext = os.path.splitext(filename)
+            local_file = os.path.join(
+                cache_dir,
+                f"{name}.{hashlib.sha1(etag.encode()).hexdigest()[:16]}{ext}",
+            )
+            if etag == "" or not os.path.exists(local_file):
+                fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+                os.close(fd)
+                try:
+                    fs.get_file(s3_path, tmp_file)
+                    os.replace(tmp_file, local_file)
+                finally:
+                    if os.path.exists(tmp_file):
+                        os.remove(tmp_file)
+
+        meta = dict(
+            etag=etag,
+            file=os.path.basename(local_file),
+            checked_at=time.time(),
+        )
+        fd, tmp_meta = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_meta, meta_file)
+        # the copies of older ETags, the meta file points to the new one
+        name, ext = os.path.splitext(filename)
+        pattern = re.compile(re.escape(name) + r"\.[0-9a-f]{16}" + re.escape(ext))
+        for path_file in os.listdir(cache_dir):
+            if pattern.fullmatch(path_file) and path_file != meta["file"]:
+                try:
+                    os.remove(os.path.join(cache_dir, path_file))
+                except OSError:
+                    pass
+        return local_file
+
     def get_chospital(
         self,
         province_code: Optional[str] = None,
@@ -127,6 +319,8 @@ class CoLookup:
     ) -> DataFrame:
         """
         Retrieves a DataFrame containing data from the 'chospital' table.
+        The province filter and the columns are pushed down to the parquet read, the result is memoized
+        per (province_code, columns) in the instance and, with a cache directory, in files shared by processes.
 
         Args:
             province_code (str, optional): The code of the province. Defaults to None.
@@ -137,20 +331,95 @@ class CoLookup:
         Returns:
             DataFrame: The DataFrame containing the retrieved data.
         """
-        if columns is not None and province_code is not None:
-            columns.append("CHW_CODE")
-        df = self.read_pq(name=name, columns=columns, ext=ext)
+        if columns is not None:
+            # a copy, the caller's list is never changed
+            columns = list(dict.fromkeys(columns))
+            if province_code is not None and "CHW_CODE" not in columns:
+                columns.append("CHW_CODE")
+        key: tuple = (
+            name,
+            ext,
+            province_code,
+            None if columns is None else tuple(columns),
+        )
+        df: Optional[DataFrame] = self._memo.get(key)
+        if df is not None:
+            return df.copy()
+
+        memo_file: Optional[str] = None
+        try:
+            memo_file = self._memo_file(key)
+        except Exception as e:
+            warning(f"memo of {name}{ext} is disabled: {e}")
+        if memo_file is not None and os.path.exists(memo_file):
+            self._record_input(name + ext)
+            df = read_parquet(memo_file, engine="pyarrow", dtype_backend="pyarrow")
+            self._memo[key] = df
+            return df.copy()
+
+        # only the hospitals of the province and the columns are decoded
+        filters: Optional[Filters] = None
+        if province_code is not None:
+            filters = [("CHW_CODE", "==", province_code)]
+        df = self.read_pq(name=name, columns=columns, ext=ext, filters=filters)
         if df.empty:
             return df
 
         try:
             if "HOSPCODE" not in df.columns:
                 df["HOSPCODE"] = df["HOSCODE"]
-            if province_code is not None:
-                df: DataFrame = df.loc[df["CHW_CODE"] == province_code]
 
         except Exception as e:
             warning(str(e))
             return df
 
-        return df
+        self._memo[key] = df
+        if memo_file is not None:
+            self._write_memo(memo_file, df)
+        return df.copy()
+
+    def _memo_file(self, key: tuple) -> Optional[str]:
+        """
+        Returns the file of a get_chospital result shared by processes, named by the key and
+        the version of the source: the ETag for s3, the mtime and size for local files.
+        None without a cache directory.
+        """
+        if self.CACHE_DIR is None:
+            return None
+        name, ext = key[0], key[1]
+        if self.STORAGE_TYPE == "s3":
+            # the local copy of fetch_cache is named by the ETag
+            source: str = self.fetch_cache(name + ext)
+        else:
+            source = f"{self.BASE_PATH}/{name}{ext}"
+        st = os.stat(source)
+        endpoint: str = self.STORAGE_OPTIONS.get("endpoint_url", "")
+        key_hash: str = hashlib.sha1(
+            json.dumps([endpoint, self.BASE_PATH, *key]).encode()
+        ).hexdigest()[:16]
+        version_hash: str = hashlib.sha1(
+            json.dumps([os.path.abspath(source), st.st_mtime_ns, st.st_size]).encode()
+        ).hexdigest()[:16]
+        return os.path.join(
+            self.CACHE_DIR, "memo", f"{name}.{key_hash}.{version_hash}{ext}"
+        )
+
+    def _write_memo(self, memo_file: str, df: DataFrame):
+        try:
+            memo_dir: str = os.path.dirname(memo_file)
+            os.makedirs(memo_dir, exist_ok=True)
+            fd, tmp_file = tempfile.mkstemp(dir=memo_dir, suffix=".tmp")
+            os.close(fd)
+            try:
+                df.to_parquet(tmp_file, engine="pyarrow", index=False)
+                os.replace(tmp_file, memo_file)
+            finally:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+            # the results of older versions of the source
+            prefix: str = memo_file.rsplit(".", 2)[0]
+            for path_file in glob(f"{prefix}.*"):
+                if path_file != memo_file and not path_file.endswith(".tmp"):
+                    os.remove(path_file)
+        except Exception as e:
+            warning(f"write memo {memo_file} failed: {e}")
@@ -4,3 +4,7 @@ class IgnoreEmptyDataFrame(Exception):
 
 class EmptyDataFrame(Exception):
     pass
+
+
+class BuildError(Exception):
+    pass
@@ -1,9 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from copy import copy
 from datetime import datetime, date
+from glob import glob
 import os
+import re
+import shutil
+import socket
 import warnings
+from time import perf_counter, time
 
-from typing import Optional, List
-from pandas import DataFrame, read_parquet, set_option, Index
+from typing import Any, Dict, Iterator, Optional, List, Tuple, Union
+from pandas import ArrowDtype, DataFrame, set_option, Index
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .cache import LRUCache, SharedTableCache
+from .tracking import record_input, record_output
 
 
 def init_pandas_options():
@@ -26,15 +40,164 @@ def init_pandas_options():
 
 ALL_HOSPCODE = "_all_"
 
+# pyarrow DNF filters: [(col, op, val), ...] (AND) or [[...], [...]] (OR of ANDs)
+Filters = Union[List[Tuple[str, str, Any]], List[List[Tuple[str, str, Any]]]]
+
+# hive partition keys of the dataset layout: {pname}/B_YEAR=2024/HOSPCODE=10669/part-0.parquet
+PARTITION_SCHEMA = pa.schema([("B_YEAR", pa.string()), ("HOSPCODE", pa.string())])
+
+# a file of read_many: pname, (pname, hospcode) or (pname, hospcode, budget_year)
+Source = Union[str, Tuple[str, str], Tuple[str, str, Union[str, int]]]
+
+# concurrent reads of read_many
+DEFAULT_READ_WORKERS = 8
+
+# the hospcode of a flat file name: {pname}_{hospcode}_{BUDGET_YEAR}.parquet
+_FLAT_HOSPCODE_PATTERN = r"_(_all_|[^_/]+)_[0-9]+\.parquet$"
+
+# rows per batch of iter_batches
+DEFAULT_BATCH_ROWS = 64 * 1024
+
+# rows per parquet row group, small enough for readers to skip groups by their statistics
+DEFAULT_ROW_GROUP_SIZE = 64 * 1024
+
+# string columns of person and visit ids, unique per row, never dictionary encoded;
+# the writer falls back to plain encoding for other columns whose dictionary grows too large
+NO_DICTIONARY_COLUMNS = ["CID", "PID", "HN", "AN", "SEQ"]
+
+# staging paths of other hosts older than this are left by killed runs
+STALE_STAGING_SECONDS = 24 * 60 * 60
+
+# the suffix of a staging path: {name}.tmp-{host}-{pid}-{id}
+_STAGING_PATTERN = re.compile(r"\.tmp-(?P<host>.+)-(?P<pid>[0-9]+)-[0-9]+(?:[-.].*)?")
+
+
+def _filter_columns(filters: Filters) -> List[str]:
+    # the columns of DNF filters
+    groups = filters if isinstance(filters[0], list) else [filters]
+    return [f[0] for group in groups for f in group]
+
+
+def _sort_table(table: pa.Table, sort_by: List[str]) -> pa.Table:
+    # stable sort by the columns of sort_by the table has
+    keys = [(c, "ascending") for c in sort_by if c in table.column_names]
+    if len(keys) == 0 or table.num_rows == 0:
+        return table
+    return table.sort_by(keys)
+
+
+def _write_options(
+    schema: pa.Schema, compression: str, compression_level: Optional[int] = None
+) -> Dict[str, Any]:
+    # parquet writer options: statistics of every column, dictionary encoding of the code columns,
+    # chosen by the schema so every chunk of a writer is encoded the same way
+    use_dictionary: List[str] = [
+        field.name
+        for field in schema
+        if (
+            pa.types.is_string(field.type)
+            or pa.types.is_large_string(field.type)
+            or pa.types.is_dictionary(field.type)
+        )
+        and field.name not in NO_DICTIONARY_COLUMNS
+    ]
+    return dict(
+        compression=compression,
+        compression_level=compression_level,
+        use_dictionary=use_dictionary,
+        write_statistics=True,
+    )
+
+
+def _conform_table(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    # the columns of schema by name, cast to its types, missing columns are null
+    columns: List[pa.ChunkedArray] = [
+        (
+            table[field.name].cast(field.type)
+            if field.name in table.column_names
+            else pa.chunked_array([pa.nulls(table.num_rows, field.type)])
+        )
+        for field in schema
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def _staging_suffix(owner: Any) -> str:
+    return f".tmp-{socket.gethostname()}-{os.getpid()}-{id(owner)}"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _sweep_staging(directory: str, prefix: str):
+    """
+    Removes the staging files and directories of prefix in directory left by killed runs,
+    those of a dead process of this host, and those of other hosts older than STALE_STAGING_SECONDS.
+    """
+    if not os.path.isdir(directory):
+        return
+    host: str = socket.gethostname()
+    now: float = time()
+    for name in os.listdir(directory):
+        if not name.startswith(prefix):
+            continue
+        match = _STAGING_PATTERN.fullmatch(name[len(prefix) :])
+        if match is None:
+            continue
+        path: str = os.path.join(directory, name)
+        try:
+            if match["host"] == host:
+                stale: bool = not _pid_alive(int(match["pid"]))
+            else:
+                stale = now - os.path.getmtime(path) > STALE_STAGING_SECONDS
+            if not stale:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            # removed by another run
+            continue
+
+
+def _quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _quote_identifier(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _quote_list(values: List[str]) -> str:
+    return "[" + ", ".join(_quote_literal(v) for v in values) + "]"
+
 
 class HDCFiles:
-    def __init__(self, base_path: str, budget_year: str | int):
+    def __init__(
+        self,
+        base_path: str,
+        budget_year: str | int,
+        cache_bytes: int = 0,
+        shared_cache_dir: Optional[str] = None,
+        shared_cache_pnames: Optional[List[str]] = None,
+    ):
         """
         Initializes an instance of the class.
 
         Args:
             base_path (str): The base path for the data files.
             budget_year (str | int): The year for the thai budget.
+            cache_bytes (int, optional): The byte budget of the read cache. Defaults to 0 is disabled.
+            shared_cache_dir (str, optional): The directory of the memory-mapped cache shared by processes, see enable_shared_cache. Defaults to None is disabled.
+            shared_cache_pnames (List[str], optional): The pname served by the shared cache. Defaults to None is all.
 
         Raises:
             Exception: If the budget year is invalid.
@@ -52,6 +215,15 @@ class HDCFiles:
 
         self.BASE_PATH = base_path
         self.BUDGET_YEAR = str(year)
+        self.CACHE: Optional[LRUCache] = None
+        self.enable_cache(cache_bytes)
+        self.SHARED_CACHE: Optional[SharedTableCache] = None
+        self.SHARED_CACHE_PNAMES: Optional[List[str]] = None
+        if shared_cache_dir:
+            self.enable_shared_cache(shared_cache_dir, shared_cache_pnames)
+        # totals of read_table, used by the run metrics
+        self.rows_read: int = 0
+        self.read_seconds: float = 0.0
 
     @staticmethod
     def validate_hospcode(hospcode: str) -> bool:
@@ -92,13 +264,175 @@ class HDCFiles:
             bool: True if the path exists, False otherwise.
         """
         path_file: str = self.get_path(pname=pname, hospcode=hospcode)
-        return os.path.exists(path_file)
+        return os.path.exists(path_file) or self.has_dataset(
+            pname=pname, hospcode=hospcode
+        )
+
+    def get_dataset_path(self, pname: str, hospcode: str = ALL_HOSPCODE) -> str:
+        """
+        Returns the directory of the hive-partitioned layout for a given pname and hospcode.
+
+        Layout: `{BASE_PATH}/{pname}/B_YEAR={BUDGET_YEAR}/HOSPCODE={hospcode}/part-*.parquet`
+
+        Args:
+            pname (str): The name of the parameter.
+            hospcode (str, optional): The hospital code. Defaults to ALL_HOSPCODE is the budget year directory.
+
+        Returns:
+            str: The path to the partition directory.
+        """
+        if self.validate_hospcode(hospcode=hospcode) is False:
+            warnings.warn(message="hospcode is not valid")
+
+        dir_year: str = os.path.join(self.BASE_PATH, pname, f"B_YEAR={self.BUDGET_YEAR}")
+        if hospcode == ALL_HOSPCODE:
+            return dir_year
+        return os.path.join(dir_year, f"HOSPCODE={hospcode}")
+
+    def has_dataset(self, pname: str, hospcode: str = ALL_HOSPCODE) -> bool:
+        """
+        Check if the hive-partitioned layout exists for a given pname and hospcode.
+
+        Args:
+            pname (str): The name of the parameter.
+            hospcode (str, optional): The hospital code. Defaults to ALL_HOSPCODE.
+
+        Returns:
+            bool: True if the partition directory exists, False otherwise.
+        """
+        return os.path.isdir(self.get_dataset_path(pname=pname, hospcode=hospcode))
+
+    def get_size(self, pname: str, hospcode: str = ALL_HOSPCODE) -> int:
+        """
+        Returns the size in bytes of the data stored for a given pname and hospcode,
+        in either the flat file or the hive-partitioned layout.
+
+        Args:
+            pname (str): The name of the parameter.
+            hospcode (str, optional): The hospital code. Defaults to ALL_HOSPCODE.
+
+        Returns:
+            int: The size in bytes, 0 if no data exists.
+        """
+        files, _ = self._source_files(pname=pname, hospcode=hospcode)
+        return sum(os.stat(f).st_size for f in files)
+
+    def write_data(
+        self,
+        pname: str,
+        hospcode: str,
+        df: DataFrame,
+        sort_by: Optional[List[str]] = None,
+        date_column: Optional[str] = None,
+        row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+        compression: str = "snappy",
+        compression_level: Optional[int] = None,
+    ) -> str:
+        """
+        Writes a DataFrame to the file of pname and hospcode, sorted so readers filtering
+        by HOSPCODE (and date) skip row groups by their statistics. The file is written
+        to a temporary path and renamed into place.
+
+        Args:
+            pname (str): The name of the parameter.
+            hospcode (str): The hospital code, ALL_HOSPCODE for the `_all_` file.
+            df (DataFrame): The data to write.
+            sort_by (List[str], optional): The sort columns, missing columns are ignored. Defaults to None is ["HOSPCODE"].
+            date_column (str, optional): A date column sorted after sort_by. Defaults to None.
+            row_group_size (int, optional): The rows per row group. Defaults to DEFAULT_ROW_GROUP_SIZE.
+            compression (str, optional): The parquet compression codec, e.g. "zstd". Defaults to "snappy".
+            compression_level (int, optional): The level of the codec. Defaults to None is the codec default.
+
+        Returns:
+            str: The path of the written file.
+        """
+        keys: List[str] = ["HOSPCODE"] if sort_by is None else list(sort_by)
+        if date_column is not None:
+            keys.append(date_column)
+        table: pa.Table = pa.Table.from_pandas(df, preserve_index=False)
+        table = _sort_table(table, keys)
+
+        path: str = self.get_path(pname=pname, hospcode=hospcode)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _sweep_staging(os.path.dirname(path), os.path.basename(path))
+        tmp_path: str = path + _staging_suffix(table)
+        try:
+            pq.write_table(
+                table,
+                tmp_path,
+                row_group_size=row_group_size,
+                **_write_options(table.schema, compression, compression_level),
+            )
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        record_output(path)
+        return path
+
+    def write_dataset(self, pname: str, df: DataFrame) -> str:
+        """
+        Writes a DataFrame in the hive-partitioned layout, one partition per HOSPCODE.
+        Data of the budget year already written for pname is replaced, the `_all_` flat file
+        of the budget year is removed so it does not shadow the new layout.
+        Per-hospcode flat files are kept and still take precedence for their hospcode.
+
+        Args:
+            pname (str): The name of the parameter.
+            df (DataFrame): The data to write, must have a HOSPCODE column.
+
+        Raises:
+            Exception: If the DataFrame has no HOSPCODE column.
+
+        Returns:
+            str: The budget year directory of the written dataset.
+        """
+        with self.open_writer(pname, partitioned=True, fill_column=False) as writer:
+            writer.write(df)
+        return writer.PATH
+
+    def open_writer(
+        self,
+        pname: str,
+        partitioned: bool = False,
+        fill_column: bool = True,
+        compression: str = "snappy",
+        compression_level: Optional[int] = None,
+        row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+        sort_by: Optional[List[str]] = None,
+    ) -> "HDCFilesWriter":
+        """
+        Opens a streaming writer of the `_all_` output of pname, see HDCFilesWriter.
+
+        Args:
+            pname (str): The name of the parameter.
+            partitioned (bool, optional): Write the hive-partitioned layout instead of the flat file. Defaults to False.
+            fill_column (bool, optional): Apply fill_column to every chunk (s_ table). Defaults to True.
+            compression (str, optional): The parquet compression codec, e.g. "zstd". Defaults to "snappy".
+            compression_level (int, optional): The level of the codec. Defaults to None is the codec default.
+            row_group_size (int, optional): The rows per row group. Defaults to DEFAULT_ROW_GROUP_SIZE.
+            sort_by (List[str], optional): The sort columns of every chunk. Defaults to None is ["HOSPCODE"].
+
+        Returns:
+            HDCFilesWriter: The writer, use it as a context manager.
+        """
+        return HDCFilesWriter(
+            self,
+            pname,
+            partitioned=partitioned,
+            fill_column=fill_column,
+            compression=compression,
+            compression_level=compression_level,
+            row_group_size=row_group_size,
+            sort_by=sort_by,
+        )
 
     def read_data(
         self,
         pname: str,
         hospcode: str = ALL_HOSPCODE,
         columns: Optional[List[str]] = None,
+        filters: Optional[Filters] = None,
     ) -> DataFrame:
         """
         Reads data from a file and returns it as a DataFrame.
@@ -107,21 +441,582 @@ class HDCFiles:
             pname (str): The name of the file to read.
             hospcode (str, optional): The hospital code. Defaults to ALL_HOSPCODE.
             columns (List[str], optional): The list of columns to read. Defaults to None is All collumns.
+            filters (Filters, optional): Row filters pushed down to pyarrow, e.g. [("HOSPCODE", "==", "10669")].
+                Row groups whose statistics cannot match are skipped. Defaults to None is All rows.
 
         Returns:
             DataFrame: The data read from the file as a DataFrame.
         """
-        path_file: str = self.get_path(pname=pname, hospcode=hospcode)
-        if os.path.exists(path=path_file) is False:
+        table: Optional[pa.Table] = self.read_table(
+            pname=pname, hospcode=hospcode, columns=columns, filters=filters
+        )
+        if table is None:
             return DataFrame()
-        return read_parquet(
-            path=path_file, engine="pyarrow", dtype_backend="pyarrow", columns=columns
+        # arrow-backed columns share the immutable cached buffers, writes never leak between callers
+        return table.to_pandas(types_mapper=ArrowDtype)
+
+    def read_table(
+        self,
+        pname: str,
+        hospcode: str = ALL_HOSPCODE,
+        columns: Optional[List[str]] = None,
+        filters: Optional[Filters] = None,
+    ) -> Optional[pa.Table]:
+        """
+        Reads data from a file and returns it as a pyarrow Table, served from the cache when enabled.
+
+        Args:
+            pname (str): The name of the file to read.
+            hospcode (str, optional): The hospital code. Defaults to ALL_HOSPCODE.
+            columns (List[str], optional): The list of columns to read. Defaults to None is All collumns.
+            filters (Filters, optional): Row filters pushed down to pyarrow. Defaults to None is All rows.
+
+        Returns:
+            pa.Table | None: The data read from the file, None if no file exists.
+        """
+        start: float = perf_counter()
+        table: Optional[pa.Table] = self._read_table(pname, hospcode, columns, filters)
+        self.read_seconds += perf_counter() - start
+        if table is not None:
+            self.rows_read += table.num_rows
+        return table
+
+    def read_many(
+        self,
+        sources: List[Source],
+        columns: Optional[List[str]] = None,
+        filters: Optional[Filters] = None,
+        add_source: bool = False,
+        max_workers: int = DEFAULT_READ_WORKERS,
+        max_bytes: Optional[int] = None,
+    ) -> DataFrame:
+        """
+        Reads several files concurrently and returns them as one DataFrame, see read_many_table.
+
+        Args:
+            sources (List[Source]): The files to read: pname, (pname, hospcode) or (pname, hospcode, budget_year).
+            columns (List[str], optional): The list of columns to read. Defaults to None is All collumns.
+            filters (Filters, optional): Row filters pushed down to pyarrow. Defaults to None is All rows.
+            add_source (bool, optional): Add the SOURCE_B_YEAR and SOURCE_HOSPCODE columns of every file. Defaults to False.
+            max_workers (int, optional): Number of concurrent reads. Defaults to DEFAULT_READ_WORKERS.
+            max_bytes (int, optional): The byte budget of the data read. Defaults to None is no limit.
+
+        Raises:
+            Exception: If the data read is larger than max_bytes.
+
+        Returns:
+            DataFrame: The data of all files in the order of sources, empty if no file exists.
+        """
+        table: Optional[pa.Table] = self.read_many_table(
+            sources,
+            columns=columns,
+            filters=filters,
+            add_source=add_source,
+            max_workers=max_workers,
+            max_bytes=max_bytes,
         )
+        if table is None:
+            return DataFrame()
+        return table.to_pandas(types_mapper=ArrowDtype)
+
+    def read_many_table(
+        self,
+        sources: List[Source],
+        columns: Optional[List[str]] = None,
+        filters: Optional[Filters] = None,
+        add_source: bool = False,
+        max_workers: int = DEFAULT_READ_WORKERS,
+        max_bytes: Optional[int] = None,
+    ) -> Optional[pa.Table]:
+        """
+        Reads several pname, hospcode and budget year files on a bounded thread pool,
+        pyarrow releases the GIL so the reads use the disk bandwidth in parallel.
+        The tables are concatenated without copying, columns missing in a file are null.
+
+        Args:
+            sources (List[Source]): The files to read: pname, (pname, hospcode) or (pname, hospcode, budget_year).
+            columns (List[str], optional): The list of columns to read. Defaults to None is All collumns.
+            filters (Filters, optional): Row filters pushed down to pyarrow. Defaults to None is All rows.
+            add_source (bool, optional): Add the SOURCE_B_YEAR and SOURCE_HOSPCODE columns of every file. Defaults to False.
+            max_workers (int, optional): Number of concurrent reads. Defaults to DEFAULT_READ_WORKERS.
+            max_bytes (int, optional): The byte budget of the data read, pending reads are cancelled above it. Defaults to None is no limit.
+
+        Raises:
+            Exception: If the data read is larger than max_bytes.
+
+        Returns:
+            pa.Table | None: The data of all files in the order of sources, None if no file exists.
+        """
+        requests: List[Tuple[str, str, str]] = []
+        for source in sources:
+            if isinstance(source, str):
+                requests.append((source, ALL_HOSPCODE, self.BUDGET_YEAR))
+            else:
+                pname, hospcode, *budget_year = source
+                year: str = str(int(budget_year[0])) if budget_year else self.BUDGET_YEAR
+                requests.append((pname, hospcode or ALL_HOSPCODE, year))
+
+        def read(request: Tuple[str, str, str]) -> Tuple[Optional[pa.Table], float]:
+            pname, hospcode, year = request
+            hdcfile: HDCFiles = self
+            if year != self.BUDGET_YEAR:
+                # same storage and caches, another budget year
+                hdcfile = copy(self)
+                hdcfile.BUDGET_YEAR = year
+            start: float = perf_counter()
+            table = hdcfile._read_table(pname, hospcode, columns, filters)
+            return table, perf_counter() - start
+
+        tables: List[Optional[pa.Table]] = [None] * len(requests)
+        nbytes: int = 0
+        with ThreadPoolExecutor(max(max_workers, 1)) as pool:
+            futures = {pool.submit(read, r): i for i, r in enumerate(requests)}
+            try:
+                for future in as_completed(futures):
+                    table, seconds = future.result()
+                    # counted here, the counters are not shared with the threads
+                    self.read_seconds += seconds
+                    if table is None:
+                        continue
+                    self.rows_read += table.num_rows
+                    nbytes += table.nbytes
+                    if max_bytes is not None and nbytes > max_bytes:
+                        raise Exception(
+                            f"read_many is larger than max_bytes: {nbytes:,} > {max_bytes:,}"
+                        )
+                    tables[futures[future]] = table
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        results: List[pa.Table] = []
+        for (pname, hospcode, year), table in zip(requests, tables):
+            if table is None:
+                continue
+            if add_source:
+                table = table.append_column(
+                    "SOURCE_B_YEAR", pa.repeat(pa.scalar(year), table.num_rows)
+                ).append_column(
+                    "SOURCE_HOSPCODE", pa.repeat(pa.scalar(hospcode), table.num_rows)
+                )
+            results.append(table)
+        if len(results) == 0:
+            return None
+        return pa.concat_tables(results, promote_options="default")
+
+    def query(
+        self,
+        sql: str,
+        pnames: Optional[List[str]] = None,
+        output: str = "pandas",
+        threads: Optional[int] = None,
+        memory_limit: Optional[str] = None,
+        temp_directory: Optional[str] = None,
+    ) -> Union[DataFrame, pa.Table]:
+        """
+        Runs SQL over the files of the budget year with DuckDB, every pname is a view of one source
+        like read_data: the `_all_` file, else the hive-partitioned layout, else the per-hospcode files.
+        Joins, group-bys and filters run multi-threaded and out of core, only the columns and row groups
+        the query needs are read. The time is added to read_seconds, rows_read is not counted since
+        the rows DuckDB scans are not known.
+
+        The view has a SOURCE_HOSPCODE column, the hospcode of the file: ALL_HOSPCODE for the
+        `_all_` file, the hospcode of a per-hospcode file or of a HOSPCODE= partition.
+
+            hdcfile.query('''
+                SELECT p.HOSPCODE, count(*) AS TARGET
+                FROM t_person_db p JOIN s_bench s USING (HOSPCODE)
+                GROUP BY p.HOSPCODE
+            ''')
+
+        Args:
+            sql (str): The query.
+            pnames (List[str], optional): The pname registered as views. Defaults to None is every pname named in sql.
+            output (str, optional): "pandas" or "arrow". Defaults to "pandas".
+            threads (int, optional): The threads of DuckDB. Defaults to None is the number of cpus.
+            memory_limit (str, optional): The memory limit of DuckDB, e.g. "4GB", larger operators spill to disk. Defaults to None is 80% of the memory.
+            temp_directory (str, optional): The spill directory. Defaults to None is the default of DuckDB.
+
+        Raises:
+            ImportError: If duckdb is not installed.
+            ValueError: If output is not "pandas" or "arrow".
+
+        Returns:
+            DataFrame | pa.Table: The result of the query.
+        """
+        if output not in ["pandas", "arrow"]:
+            raise ValueError(f"output must be pandas or arrow: {output}")
+        try:
+            import duckdb
+        except ImportError as e:
+            raise ImportError(
+                "HDCFiles.query requires duckdb, install it with `pip install hdcutil[query]`"
+            ) from e
+
+        if pnames is None:
+            pnames = [
+                p
+                for p in self.list_pnames()
+                if re.search(rf"\b{re.escape(p)}\b", sql, flags=re.IGNORECASE)
+            ]
+
+        start: float = perf_counter()
+        config: Dict[str, Any] = dict()
+        if threads is not None:
+            config["threads"] = threads
+        if memory_limit is not None:
+            config["memory_limit"] = memory_limit
+        if temp_directory is not None:
+            config["temp_directory"] = temp_directory
+        con = duckdb.connect(config=config)
+        try:
+            for pname in pnames:
+                view: Optional[str] = self._query_view(pname)
+                if view is not None:
+                    con.execute(f"CREATE VIEW {_quote_identifier(pname)} AS {view}")
+            table: pa.Table = con.sql(sql).fetch_arrow_table()
+        finally:
+            con.close()
+        self.read_seconds += perf_counter() - start
+        if output == "arrow":
+            return table
+        return table.to_pandas(types_mapper=ArrowDtype)
+
+    def list_pnames(self) -> List[str]:
+        """
+        Returns the pname stored for the budget year, in the flat or the hive-partitioned layout.
+
+        Returns:
+            List[str]: The sorted pname.
+        """
+        pnames: set = set()
+        dir_year: str = os.path.join(self.BASE_PATH, self.BUDGET_YEAR)
+        if os.path.isdir(dir_year):
+            pnames.update(
+                p
+                for p in os.listdir(dir_year)
+                if os.path.isdir(os.path.join(dir_year, p))
+            )
+        for path_dir in glob(
+            os.path.join(self.BASE_PATH, "*", f"B_YEAR={self.BUDGET_YEAR}")
+        ):
+            pnames.add(os.path.basename(os.path.dirname(path_dir)))
+        return sorted(pnames)
+
+    def _query_view(self, pname: str) -> Optional[str]:
+        # the SELECT of the view of pname from a single source, the `_all_` file and the hive
+        # layout hold the same rows as the per-hospcode files; None if no file exists
+        files, partitioned = self._source_files(pname=pname)
+        if len(files) == 0:
+            files = sorted(
+                glob(
+                    os.path.join(
+                        self.BASE_PATH,
+                        self.BUDGET_YEAR,
+                        pname,
+                        f"{pname}_*_{self.BUDGET_YEAR}.parquet",
+                    )
+                )
+            )
+        if len(files) == 0:
+            return None
+        for path_file in files:
+            record_input(path_file)
+
+        if partitioned:
+            # the partition keys stay strings, like PARTITION_SCHEMA
+            return (
+                "SELECT *, HOSPCODE AS SOURCE_HOSPCODE "
+                f"FROM read_parquet({_quote_list(files)}, hive_partitioning = true, "
+                "hive_types = {'B_YEAR': VARCHAR, 'HOSPCODE': VARCHAR}, union_by_name = true)"
+            )
+        return (
+            "SELECT * EXCLUDE (filename), "
+            f"regexp_extract(filename, {_quote_literal(_FLAT_HOSPCODE_PATTERN)}, 1) AS SOURCE_HOSPCODE "
+            f"FROM read_parquet({_quote_list(files)}, filename = true, union_by_name = true)"
+        )
+
+    def _read_table(
+        self,
+        pname: str,
+        hospcode: str = ALL_HOSPCODE,
+        columns: Optional[List[str]] = None,
+        filters: Optional[Filters] = None,
+    ) -> Optional[pa.Table]:
+        files, partitioned = self._source_files(pname=pname, hospcode=hospcode)
+        if len(files) == 0:
+            record_input(self.get_path(pname=pname, hospcode=hospcode))
+            return None
+        for path_file in files:
+            record_input(path_file)
+        if self.CACHE is None:
+            return self._load_table(
+                pname, hospcode, files, partitioned, columns, filters
+            )
+
+        stats = [os.stat(f) for f in files]
+        key = (
+            tuple((f, st.st_mtime_ns, st.st_size) for f, st in zip(files, stats)),
+            None if columns is None else tuple(columns),
+            repr(filters),
+        )
+        table: Optional[pa.Table] = self.CACHE.get(key)
+        if table is None:
+            table = self._load_table(
+                pname, hospcode, files, partitioned, columns, filters
+            )
+            self.CACHE.put(key, table, table.nbytes)
+        return table
+
+    def _load_table(
+        self,
+        pname: str,
+        hospcode: str,
+        files: List[str],
+        partitioned: bool,
+        columns: Optional[List[str]] = None,
+        filters: Optional[Filters] = None,
+    ) -> pa.Table:
+        # from the shared memory-mapped cache when it serves pname, otherwise from parquet
+        if self.SHARED_CACHE is None or (
+            self.SHARED_CACHE_PNAMES is not None
+            and pname not in self.SHARED_CACHE_PNAMES
+        ):
+            return self._read_files(pname, files, partitioned, columns, filters)
+
+        sources = []
+        for f in files:
+            st = os.stat(f)
+            sources.append((os.path.abspath(f), st.st_mtime_ns, st.st_size))
+        table: pa.Table = self.SHARED_CACHE.get(
+            f"{pname}_{hospcode}_{self.BUDGET_YEAR}",
+            sources,
+            lambda: self._read_files(pname, files, partitioned),
+        )
+        # the whole table is mapped, filters and columns are applied with pyarrow.compute instead of
+        # skipping row groups: the columns are zero-copy slices, only the rows kept by the filter are
+        # copied, of the selected and filtered columns only
+        if columns is not None and filters:
+            table = table.select(
+                list(dict.fromkeys(columns + _filter_columns(filters)))
+            )
+        if filters:
+            table = table.filter(pq.filters_to_expression(filters))
+        if columns is not None:
+            table = table.select(columns)
+        return table
+
+    def _source_files(
+        self, pname: str, hospcode: str = ALL_HOSPCODE
+    ) -> Tuple[List[str], bool]:
+        # flat file first, then the hive-partitioned layout
+        path_file: str = self.get_path(pname=pname, hospcode=hospcode)
+        if os.path.exists(path=path_file):
+            return [path_file], False
+        if self.has_dataset(pname=pname, hospcode=hospcode):
+            path_dir: str = self.get_dataset_path(pname=pname, hospcode=hospcode)
+            files = glob(os.path.join(path_dir, "**", "*.parquet"), recursive=True)
+            return sorted(files), True
+        return [], False
+
+    def _read_files(
+        self,
+        pname: str,
+        files: List[str],
+        partitioned: bool,
+        columns: Optional[List[str]] = None,
+        filters: Optional[Filters] = None,
+    ) -> pa.Table:
+        if not partitioned:
+            return pq.read_table(files[0], columns=columns, filters=filters)
+
+        # open only the files of the requested partition, the scan is multi-threaded
+        return self._open_dataset(pname, files, partitioned).to_table(
+            columns=columns,
+            filter=pq.filters_to_expression(filters) if filters else None,
+        )
+
+    def _open_dataset(
+        self, pname: str, files: List[str], partitioned: bool
+    ) -> ds.Dataset:
+        if not partitioned:
+            return ds.dataset(files, format="parquet")
+        return ds.dataset(
+            files,
+            format="parquet",
+            partitioning=ds.partitioning(PARTITION_SCHEMA, flavor="hive"),
+            partition_base_dir=os.path.join(self.BASE_PATH, pname),
+        )
+
+    def enable_cache(self, max_bytes: int):
+        """
+        Enables the in-process LRU cache of read_data/read_table, keyed by path, mtime/size, columns and filters.
+
+        Args:
+            max_bytes (int): The byte budget of the cache. 0 disables the cache.
+
+        Returns:
+            None
+        """
+        self.CACHE = LRUCache(max_bytes) if max_bytes > 0 else None
+
+    def enable_shared_cache(self, cache_dir: str, pnames: Optional[List[str]] = None):
+        """
+        Enables the cache shared by processes: the whole table of a pname is decoded once into an
+        uncompressed Arrow IPC file in cache_dir, invalidated by the mtime/size of its parquet files,
+        and every process reading it memory-maps that file zero-copy. Use a local disk, e.g. for
+        the scripts of `hdcli run -w 8` reading the same t_person_db.
+        Filters and columns are applied to the mapped table with pyarrow.compute, no row group is
+        skipped: cache the tables most scripts read whole, a table read with selective filters is
+        faster from parquet.
+
+        Args:
+            cache_dir (str): The local directory of the cached files.
+            pnames (List[str], optional): The pname served by the cache. Defaults to None is all.
+
+        Returns:
+            None
+        """
+        self.SHARED_CACHE = SharedTableCache(cache_dir)
+        self.SHARED_CACHE_PNAMES = None if pnames is None else list(pnames)
+
+    def cache_info(self) -> dict:
+        """
+        Returns the hit/miss/eviction counters of the cache.
+
+        Returns:
+            dict: The counters, empty if the cache is disabled,
+                with the counters of the shared cache in "shared" when it is enabled.
+        """
+        info: dict = dict()
+        if self.CACHE is not None:
+            info = self.CACHE.info()
+        if self.SHARED_CACHE is not None:
+            info["shared"] = self.SHARED_CACHE.info()
+        return info
+
+    def read_grouped(
+        self,
+        pname: str,
+        key: str = "HOSPCODE",
+        hospcode: str = ALL_HOSPCODE,
+        columns: Optional[List[str]] = None,
+        filters: Optional[Filters] = None,
+    ) -> "GroupedData":
+        """
+        Reads data once, sorted by key, with the row offsets of every key value precomputed.
+        Use it before the per-hospcode loop instead of `df.loc[df["HOSPCODE"] == hospcode]`,
+        each lookup is an O(1) zero-copy slice instead of a full column scan.
+
+        Args:
+            pname (str): The name of the file to read.
+            key (str, optional): The column to group by. Defaults to "HOSPCODE".
+            hospcode (str, optional): The hospital code of the file. Defaults to ALL_HOSPCODE.
+            columns (List[str], optional): The list of columns to read. Defaults to None is All collumns.
+            filters (Filters, optional): Row filters pushed down to pyarrow. Defaults to None is All rows.
+
+        Returns:
+            GroupedData: The grouped data, `grouped[hospcode]` returns the rows of the hospcode.
+        """
+        if columns is not None and key not in columns:
+            columns = columns + [key]
+        table: Optional[pa.Table] = self.read_table(
+            pname=pname, hospcode=hospcode, columns=columns, filters=filters
+        )
+        if table is None:
+            return GroupedData(DataFrame(), key, dict())
+
+        table = table.sort_by(key)
+        offsets: Dict[Any, Tuple[int, int]] = dict()
+        if table.num_rows > 0:
+            runs = pc.run_end_encode(table[key].combine_chunks())
+            start: int = 0
+            for value, end in zip(runs.values.to_pylist(), runs.run_ends.to_pylist()):
+                offsets[value] = (start, end)
+                start = end
+        df: DataFrame = table.to_pandas(types_mapper=ArrowDtype)
+        return GroupedData(df, key, offsets)
+
+    def iter_batches(
+        self,
+        pname: str,
+        hospcode: str = ALL_HOSPCODE,
+        columns: Optional[List[str]] = None,
+        filters: Optional[Filters] = None,
+        batch_rows: int = DEFAULT_BATCH_ROWS,
+        output: str = "pandas",
+    ) -> Iterator[Union[DataFrame, pa.RecordBatch]]:
+        """
+        Streams data in batches of at most batch_rows rows, only a few row groups are in memory at a time.
+        Use it to aggregate tables too large for read_data with a running aggregation,
+        the batches are never cached.
+
+            parts = []
+            for df_batch in hdcfile.iter_batches("t_person_db", columns=["HOSPCODE", "SEX"]):
+                parts.append(df_batch.groupby(["HOSPCODE", "SEX"], as_index=False).size())
+            df = pd.concat(parts).groupby(["HOSPCODE", "SEX"], as_index=False)["size"].sum()
+
+        Args:
+            pname (str): The name of the file to read.
+            hospcode (str, optional): The hospital code. Defaults to ALL_HOSPCODE.
+            columns (List[str], optional): The list of columns to read. Defaults to None is All collumns.
+            filters (Filters, optional): Row filters pushed down to pyarrow. Defaults to None is All rows.
+            batch_rows (int, optional): The maximum rows of a batch. Defaults to DEFAULT_BATCH_ROWS.
+            output (str, optional): "pandas" for DataFrame or "arrow" for pa.RecordBatch batches. Defaults to "pandas".
+
+        Raises:
+            ValueError: If output is not "pandas" or "arrow", raised by the call, not the first batch.
+
+        Returns:
+            Iterator[DataFrame | pa.RecordBatch]: The non-empty batches in file order, nothing if no file exists.
+        """
+        if output not in ["pandas", "arrow"]:
+            raise ValueError(f"output must be pandas or arrow: {output}")
+        files, partitioned = self._source_files(pname=pname, hospcode=hospcode)
+        if len(files) == 0:
+            record_input(self.get_path(pname=pname, hospcode=hospcode))
+            return iter(())
+        for path_file in files:
+            record_input(path_file)
+
+        # one file and two batches read ahead, the scan still decodes columns in parallel
+        batches = (
+            self._open_dataset(pname, files, partitioned)
+            .scanner(
+                columns=columns,
+                filter=pq.filters_to_expression(filters) if filters else None,
+                batch_size=max(batch_rows, 1),
+                batch_readahead=2,
+                fragment_readahead=1,
+            )
+            .to_batches()
+        )
+        return self._iter_batches(batches, output)
+
+    def _iter_batches(
+        self, batches: Iterator[pa.RecordBatch], output: str
+    ) -> Iterator[Union[DataFrame, pa.RecordBatch]]:
+        # the generator of iter_batches, the arguments are checked before the first batch
+        while True:
+            start: float = perf_counter()
+            batch: Optional[pa.RecordBatch] = next(batches, None)
+            self.read_seconds += perf_counter() - start
+            if batch is None:
+                return
+            if batch.num_rows == 0:
+                continue
+            self.rows_read += batch.num_rows
+            if output == "arrow":
+                yield batch
+            else:
+                yield batch.to_pandas(types_mapper=ArrowDtype)
 
     def read_person_db(
         self,
         hospcode: str = ALL_HOSPCODE,
         columns: Optional[List[str]] = None,
+        filters: Optional[Filters] = None,
     ) -> DataFrame:
         """
         Read all person data for a specific hospital or all hospitals.
@@ -129,13 +1024,14 @@ class HDCFiles:
         Args:
             hospcode (str, optional): The hospital code. Defaults to ALL_HOSPCODE.
             columns (List[str], optional): The columns to include in the result. Defaults to None is All collumns.
+            filters (Filters, optional): Row filters pushed down to pyarrow. Defaults to None is All rows.
 
         Returns:
             DataFrame: The person database as a DataFrame.
         """
 
         df: DataFrame = self.read_data(
-            pname="t_person_db", hospcode=hospcode, columns=columns
+            pname="t_person_db", hospcode=hospcode, columns=columns, filters=filters
         )
         return df
 
@@ -143,6 +1039,7 @@ class HDCFiles:
         self,
         hospcode: str = ALL_HOSPCODE,
         columns: Optional[List[str]] = None,
+        filters: Optional[Filters] = None,
     ) -> DataFrame:
         """
         Read the person is unique CID from the specified hospital code or all hospitals.
@@ -150,6 +1047,7 @@ class HDCFiles:
         Parameters:
             hospcode (str): The hospital code. Defaults to ALL_HOSPCODE.
             columns (Optional[List[str]]): A list of column names to include in the result DataFrame. Defaults to None is All collumns.
+            filters (Optional[Filters]): Row filters pushed down to pyarrow. Defaults to None is All rows.
 
         Returns:
             DataFrame: The DataFrame containing the person's CID.
@@ -158,19 +1056,22 @@ class HDCFiles:
         cols: List[str] | None = columns
         if columns is not None and "CK_CID" not in columns:
             columns.append("CK_CID")
-        df: DataFrame = self.read_person_db(hospcode=hospcode, columns=columns)
+        df: DataFrame = self.read_person_db(
+            hospcode=hospcode, columns=columns, filters=filters
+        )
         if not df.empty and cols is not None:
             df = df.loc[df["CK_CID"] > 0]
             df = df[cols]
         return df
 
-    def fill_column(self, df: DataFrame) -> DataFrame:
+    def fill_column(self, df: DataFrame, d_com: Optional[str] = None) -> DataFrame:
         """
         Only for ***s_ table***
         เติม column ของ DataFrame ที่ต้องการสำหรับตาราง Summary(s table) ในกรณีที่ยังไม่มี column
 
         Parameters:
         - df (DataFrame): The input DataFrame.
+        - d_com (str, optional): The value of D_COM when missing. Defaults to None is now.
 
         Returns:
         - df (DataFrame): The modified DataFrame with filled values and reordered columns.
@@ -183,7 +1084,7 @@ class HDCFiles:
             if "HAREA" in col:
                 df = df.rename(columns={"HAREA": "AREACODE"})
         if "D_COM" not in col:
-            df["D_COM"] = datetime.now().isoformat()
+            df["D_COM"] = d_com or datetime.now().isoformat()
         if "B_YEAR" not in col:
             df["B_YEAR"] = self.BUDGET_YEAR
         if "HOSPCODE" not in col:
@@ -198,9 +1099,12 @@ class HDCFiles:
         if "HAREA" in col:
             df = df.drop(columns=["HAREA"])
         # order column
-        cols: list[str] = ["HOSPCODE", "AREACODE", "D_COM", "B_YEAR"]
-        cols += set(df.columns.to_list()).difference(cols)
-        df.columns = cols
+        col = df.columns.to_list()
+        cols: list[str] = [
+            c for c in ["HOSPCODE", "AREACODE", "D_COM", "B_YEAR"] if c in col
+        ]
+        cols += [c for c in col if c not in cols]
+        df = df[cols]
         return df
 
     def verify_df(self, df: DataFrame) -> bool:
@@ -226,3 +1130,345 @@ class HDCFiles:
         if "AREACODE" not in col:
             return False
         return True
+
+
+class GroupedData:
+    def __init__(
+        self, df: DataFrame, key: str, offsets: Dict[Any, Tuple[int, int]]
+    ):
+        """
+        A DataFrame sorted by key with the row range of every key value, see HDCFiles.read_grouped.
+
+        Args:
+            df (DataFrame): The data sorted by key.
+            key (str): The column the data is grouped by.
+            offsets (Dict[Any, Tuple[int, int]]): The (start, stop) rows of every key value.
+
+        Returns:
+            None
+        """
+        self.df = df
+        self.KEY = key
+        self._offsets = offsets
+
+    def get(self, value: Any) -> DataFrame:
+        """
+        Returns the rows of a key value as a zero-copy slice.
+
+        Args:
+            value (Any): The key value, e.g. the hospcode.
+
+        Returns:
+            DataFrame: The rows of the key value, empty if the value is not found.
+        """
+        start, stop = self._offsets.get(value, (0, 0))
+        return self.df.iloc[start:stop]
+
+    def __getitem__(self, value: Any) -> DataFrame:
+        return self.get(value)
+
+    def __contains__(self, value: Any) -> bool:
+        return value in self._offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def keys(self) -> List[Any]:
+        return list(self._offsets.keys())
+
+
+class HDCFilesWriter:
+    def __init__(
+        self,
+        hdcfile: HDCFiles,
+        pname: str,
+        partitioned: bool = False,
+        fill_column: bool = True,
+        compression: str = "snappy",
+        compression_level: Optional[int] = None,
+        row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+        sort_by: Optional[List[str]] = None,
+    ):
+        """
+        Streams DataFrame chunks (e.g. one per hospcode) to the `_all_` output of pname.
+        Every chunk is sorted, small chunks are buffered and written together as row groups
+        of row_group_size rows. Chunks are not sorted across each other, the output is sorted
+        by sort_by only when the chunks are written in that order (e.g. sorted hospcodes).
+        The schema is taken from the first chunk, the columns of the others are matched by
+        name and the schema is widened when a chunk needs it (null to a type, int to float,
+        new columns), the rows written before are conformed on close.
+        Data is written to a temporary path and moved into place on close, so a crashed run
+        never leaves a half-written output, the staging paths of killed runs are removed.
+
+        Args:
+            hdcfile (HDCFiles): The storage to write to.
+            pname (str): The name of the parameter.
+            partitioned (bool, optional): Write the hive-partitioned layout instead of the flat file. Defaults to False.
+            fill_column (bool, optional): Apply fill_column to every chunk and verify_df to the first. Defaults to True.
+            compression (str, optional): The parquet compression codec, e.g. "zstd". Defaults to "snappy".
+            compression_level (int, optional): The level of the codec. Defaults to None is the codec default.
+            row_group_size (int, optional): The rows per row group. Defaults to DEFAULT_ROW_GROUP_SIZE.
+            sort_by (List[str], optional): The sort columns of every chunk. Defaults to None is ["HOSPCODE"].
+
+        Returns:
+            None
+        """
+        self.hdcfile = hdcfile
+        self.PNAME = pname
+        self.PARTITIONED = partitioned
+        self.FILL_COLUMN = fill_column
+        self.COMPRESSION = compression
+        self.COMPRESSION_LEVEL = compression_level
+        self.ROW_GROUP_SIZE = max(int(row_group_size), 1)
+        self.SORT_BY: List[str] = ["HOSPCODE"] if sort_by is None else list(sort_by)
+        self.D_COM: str = datetime.now().isoformat()
+        if partitioned:
+            self.PATH: str = hdcfile.get_dataset_path(pname=pname)
+            self.TMP_PATH: str = os.path.join(
+                hdcfile.BASE_PATH, pname, _staging_suffix(self)
+            )
+        else:
+            self.PATH: str = hdcfile.get_path(pname=pname, hospcode=ALL_HOSPCODE)
+            self.TMP_PATH: str = self.PATH + _staging_suffix(self)
+        _sweep_staging(
+            os.path.dirname(self.TMP_PATH),
+            "" if partitioned else os.path.basename(self.PATH),
+        )
+        self.schema: Optional[pa.Schema] = None
+        self.num_rows: int = 0
+        # time spent in write and close, used by the run metrics
+        self.write_seconds: float = 0.0
+        self.close_seconds: float = 0.0
+        self._writer: Optional[pq.ParquetWriter] = None
+        self._options: Dict[str, Any] = dict()
+        # chunks not written yet, fewer than ROW_GROUP_SIZE rows
+        self._pending: List[pa.Table] = []
+        self._pending_rows: int = 0
+        self._parts: int = 0
+        # flat files of the schemas before the last widening, merged on close
+        self._segments: List[str] = []
+        self._widened: bool = False
+
+    def __enter__(self) -> "HDCFilesWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, df: DataFrame) -> int:
+        """
+        Appends a chunk to the output, empty chunks are skipped.
+
+        Args:
+            df (DataFrame): The chunk to write.
+
+        Raises:
+            Exception: If the chunk is not valid or its types can not be unified with the schema.
+
+        Returns:
+            int: The number of rows written.
+        """
+        if df.empty:
+            return 0
+        start: float = perf_counter()
+        try:
+            return self._write(df)
+        finally:
+            self.write_seconds += perf_counter() - start
+
+    def _write(self, df: DataFrame) -> int:
+        if self.FILL_COLUMN:
+            df = self.hdcfile.fill_column(df, d_com=self.D_COM)
+        if self.PARTITIONED:
+            if "HOSPCODE" not in df.columns:
+                raise Exception("Dataframe has no HOSPCODE column.")
+            df = df.assign(
+                B_YEAR=self.hdcfile.BUDGET_YEAR,
+                HOSPCODE=df["HOSPCODE"].astype("string"),
+            )
+
+        if self.schema is None:
+            if self.FILL_COLUMN and not self.hdcfile.verify_df(df):
+                raise Exception("Dataframe is not correct.")
+            table: pa.Table = pa.Table.from_pandas(df, preserve_index=False)
+            self.schema = table.schema
+            self._options = _write_options(
+                self.schema, self.COMPRESSION, self.COMPRESSION_LEVEL
+            )
+        else:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if not table.schema.equals(self.schema):
+                table = self._conform(table)
+
+        table = _sort_table(table, self.SORT_BY)
+        if self.PARTITIONED:
+            ds.write_dataset(
+                table,
+                self.TMP_PATH,
+                format="parquet",
+                partitioning=ds.partitioning(PARTITION_SCHEMA, flavor="hive"),
+                basename_template=f"part-{self._parts}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+                file_options=ds.ParquetFileFormat().make_write_options(
+                    **self._options
+                ),
+                max_rows_per_group=self.ROW_GROUP_SIZE,
+            )
+            self._parts += 1
+        else:
+            self._pending.append(table)
+            self._pending_rows += table.num_rows
+            if self._pending_rows >= self.ROW_GROUP_SIZE:
+                self._flush()
+        self.num_rows += table.num_rows
+        return table.num_rows
+
+    def _conform(self, table: pa.Table) -> pa.Table:
+        # a chunk with other column order, types castable to the schema or missing columns
+        if set(table.column_names) <= set(self.schema.names):
+            try:
+                return _conform_table(table, self.schema)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                pass
+        try:
+            schema: pa.Schema = pa.unify_schemas(
+                [self.schema, table.schema], promote_options="permissive"
+            )
+            table = _conform_table(table, schema.remove_metadata())
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+            raise Exception(f"Dataframe schema is not match: {e}")
+        # the rows written so far keep the old schema until close
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            segment: str = f"{self.TMP_PATH}.{len(self._segments)}"
+            os.replace(self.TMP_PATH, segment)
+            self._segments.append(segment)
+        self._pending = [_conform_table(t, table.schema) for t in self._pending]
+        self.schema = table.schema
+        self._options = _write_options(
+            self.schema, self.COMPRESSION, self.COMPRESSION_LEVEL
+        )
+        self._widened = True
+        return table
+
+    def _flush(self, final: bool = False):
+        # writes the full row groups of the pending chunks, and the rest when final
+        if self._pending_rows == 0:
+            return
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self.PATH), exist_ok=True)
+            self._writer = pq.ParquetWriter(self.TMP_PATH, self.schema, **self._options)
+        table: pa.Table = pa.concat_tables(self._pending)
+        rows: int = table.num_rows
+        if not final:
+            rows -= rows % self.ROW_GROUP_SIZE
+        self._writer.write_table(
+            table.slice(0, rows), row_group_size=self.ROW_GROUP_SIZE
+        )
+        self._pending = [table.slice(rows)] if rows < table.num_rows else []
+        self._pending_rows = table.num_rows - rows
+
+    def close(self) -> str:
+        """
+        Finalizes the output and moves it into place.
+
+        Raises:
+            Exception: If no data was written.
+
+        Returns:
+            str: The path of the output.
+        """
+        start: float = perf_counter()
+        try:
+            return self._close()
+        finally:
+            self.close_seconds += perf_counter() - start
+
+    def _close(self) -> str:
+        if self.schema is None:
+            self.abort()
+            raise Exception("Dataframe is not correct.")
+        if not self.PARTITIONED:
+            self._flush(final=True)
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            if self._segments:
+                self._merge_segments()
+            os.replace(self.TMP_PATH, self.PATH)
+            record_output(self.PATH)
+            return self.PATH
+
+        if self._widened:
+            self._conform_parts()
+        # swap the budget year directory, the `_all_` flat file of the year would shadow it
+        dir_old: str = f"{self.TMP_PATH}-old"
+        if os.path.exists(self.PATH):
+            os.replace(self.PATH, dir_old)
+        os.replace(os.path.join(self.TMP_PATH, os.path.basename(self.PATH)), self.PATH)
+        shutil.rmtree(self.TMP_PATH, ignore_errors=True)
+        shutil.rmtree(dir_old, ignore_errors=True)
+        # per-hospcode flat files are kept, they are still read by hospcode
+        path_flat: str = self.hdcfile.get_path(pname=self.PNAME, hospcode=ALL_HOSPCODE)
+        if os.path.exists(path_flat):
+            os.remove(path_flat)
+        record_output(self.PATH)
+        return self.PATH
+
+    def _merge_segments(self):
+        # rewrites the segments and the last file with the final schema, a row group at a time
+        paths: List[str] = self._segments + (
+            [self.TMP_PATH] if os.path.exists(self.TMP_PATH) else []
+        )
+        path_merged: str = f"{self.TMP_PATH}.{len(self._segments)}"
+        with pq.ParquetWriter(path_merged, self.schema, **self._options) as writer:
+            for path in paths:
+                file: pq.ParquetFile = pq.ParquetFile(path)
+                for i in range(file.num_row_groups):
+                    writer.write_table(
+                        _conform_table(file.read_row_group(i), self.schema),
+                        row_group_size=self.ROW_GROUP_SIZE,
+                    )
+        for path in paths:
+            os.remove(path)
+        os.replace(path_merged, self.TMP_PATH)
+        self._segments = []
+
+    def _conform_parts(self):
+        # rewrites the parts written before the schema was widened, the partition keys are in the path
+        schema: pa.Schema = pa.schema(
+            [f for f in self.schema if f.name not in PARTITION_SCHEMA.names]
+        )
+        for path in glob(os.path.join(self.TMP_PATH, "**", "*.parquet"), recursive=True):
+            if pq.read_schema(path).equals(schema):
+                continue
+            table: pa.Table = _conform_table(pq.ParquetFile(path).read(), schema)
+            pq.write_table(
+                table,
+                f"{path}.tmp",
+                row_group_size=self.ROW_GROUP_SIZE,
+                **self._options,
+            )
+            os.replace(f"{path}.tmp", path)
+
+    def abort(self):
+        """
+        Discards the data written so far, the existing output is kept.
+        """
+        self._pending = []
+        self._pending_rows = 0
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        for path in self._segments:
+            if os.path.exists(path):
+                os.remove(path)
+        self._segments = []
+        if os.path.isdir(self.TMP_PATH):
+            shutil.rmtree(self.TMP_PATH, ignore_errors=True)
+        elif os.path.exists(self.TMP_PATH):
+            os.remove(self.TMP_PATH)
@@ -0,0 +1,296 @@
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Any, Optional
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+# set by `hdcli run --metrics-dir`, the metrics file of the running script
+METRICS_ENV = "HDCUTIL_METRICS_FILE"
+
+# set by `hdcli run`, the id of the run shared by its scripts
+RUN_ID_ENV = "HDCUTIL_RUN_ID"
+
+
+def new_run_id() -> str:
+    """
+    Returns a new run id, the start time and the process id.
+    """
+    return f"{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+
+
+# the run id of a script started without hdcli run
+_RUN_ID: str = new_run_id()
+
+
+def get_run_id() -> str:
+    """
+    Returns the run id of the environment, or of this process when started without hdcli run.
+    """
+    return os.environ.get(RUN_ID_ENV) or _RUN_ID
+
+
+def get_peak_rss() -> Optional[int]:
+    """
+    Returns the peak resident set size of the process in bytes, None if unknown.
+    """
+    if resource is None:
+        return None
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_metrics_path(hdcfile, pname: str) -> str:
+    """
+    Returns the metrics file of a script, from the environment or next to its output.
+    Every run rewrites it, a script that did not run keeps the file of an earlier run,
+    so the records carry the run id and aggregate only keeps those of one run.
+
+    Args:
+        hdcfile (HDCFiles): The storage of the output.
+        pname (str): The output_filename of the script.
+
+    Returns:
+        str: The metrics file, `{BASE_PATH}/{BUDGET_YEAR}/{pname}/_metrics.jsonl`.
+    """
+    path: Optional[str] = os.environ.get(METRICS_ENV)
+    if path:
+        return path
+    # not a parquet file, never read back as data of pname
+    return os.path.join(hdcfile.BASE_PATH, hdcfile.BUDGET_YEAR, pname, "_metrics.jsonl")
+
+
+class HospcodeMetric:
+    def __init__(self, hdcfile, i: int, hospcode: str):
+        """
+        Measures the processing of one hospcode, created by RunMetrics.start.
+        It only reads counters, so it can be created and finished in a forked worker.
+
+        Args:
+            hdcfile (HDCFiles): The storage read by the processing code.
+            i (int): The position of the hospcode, 1-based.
+            hospcode (str): The hospital code.
+
+        Returns:
+            None
+        """
+        self.hdcfile = hdcfile
+        self.i = i
+        self.hospcode = hospcode
+        self._wall: float = time.perf_counter()
+        self._cpu: float = time.process_time()
+        self._rss: Optional[int] = get_peak_rss()
+        self._rows_read: int = hdcfile.rows_read
+        self._read_seconds: float = hdcfile.read_seconds
+
+    def finish(
+        self,
+        status: str,
+        rows_out: int = 0,
+        exception: Optional[BaseException] = None,
+    ) -> dict:
+        """
+        Returns the record of the hospcode.
+
+        Args:
+            status (str): "success", "ignore" or "error".
+            rows_out (int, optional): The rows written. Defaults to 0.
+            exception (BaseException, optional): The error raised by the processing code. Defaults to None.
+
+        Returns:
+            dict: The "hospcode" record.
+        """
+        rss: Optional[int] = get_peak_rss()
+        return dict(
+            kind="hospcode",
+            pid=os.getpid(),
+            i=self.i,
+            hospcode=self.hospcode,
+            status=status,
+            wall_seconds=round(time.perf_counter() - self._wall, 6),
+            cpu_seconds=round(time.process_time() - self._cpu, 6),
+            # the peak only grows, 0 when the hospcode stayed under the previous peak
+            peak_rss_delta_bytes=None if rss is None else rss - self._rss,
+            rows_in=self.hdcfile.rows_read - self._rows_read,
+            rows_out=rows_out,
+            read_seconds=round(self.hdcfile.read_seconds - self._read_seconds, 6),
+            exception=None if exception is None else type(exception).__name__,
+            message=None if exception is None else str(exception),
+        )
+
+
+class RunMetrics:
+    def __init__(self, hdcfile, output_filename: str, path: Optional[str] = None):
+        """
+        Writes the metrics of a script as JSON lines, one "hospcode" record per processed
+        hospcode and a "run" record at the end. The file is rewritten by every run.
+
+        Args:
+            hdcfile (HDCFiles): The storage of the script.
+            output_filename (str): The output_filename of the script.
+            path (str, optional): The metrics file. Defaults to None is get_metrics_path.
+
+        Returns:
+            None
+        """
+        self.hdcfile = hdcfile
+        self.OUTPUT_FILENAME = output_filename
+        self.PATH: str = path or get_metrics_path(hdcfile, output_filename)
+        self.SCRIPT: str = os.path.abspath(sys.argv[0]) if sys.argv[0] else ""
+        self.RUN_ID: str = get_run_id()
+        self.STARTED: datetime = datetime.now()
+        self._wall: float = time.perf_counter()
+        self._times = os.times()
+        self.records: list[dict] = []
+        os.makedirs(os.path.dirname(os.path.abspath(self.PATH)), exist_ok=True)
+        self._file = open(self.PATH, "w")
+
+    def start(self, i: int, hospcode: str) -> HospcodeMetric:
+        return HospcodeMetric(self.hdcfile, i, hospcode)
+
+    def add(self, record: dict):
+        """
+        Writes a "hospcode" record, returned by HospcodeMetric.finish.
+
+        Args:
+            record (dict): The record.
+        """
+        self.records.append(record)
+        self._write(record)
+
+    def _write(self, record: dict):
+        # flushed per line, the records of a crashed run are kept
+        self._file.write(
+            json.dumps(
+                dict(output_filename=self.OUTPUT_FILENAME, run_id=self.RUN_ID, **record),
+                default=str,
+            )
+            + "\n"
+        )
+        self._file.flush()
+
+    def finish(self, writer=None, **extra: Any) -> dict:
+        """
+        Writes the "run" record and closes the file.
+
+        Args:
+            writer (HDCFilesWriter, optional): The writer of the output, for the write timings. Defaults to None.
+            **extra: Other values of the record.
+
+        Returns:
+            dict: The "run" record.
+        """
+        times = os.times()
+        statuses: list[str] = [r["status"] for r in self.records]
+        # reads of the script are counted by hdcfile, plus those of the forked workers
+        forked: list[dict] = [r for r in self.records if r["pid"] != os.getpid()]
+        output_bytes: int = 0
+        output_path: Optional[str] = None
+        if writer is not None:
+            output_path = writer.PATH
+            output_bytes = self.hdcfile.get_size(self.OUTPUT_FILENAME)
+        record: dict = dict(
+            kind="run",
+            script=self.SCRIPT,
+            budget_year=self.hdcfile.BUDGET_YEAR,
+            started=self.STARTED.isoformat(),
+            wall_seconds=round(time.perf_counter() - self._wall, 6),
+            # children are the forked workers, counted once they are joined
+            cpu_seconds=round(sum(times[:4]) - sum(self._times[:4]), 6),
+            peak_rss_bytes=get_peak_rss(),
+            hospcodes=len(self.records),
+            success=statuses.count("success"),
+            ignore=statuses.count("ignore"),
+            error=statuses.count("error"),
+            rows_in=self.hdcfile.rows_read + sum(r["rows_in"] for r in forked),
+            rows_out=sum(r["rows_out"] for r in self.records),
+            read_seconds=round(
+                self.hdcfile.read_seconds + sum(r["read_seconds"] for r in forked), 6
+            ),
+            write_seconds=None if writer is None else round(writer.write_seconds, 6),
+            close_seconds=None if writer is None else round(writer.close_seconds, 6),
+            output_path=output_path,
+            output_bytes=output_bytes,
+            **extra,
+        )
+        self._write(record)
+        self._file.close()
+        return record
+
+
+def read_metrics(path: str) -> list[dict]:
+    """
+    Reads the records of a metrics file.
+
+    Args:
+        path (str): The metrics file.
+
+    Returns:
+        list[dict]: The records, empty if the file does not exist.
+    """
+    records: list[dict] = []
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    except OSError:
+        pass
+    return records
+
+
+def aggregate(paths: list[str], top: int = 10, run_id: Optional[str] = None) -> dict:
+    """
+    Aggregates the metrics files of several scripts into one report.
+
+    Args:
+        paths (list[str]): The metrics files.
+        top (int, optional): Number of slowest hospcodes in the report. Defaults to 10.
+        run_id (str, optional): Only the records of this run, the files of scripts that did not run are stale. Defaults to None is all records.
+
+    Returns:
+        dict: The "run" record of each script, the totals of all scripts,
+            the slowest hospcodes and the errors.
+    """
+    runs: list[dict] = []
+    hospcodes: list[dict] = []
+    for path in paths:
+        records: list[dict] = read_metrics(path)
+        if run_id is not None:
+            records = [r for r in records if r.get("run_id") == run_id]
+        hospcodes += [r for r in records if r["kind"] == "hospcode"]
+        run: Optional[dict] = next((r for r in records if r["kind"] == "run"), None)
+        if run is None and len(records) > 0:
+            # the script did not finish, only its hospcode records were written
+            run = dict(kind="run", output_filename=records[0]["output_filename"])
+        if run is not None:
+            runs.append(dict(run, metrics_file=path))
+
+    totals: dict = dict(scripts=len(runs))
+    for name in [
+        "wall_seconds",
+        "cpu_seconds",
+        "hospcodes",
+        "success",
+        "ignore",
+        "error",
+        "rows_in",
+        "rows_out",
+        "read_seconds",
+        "write_seconds",
+        "close_seconds",
+        "output_bytes",
+    ]:
+        totals[name] = sum(r.get(name) or 0 for r in runs)
+    return dict(
+        runs=runs,
+        totals=totals,
+        slowest=sorted(hospcodes, key=lambda r: r["wall_seconds"], reverse=True)[:top],
+        errors=[r for r in hospcodes if r["status"] == "error"],
+    )
@@ -0,0 +1,219 @@
+import os
+import runpy
+import subprocess
+import sys
+import traceback
+from importlib import import_module
+from importlib.util import MAGIC_NUMBER
+from multiprocessing import get_context
+from queue import Queue
+from typing import Dict, Optional, Tuple
+
+# modules every built script imports, loaded once by the warm workers
+__WARM_MODULES__ = [
+    "pandas",
+    "numpy",
+    "pyarrow",
+    "pyarrow.dataset",
+    "pyarrow.parquet",
+    "sqlalchemy",
+    "s3fs",
+    "dacutil",
+    "hdcutil",
+]
+
+
+def get_log_paths(filename: str, log_dir: str) -> Tuple[str, str]:
+    """
+    Returns the stdout and stderr log files of a script.
+
+    Args:
+        filename (str): The script.
+        log_dir (str): The log directory.
+
+    Returns:
+        Tuple[str, str]: The stdout and stderr log files.
+    """
+    name: str = os.path.splitext(os.path.basename(filename))[0]
+    return (
+        os.path.join(log_dir, f"{name}.stdout.log"),
+        os.path.join(log_dir, f"{name}.stderr.log"),
+    )
+
+
+def get_executable(filename: str) -> str:
+    """
+    Returns the `.pyc` written by `hdcli build --bytecode` next to a script when it is
+    up to date and compiled for this interpreter, otherwise the script itself.
+
+    Args:
+        filename (str): The script.
+
+    Returns:
+        str: The file to execute.
+    """
+    if not filename.endswith(".py"):
+        return filename
+    filename_pyc: str = filename + "c"
+    try:
+        if os.stat(filename_pyc).st_mtime_ns < os.stat(filename).st_mtime_ns:
+            return filename
+        with open(filename_pyc, "rb") as f:
+            if f.read(len(MAGIC_NUMBER)) != MAGIC_NUMBER:
+                return filename
+    except OSError:
+        return filename
+    return filename_pyc
+
+
+def run_script(
+    filename: str, log_dir: Optional[str] = None, env: Optional[Dict[str, str]] = None
+) -> int:
+    """
+    Runs a script in a new interpreter.
+
+    Args:
+        filename (str): The script.
+        log_dir (str, optional): Directory to capture stdout/stderr of the script. Defaults to None is not captured.
+        env (Dict[str, str], optional): Environment variables added for the script. Defaults to None.
+
+    Returns:
+        int: The exit code of the script.
+    """
+    script_env: Optional[Dict[str, str]] = None
+    if env is not None:
+        script_env = dict(os.environ, **env)
+    args: list[str] = [sys.executable, get_executable(filename)]
+    if log_dir is None:
+        return subprocess.run(args, env=script_env).returncode
+    os.makedirs(log_dir, exist_ok=True)
+    stdout_path, stderr_path = get_log_paths(filename, log_dir)
+    with open(stdout_path, "w") as stdout, open(stderr_path, "w") as stderr:
+        return subprocess.run(
+            args, stdout=stdout, stderr=stderr, env=script_env
+        ).returncode
+
+
+def _init_warm_worker():
+    for name in __WARM_MODULES__:
+        try:
+            import_module(name)
+        except ImportError:
+            pass
+
+
+def _fork_script(
+    filename: str,
+    log_dir: Optional[str] = None,
+    env: Optional[Dict[str, str]] = None,
+) -> int:
+    # runs in a warm worker, the script runs in a forked child so it can not leak state
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid: int = os.fork()
+    if pid > 0:
+        _, status = os.waitpid(pid, 0)
+        return os.waitstatus_to_exitcode(status)
+
+    exit_code: int = 1
+    try:
+        if env is not None:
+            os.environ.update(env)
+        if log_dir is not None:
+            os.makedirs(log_dir, exist_ok=True)
+            stdout_path, stderr_path = get_log_paths(filename, log_dir)
+            for path, fd in [(stdout_path, 1), (stderr_path, 2)]:
+                log_fd: int = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                os.dup2(log_fd, fd)
+                os.close(log_fd)
+        sys.argv = [filename]
+        sys.path[0] = os.path.dirname(os.path.abspath(filename))
+        runpy.run_path(get_executable(filename), run_name="__main__")
+        exit_code = 0
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+
+
+def _warm_worker(conn):
+    _init_warm_worker()
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        conn.send(_fork_script(*task))
+    conn.close()
+
+
+class WarmPool:
+    def __init__(self, workers: int = 1):
+        """
+        Starts worker processes that import the heavy modules once, every script then runs
+        in a process forked from a warm worker instead of a new interpreter.
+        Create it before starting threads, workers are forked from the current process.
+
+        Args:
+            workers (int, optional): Number of warm workers. Defaults to 1.
+
+        Returns:
+            None
+        """
+        ctx = get_context("fork")
+        self._idle: Queue = Queue()
+        self._processes = []
+        for _ in range(max(workers, 1)):
+            conn, child_conn = ctx.Pipe()
+            # not daemonic, scripts may start their own process pool
+            process = ctx.Process(target=_warm_worker, args=(child_conn,), daemon=False)
+            process.start()
+            child_conn.close()
+            self._processes.append((process, conn))
+            self._idle.put(conn)
+
+    def run_script(
+        self,
+        filename: str,
+        log_dir: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None,
+    ) -> int:
+        """
+        Runs a script in a process forked from a warm worker, blocks until it ends.
+
+        Args:
+            filename (str): The script.
+            log_dir (str, optional): Directory to capture stdout/stderr of the script. Defaults to None is not captured.
+            env (Dict[str, str], optional): Environment variables added for the script. Defaults to None.
+
+        Returns:
+            int: The exit code of the script.
+        """
+        conn = self._idle.get()
+        try:
+            conn.send((filename, log_dir, env))
+            return conn.recv()
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        for process, conn in self._processes:
+            conn.send(None)
+            conn.close()
+            process.join()
+
+    def __enter__(self) -> "WarmPool":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,105 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable
+
+from .build_process import read_dependencies
+
+
+def build_graph(filenames: list[str]) -> dict[str, set[str]]:
+    """
+    Builds the dependency graph of built scripts, a script depends on the scripts
+    whose output_filename it reads with HDCFiles.
+
+    Args:
+        filenames (list[str]): The built scripts.
+
+    Raises:
+        Exception: If the scripts have a circular dependency.
+
+    Returns:
+        dict[str, set[str]]: The scripts each script depends on.
+    """
+    outputs: dict[str, str] = dict()
+    inputs: dict[str, set[str]] = dict()
+    for filename in filenames:
+        with open(filename, "r") as f:
+            try:
+                output_filename, pnames = read_dependencies(f.read())
+            except SyntaxError:
+                output_filename, pnames = "", set()
+        inputs[filename] = pnames
+        if output_filename != "":
+            outputs[output_filename] = filename
+
+    graph: dict[str, set[str]] = dict()
+    for filename in filenames:
+        graph[filename] = set(
+            outputs[p] for p in inputs[filename] if p in outputs
+        ).difference([filename])
+
+    # detect cycle, every script must be reachable in topological order
+    indegree: dict[str, int] = {f: len(deps) for f, deps in graph.items()}
+    ready: list[str] = [f for f, n in indegree.items() if n == 0]
+    visited: int = 0
+    while ready:
+        filename = ready.pop()
+        visited += 1
+        for f, deps in graph.items():
+            if filename in deps:
+                indegree[f] -= 1
+                if indegree[f] == 0:
+                    ready.append(f)
+    if visited != len(graph):
+        cycle = sorted(f for f, n in indegree.items() if n > 0)
+        raise Exception(f"Circular dependency: {', '.join(cycle)}")
+    return graph
+
+
+def run_graph(
+    graph: dict[str, set[str]], task: Callable[[str], int], workers: int = 1
+) -> dict[str, int | None]:
+    """
+    Runs the scripts of a dependency graph, a script is started as soon as all scripts
+    it depends on succeeded, scripts downstream of a failed script are skipped.
+
+    Args:
+        graph (dict[str, set[str]]): The scripts each script depends on, see build_graph.
+        task (Callable[[str], int]): Runs a script and returns its exit code.
+        workers (int, optional): Number of scripts running at the same time. Defaults to 1.
+
+    Returns:
+        dict[str, int | None]: The exit code of each script, None if it was skipped.
+    """
+    dependents: dict[str, set[str]] = {f: set() for f in graph}
+    for filename, deps in graph.items():
+        for dep in deps:
+            dependents[dep].add(filename)
+    waiting: dict[str, set[str]] = {f: set(deps) for f, deps in graph.items()}
+    results: dict[str, int | None] = dict()
+
+    def skip(filename: str):
+        for f in dependents[filename]:
+            if f not in results:
+                results[f] = None
+                waiting.pop(f, None)
+                skip(f)
+
+    with ThreadPoolExecutor(max(workers, 1)) as pool:
+        running: dict[Future, str] = dict()
+        while waiting or running:
+            for filename in [f for f, deps in waiting.items() if len(deps) == 0]:
+                del waiting[filename]
+                running[pool.submit(task, filename)] = filename
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                filename = running.pop(future)
+                try:
+                    results[filename] = future.result()
+                except Exception:
+                    results[filename] = -1
+                if results[filename] == 0:
+                    for f in dependents[filename]:
+                        if f in waiting:
+                            waiting[f].discard(filename)
+                else:
+                    skip(filename)
+    return results
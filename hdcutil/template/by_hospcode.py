@@ -30,6 +30,8 @@ from hdcutil import (
     IgnoreEmptyDataFrame,
     EmptyDataFrame,
 )
+from hdcutil.checkpoint import Checkpoint
+from hdcutil.metrics import RunMetrics
 
 init_pandas_options()
 
@@ -50,6 +52,14 @@ conf.BUDGET_YEAR = str(os.environ.get("BUDGET_YEAR", "2023"))
 conf.PROVINCE_CODE = os.environ.get("PROVINCE_CODE", "14")
 conf.PROCESS_DATETIME = datetime.now()
 conf.PROCESS_DATE = date.today()
+conf.OUTPUT_PARTITIONED = os.environ.get("OUTPUT_PARTITIONED", "false").lower() in [
+    "true",
+    "1",
+    "y",
+    "yes",
+]
+# parquet codec of the output, e.g. zstd for smaller files
+conf.OUTPUT_COMPRESSION = os.environ.get("OUTPUT_COMPRESSION", "snappy")
 
 
 b_year = int(conf.BUDGET_YEAR)
@@ -68,8 +78,23 @@ print(
 
 
 # setup read data and read lookup
-hdcfile = HDCFiles(conf.storage.base, conf.BUDGET_YEAR)
-colookup = CoLookup(conf.s3_lookup.dsn)
+hdcfile = HDCFiles(
+    conf.storage.base,
+    conf.BUDGET_YEAR,
+    cache_bytes=int(os.environ.get("HDCFILES_CACHE_MB", "0")) * 1024 * 1024,
+    # tables decoded once and memory-mapped by all scripts, e.g. HDCFILES_SHARED_CACHE_PNAMES=t_person_db
+    shared_cache_dir=os.environ.get("HDCFILES_SHARED_CACHE_DIR"),
+    shared_cache_pnames=(
+        os.environ["HDCFILES_SHARED_CACHE_PNAMES"].split(",")
+        if os.environ.get("HDCFILES_SHARED_CACHE_PNAMES")
+        else None
+    ),
+)
+colookup = CoLookup(
+    conf.s3_lookup.dsn,
+    cache_dir=os.environ.get("COLOOKUP_CACHE_DIR"),
+    cache_ttl=int(os.environ.get("COLOOKUP_CACHE_TTL", "0")),
+)
 
 
 output_filename: str = "filename_not_define"
@@ -89,58 +114,94 @@ process_error = []
 df_hospital: DataFrame = colookup.get_chospital(
     province_code=conf.PROVINCE_CODE, columns=["STATUS", "HOSPCODE", "CHW_CODE"]
 )
-list_hospcode: list[str] = df_hospital.loc[
-    (df_hospital["STATUS"] == 1) & (df_hospital["CHW_CODE"] == conf.PROVINCE_CODE),
-    "HOSPCODE",
-].tolist()
-len_hospcode: int = len(list_hospcode)
-
-## with write parquet one file
-
-_pathfile: str = hdcfile.get_path(
-    output_filename,
-    ALL_HOSPCODE,
+# sorted, the output is sorted by HOSPCODE only when the hospcodes are written in order
+list_hospcode: list[str] = sorted(
+    df_hospital.loc[
+        (df_hospital["STATUS"] == 1) & (df_hospital["CHW_CODE"] == conf.PROVINCE_CODE),
+        "HOSPCODE",
+    ].tolist()
 )
-_result_dfs: list[DataFrame] = []
-percent: int = 0
-for i, hospcode in enumerate(list_hospcode):
-    i += 1
-    _start_procsss_dt: datetime = datetime.now()
-    st_procss: datetime = datetime.now()
-    try:
-        # processing operation
-        df: DataFrame = DataFrame()
+len_hospcode: int = len(list_hospcode)
 
-        # ----
+# one json line per hospcode and one for the run, in HDCUTIL_METRICS_FILE or next to the output
+metrics = RunMetrics(hdcfile, output_filename)
 
-        __PROCESSING_CODE__: str = ""
+# with HDCUTIL_CHECKPOINT_DIR every completed hospcode is spilled, a rerun after a crash resumes them
+checkpoint = Checkpoint.from_env(hdcfile, output_filename, conf.PROVINCE_CODE)
 
-        # ----
+## with write parquet one file
 
-        # if process successful
-        if isinstance(df, DataFrame) and not df.empty:
+# stream each hospcode result to the output, it is moved into place when the loop ends
+with hdcfile.open_writer(
+    output_filename,
+    partitioned=conf.OUTPUT_PARTITIONED,
+    compression=conf.OUTPUT_COMPRESSION,
+) as _writer:
+    for i, hospcode in enumerate(list_hospcode):
+        i += 1
+        _start_procsss_dt: datetime = datetime.now()
+        st_procss: datetime = datetime.now()
+        _metric = metrics.start(i, hospcode)
+        _resumed = None if checkpoint is None else checkpoint.status(hospcode)
+        if _resumed is not None:
+            # completed by a previous run, its part is merged in hospcode order
+            _rows: int = 0
+            if _resumed == "success":
+                _rows = _writer.write(checkpoint.load(hospcode))
+                msg: str = f"[{i:4}][{datetime.now().isoformat():26}][{'resumed':14}][{hospcode:05}] Success "
+                print(msg)
+                process_summary.append(msg)
+            metrics.add(dict(_metric.finish(_resumed, rows_out=_rows), resumed=True))
+            continue
+        # the status of the hospcode, a `continue` of the processing code ignores it
+        _done = "ignore"
+        _rows: int = 0
+        _exception = None
+        try:
+            # processing operation
+            df: DataFrame = DataFrame()
+
+            # ----
+
+            __PROCESSING_CODE__: str = ""
+
+            # ----
+
+            # if process successful
+            if isinstance(df, DataFrame) and not df.empty:
+                _rows = _writer.write(df)
+                _done = "success"
+                delta = datetime.now() - _start_procsss_dt
+                msg: str = f"[{i:4}][{datetime.now().isoformat():26}][{str(delta):14}][{hospcode:05}] Success "
+                print(msg)
+                process_summary.append(msg)
+
+        except IgnoreEmptyDataFrame:
+            pass
+        except EmptyDataFrame:
+            pass
+        except Exception as e:
+            _done = "error"
+            _exception = e
             delta = datetime.now() - _start_procsss_dt
-            msg: str = f"[{i:4}][{datetime.now().isoformat():26}][{str(delta):14}][{hospcode:05}] Success "
+            msg = f"[{i:4}][{datetime.now().isoformat():26}][{str(delta):14}][{hospcode:05}] Error: {str(e)}"
             print(msg)
-            process_summary.append(msg)
-        _result_dfs.append(df.copy())
-
-    except IgnoreEmptyDataFrame:
-        pass
-    except EmptyDataFrame:
-        pass
-    except Exception as e:
-        delta = datetime.now() - _start_procsss_dt
-        msg = f"[{i:4}][{datetime.now().isoformat():26}][{str(delta):14}][{hospcode:05}] Error: {str(e)}"
-        print(msg)
-        process_error.append(msg)
-
-df = pd.concat(_result_dfs, ignore_index=True)
-df = hdcfile.fill_column(df)
-if not hdcfile.verify_df(df):
-    raise Exception("Dataframe is not correct.")
-
-df.to_parquet(_pathfile, engine="pyarrow", compression="snappy", index=False)
+            process_error.append(msg)
+        except BaseException:
+            # interrupted, the hospcode is neither recorded nor saved
+            _done = None
+            raise
+        finally:
+            # also reached by a `continue` of the processing code
+            if _done is not None:
+                metrics.add(_metric.finish(_done, rows_out=_rows, exception=_exception))
+            # the rows are written, a failed save is logged and the hospcode is processed again on resume
+            if checkpoint is not None and _done in ["success", "ignore"]:
+                checkpoint.save(hospcode, df if _done == "success" else None)
+_pathfile: str = _writer.PATH
+if checkpoint is not None:
+    # the output is complete, the next run starts again from the first hospcode
+    checkpoint.clear()
 
 
 print("------------ Summary Processing -------------")
@@ -151,17 +212,22 @@ print("Summary:", len(process_summary))
 print("Error:", len(process_error))
 
 
-filepath: str = hdcfile.get_path(output_filename, "_all_")
-if not os.path.exists(filepath):
+filepath: str = _pathfile
+if not hdcfile.has_path(output_filename, ALL_HOSPCODE):
     raise Exception("File not found: ", filepath)
-df: DataFrame = hdcfile.read_data(output_filename, ALL_HOSPCODE)
 
 print("ProcessDate:", conf.PROCESS_DATE.isoformat())
 print("ProcessTimestamp:", conf.PROCESS_DATETIME.isoformat())
 print("ProvinceCode:", conf.PROVINCE_CODE)
 print("BudgetYear:", conf.BUDGET_YEAR)
 print("Filename:", output_filename)
-print("Filesize:", "{:.2f}MB".format(os.stat(filepath).st_size / 1024 / 1024))
-print("Columns:", ",".join(df.columns.tolist()))
-print("RecordTotal:", f"{len(df):,}")
+print(
+    "Filesize:",
+    "{:.2f}MB".format(hdcfile.get_size(output_filename, ALL_HOSPCODE) / 1024 / 1024),
+)
+print("Columns:", ",".join(_writer.schema.names))
+print("RecordTotal:", f"{_writer.num_rows:,}")
 print("ProcessedTime:", datetime.now() - conf.PROCESS_DATETIME)
+
+metrics.finish(_writer, province_code=conf.PROVINCE_CODE)
+print("Metrics:", metrics.PATH)
@@ -0,0 +1,282 @@
+import os
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+from math import ceil
+from glob import glob
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Optional
+
+from datetime import datetime, date
+from pandas import DataFrame, Series, set_option
+from configparser import ConfigParser
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+import json
+
+
+from dacutil import (
+    get_config,
+    Addict,
+    datediff,
+    check_mod11,
+    df_strip,
+    worker,
+)
+
+from hdcutil import (
+    init_pandas_options,
+    CoLookup,
+    HDCFiles,
+    ALL_HOSPCODE,
+    IgnoreEmptyDataFrame,
+    EmptyDataFrame,
+)
+from hdcutil.checkpoint import Checkpoint
+from hdcutil.metrics import RunMetrics
+
+init_pandas_options()
+
+
+## for global variables
+conf: Addict = get_config(os.getenv("CONFIG_URI", "config.ini"))
+conf.unfreeze()
+# conf
+
+
+# # auto set variables
+current_b_year: int = (
+    date.today().month > 9 and date.today().year - 1 or date.today().year
+)
+
+# get config from enveronment
+conf.BUDGET_YEAR = str(os.environ.get("BUDGET_YEAR", "2023"))
+conf.PROVINCE_CODE = os.environ.get("PROVINCE_CODE", "14")
+conf.PROCESS_DATETIME = datetime.now()
+conf.PROCESS_DATE = date.today()
+# 1 by default, `hdcli run -w N` already runs N scripts at once
+conf.PROCESS_WORKERS = int(os.environ.get("PROCESS_WORKERS", conf.process.workers or 1))
+conf.OUTPUT_PARTITIONED = os.environ.get("OUTPUT_PARTITIONED", "false").lower() in [
+    "true",
+    "1",
+    "y",
+    "yes",
+]
+# parquet codec of the output, e.g. zstd for smaller files
+conf.OUTPUT_COMPRESSION = os.environ.get("OUTPUT_COMPRESSION", "snappy")
+
+
+b_year = int(conf.BUDGET_YEAR)
+b_date_start = datetime(b_year - 1, 10, 1, 0, 0, 0)
+b_date_end = datetime(b_year, 9, 30, 23, 59, 59, microsecond=999999)
+conf.BETWEEB_BUDGET_DATETIME = (b_date_start, b_date_end)
+conf.freeze(True)
+
+
+print(f"PROVINCE_CODE       : {conf.PROVINCE_CODE}")
+print(f"BUDGET_YEAR         : {conf.BUDGET_YEAR}")
+print(f"PROCESS_DATETIME    : {conf.PROCESS_DATETIME}")
+print(f"PROCESS_WORKERS     : {conf.PROCESS_WORKERS}")
+print(
+    f"BETWEEN_BUDGET      : {conf.BETWEEB_BUDGET_DATETIME[0]} - {conf.BETWEEB_BUDGET_DATETIME[1]}"
+)
+
+
+# setup read data and read lookup
+hdcfile = HDCFiles(
+    conf.storage.base,
+    conf.BUDGET_YEAR,
+    cache_bytes=int(os.environ.get("HDCFILES_CACHE_MB", "0")) * 1024 * 1024,
+    # tables decoded once and memory-mapped by all scripts, e.g. HDCFILES_SHARED_CACHE_PNAMES=t_person_db
+    shared_cache_dir=os.environ.get("HDCFILES_SHARED_CACHE_DIR"),
+    shared_cache_pnames=(
+        os.environ["HDCFILES_SHARED_CACHE_PNAMES"].split(",")
+        if os.environ.get("HDCFILES_SHARED_CACHE_PNAMES")
+        else None
+    ),
+)
+colookup = CoLookup(
+    conf.s3_lookup.dsn,
+    cache_dir=os.environ.get("COLOOKUP_CACHE_DIR"),
+    cache_ttl=int(os.environ.get("COLOOKUP_CACHE_TTL", "0")),
+)
+
+
+output_filename: str = "filename_not_define"
+
+# ---
+
+__PYSCRIPT_PARAMETERS__ = None
+
+# ---
+
+
+# procssing variables
+process_summary = []
+process_error = []
+
+# list hospcode
+df_hospital: DataFrame = colookup.get_chospital(
+    province_code=conf.PROVINCE_CODE, columns=["STATUS", "HOSPCODE", "CHW_CODE"]
+)
+# sorted, the output is sorted by HOSPCODE only when the hospcodes are written in order
+list_hospcode: list[str] = sorted(
+    df_hospital.loc[
+        (df_hospital["STATUS"] == 1) & (df_hospital["CHW_CODE"] == conf.PROVINCE_CODE),
+        "HOSPCODE",
+    ].tolist()
+)
+len_hospcode: int = len(list_hospcode)
+
+# one json line per hospcode and one for the run, in HDCUTIL_METRICS_FILE or next to the output
+metrics = RunMetrics(hdcfile, output_filename)
+
+# with HDCUTIL_CHECKPOINT_DIR every completed hospcode is spilled, a rerun after a crash resumes them
+checkpoint: Optional[Checkpoint] = Checkpoint.from_env(
+    hdcfile, output_filename, conf.PROVINCE_CODE
+)
+
+## with write parquet one file
+
+
+# the processing code runs in this function instead of the loop of by_hospcode, the build rejects
+# `continue`/`break` (raise IgnoreEmptyDataFrame instead), assigning names defined outside the
+# processing code and changing their objects, e.g. `results.append(df)`: in a forked worker
+# nothing is shared across hospcodes, only the returned df is written to the output
+def _process_hospcode(
+    args: tuple[int, str]
+) -> tuple[str, Optional[DataFrame], str, dict]:
+    # runs in a forked worker, inputs loaded above are shared read-only with the parent
+    i, hospcode = args
+    _start_procsss_dt: datetime = datetime.now()
+    st_procss: datetime = datetime.now()
+    _metric = metrics.start(i, hospcode)
+    if checkpoint is not None and checkpoint.status(hospcode) is not None:
+        # completed by a previous run, its part is loaded by the parent
+        return "resumed", None, "", _metric.finish(checkpoint.status(hospcode))
+    try:
+        # processing operation
+        df: DataFrame = DataFrame()
+
+        # ----
+
+        __PROCESSING_CODE__: str = ""
+
+        # ----
+
+        # if process successful
+        if isinstance(df, DataFrame) and not df.empty:
+            delta = datetime.now() - _start_procsss_dt
+            msg: str = f"[{i:4}][{datetime.now().isoformat():26}][{str(delta):14}][{hospcode:05}] Success "
+            return "success", df, msg, _metric.finish("success", rows_out=len(df))
+        return "ignore", None, "", _metric.finish("ignore")
+
+    except IgnoreEmptyDataFrame:
+        return "ignore", None, "", _metric.finish("ignore")
+    except EmptyDataFrame:
+        return "ignore", None, "", _metric.finish("ignore")
+    except Exception as e:
+        delta = datetime.now() - _start_procsss_dt
+        msg = f"[{i:4}][{datetime.now().isoformat():26}][{str(delta):14}][{hospcode:05}] Error: {str(e)}"
+        return "error", None, msg, _metric.finish("error", exception=e)
+
+
+_tasks = enumerate(list_hospcode, start=1)
+if conf.PROCESS_WORKERS > 1:
+    _pool = ProcessPoolExecutor(conf.PROCESS_WORKERS, mp_context=get_context("fork"))
+    # submitted and read in order, a worker killed mid-task (OOM, segfault, os._exit)
+    # raises BrokenProcessPool instead of leaving the run waiting for its result
+    _futures = deque(_pool.submit(_process_hospcode, _task) for _task in _tasks)
+    _results = (_futures.popleft().result() for _ in range(len(_futures)))
+else:
+    _pool = None
+    _results = map(_process_hospcode, _tasks)
+
+# results arrive in list_hospcode order, the output is the same as the sequential template
+try:
+    with hdcfile.open_writer(
+        output_filename,
+        partitioned=conf.OUTPUT_PARTITIONED,
+        compression=conf.OUTPUT_COMPRESSION,
+    ) as _writer:
+        for _status, _df, msg, _record in _results:
+            _resumed: bool = _status == "resumed"
+            if _resumed:
+                _status = _record["status"]
+                _record = dict(_record, resumed=True)
+                if _status == "success":
+                    _df = checkpoint.load(_record["hospcode"])
+                    _record["rows_out"] = len(_df)
+                    msg = f"[{_record['i']:4}][{datetime.now().isoformat():26}][{'resumed':14}][{_record['hospcode']:05}] Success "
+            if _status == "success":
+                try:
+                    _writer.write(_df)
+                except Exception as e:
+                    msg = msg.replace("] Success ", f"] Error: {str(e)}")
+                    print(msg)
+                    process_error.append(msg)
+                    metrics.add(
+                        dict(
+                            _record,
+                            status="error",
+                            rows_out=0,
+                            exception=type(e).__name__,
+                            message=str(e),
+                        )
+                    )
+                    continue
+                print(msg)
+                process_summary.append(msg)
+                # the rows are written, a failed save is logged and the hospcode is processed again on resume
+                if checkpoint is not None and not _resumed:
+                    checkpoint.save(_record["hospcode"], _df)
+            elif _status == "error":
+                print(msg)
+                process_error.append(msg)
+            elif checkpoint is not None and not _resumed:
+                checkpoint.save(_record["hospcode"])
+            metrics.add(_record)
+except BaseException:
+    if _pool is not None:
+        # the workers still running are stopped, a failed run never leaves forked processes behind
+        for _process in list((_pool._processes or {}).values()):
+            _process.terminate()
+    raise
+finally:
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+_pathfile: str = _writer.PATH
+if checkpoint is not None:
+    # the output is complete, the next run starts again from the first hospcode
+    checkpoint.clear()
+
+
+print("------------ Summary Processing -------------")
+
+print("SummaryDetail:", json.dumps(process_summary))
+print("ErrorDetail:", json.dumps(process_error))
+print("Summary:", len(process_summary))
+print("Error:", len(process_error))
+
+
+filepath: str = _pathfile
+if not hdcfile.has_path(output_filename, ALL_HOSPCODE):
+    raise Exception("File not found: ", filepath)
+
+print("ProcessDate:", conf.PROCESS_DATE.isoformat())
+print("ProcessTimestamp:", conf.PROCESS_DATETIME.isoformat())
+print("ProvinceCode:", conf.PROVINCE_CODE)
+print("BudgetYear:", conf.BUDGET_YEAR)
+print("Filename:", output_filename)
+print(
+    "Filesize:",
+    "{:.2f}MB".format(hdcfile.get_size(output_filename, ALL_HOSPCODE) / 1024 / 1024),
+)
+print("Columns:", ",".join(_writer.schema.names))
+print("RecordTotal:", f"{_writer.num_rows:,}")
+print("ProcessedTime:", datetime.now() - conf.PROCESS_DATETIME)
+
+metrics.finish(_writer, province_code=conf.PROVINCE_CODE, workers=conf.PROCESS_WORKERS)
+print("Metrics:", metrics.PATH)
@@ -0,0 +1,218 @@
+import os
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+from math import ceil
+from glob import glob
+from typing import Optional
+
+from datetime import datetime, date
+from pandas import DataFrame, Series, set_option
+from configparser import ConfigParser
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+import json
+
+
+from dacutil import (
+    get_config,
+    Addict,
+    datediff,
+    check_mod11,
+    df_strip,
+    worker,
+)
+
+from hdcutil import (
+    init_pandas_options,
+    CoLookup,
+    HDCFiles,
+    ALL_HOSPCODE,
+    IgnoreEmptyDataFrame,
+    EmptyDataFrame,
+)
+from hdcutil.metrics import RunMetrics
+
+init_pandas_options()
+
+
+## for global variables
+conf: Addict = get_config(os.getenv("CONFIG_URI", "config.ini"))
+conf.unfreeze()
+# conf
+
+
+# # auto set variables
+current_b_year: int = (
+    date.today().month > 9 and date.today().year - 1 or date.today().year
+)
+
+# get config from enveronment
+conf.BUDGET_YEAR = str(os.environ.get("BUDGET_YEAR", "2023"))
+conf.PROVINCE_CODE = os.environ.get("PROVINCE_CODE", "14")
+conf.PROCESS_DATETIME = datetime.now()
+conf.PROCESS_DATE = date.today()
+conf.OUTPUT_PARTITIONED = os.environ.get("OUTPUT_PARTITIONED", "false").lower() in [
+    "true",
+    "1",
+    "y",
+    "yes",
+]
+# parquet codec of the output, e.g. zstd for smaller files
+conf.OUTPUT_COMPRESSION = os.environ.get("OUTPUT_COMPRESSION", "snappy")
+
+
+b_year = int(conf.BUDGET_YEAR)
+b_date_start = datetime(b_year - 1, 10, 1, 0, 0, 0)
+b_date_end = datetime(b_year, 9, 30, 23, 59, 59, microsecond=999999)
+conf.BETWEEB_BUDGET_DATETIME = (b_date_start, b_date_end)
+conf.freeze(True)
+
+
+print(f"PROVINCE_CODE       : {conf.PROVINCE_CODE}")
+print(f"BUDGET_YEAR         : {conf.BUDGET_YEAR}")
+print(f"PROCESS_DATETIME    : {conf.PROCESS_DATETIME}")
+print(
+    f"BETWEEN_BUDGET      : {conf.BETWEEB_BUDGET_DATETIME[0]} - {conf.BETWEEB_BUDGET_DATETIME[1]}"
+)
+
+
+# setup read data and read lookup
+hdcfile = HDCFiles(
+    conf.storage.base,
+    conf.BUDGET_YEAR,
+    cache_bytes=int(os.environ.get("HDCFILES_CACHE_MB", "0")) * 1024 * 1024,
+    # tables decoded once and memory-mapped by all scripts, e.g. HDCFILES_SHARED_CACHE_PNAMES=t_person_db
+    shared_cache_dir=os.environ.get("HDCFILES_SHARED_CACHE_DIR"),
+    shared_cache_pnames=(
+        os.environ["HDCFILES_SHARED_CACHE_PNAMES"].split(",")
+        if os.environ.get("HDCFILES_SHARED_CACHE_PNAMES")
+        else None
+    ),
+)
+colookup = CoLookup(
+    conf.s3_lookup.dsn,
+    cache_dir=os.environ.get("COLOOKUP_CACHE_DIR"),
+    cache_ttl=int(os.environ.get("COLOOKUP_CACHE_TTL", "0")),
+)
+
+
+output_filename: str = "filename_not_define"
+
+# ---
+
+__PYSCRIPT_PARAMETERS__ = None
+
+# ---
+
+
+# procssing variables
+process_summary = []
+process_error = []
+
+# list hospcode
+df_hospital: DataFrame = colookup.get_chospital(
+    province_code=conf.PROVINCE_CODE, columns=["STATUS", "HOSPCODE", "CHW_CODE"]
+)
+list_hospcode: list[str] = df_hospital.loc[
+    (df_hospital["STATUS"] == 1) & (df_hospital["CHW_CODE"] == conf.PROVINCE_CODE),
+    "HOSPCODE",
+].tolist()
+len_hospcode: int = len(list_hospcode)
+
+# one json line for the processing and one for the run, in HDCUTIL_METRICS_FILE or next to the output
+metrics = RunMetrics(hdcfile, output_filename)
+
+## process the whole province at once, list_hospcode and df_hospital are available
+
+_start_procsss_dt: datetime = datetime.now()
+st_procss: datetime = datetime.now()
+hospcode: str = ALL_HOSPCODE
+df: DataFrame = DataFrame()
+_metric = metrics.start(0, hospcode)
+_exception: Optional[Exception] = None
+try:
+    # processing operation
+
+    # ----
+
+    __PROCESSING_CODE__: str = ""
+
+    # ----
+
+except IgnoreEmptyDataFrame:
+    df = DataFrame()
+except EmptyDataFrame:
+    df = DataFrame()
+except Exception as e:
+    delta = datetime.now() - _start_procsss_dt
+    msg = f"[{0:4}][{datetime.now().isoformat():26}][{str(delta):14}][{hospcode:05}] Error: {str(e)}"
+    print(msg)
+    process_error.append(msg)
+    df = DataFrame()
+    _exception = e
+
+_record_hospcode: dict[str, int] = dict()
+if isinstance(df, DataFrame) and not df.empty:
+    df = hdcfile.fill_column(df)
+    if not hdcfile.verify_df(df):
+        raise Exception("Dataframe is not correct.")
+
+    # per hospcode summary, same format as the by_hospcode template
+    _record_hospcode = df["HOSPCODE"].astype("string").value_counts().to_dict()
+    delta = datetime.now() - _start_procsss_dt
+    for i, hospcode in enumerate(list_hospcode, start=1):
+        if _record_hospcode.get(hospcode, 0) > 0:
+            msg: str = f"[{i:4}][{datetime.now().isoformat():26}][{str(delta):14}][{hospcode:05}] Success "
+            print(msg)
+            process_summary.append(msg)
+
+if _exception is not None:
+    metrics.add(_metric.finish("error", exception=_exception))
+elif df.empty:
+    metrics.add(_metric.finish("ignore"))
+else:
+    metrics.add(_metric.finish("success", rows_out=len(df)))
+
+with hdcfile.open_writer(
+    output_filename,
+    partitioned=conf.OUTPUT_PARTITIONED,
+    fill_column=False,
+    compression=conf.OUTPUT_COMPRESSION,
+) as _writer:
+    _writer.write(df)
+_pathfile: str = _writer.PATH
+
+
+print("------------ Summary Processing -------------")
+
+print("SummaryDetail:", json.dumps(process_summary))
+print("ErrorDetail:", json.dumps(process_error))
+print("Summary:", len(process_summary))
+print("Error:", len(process_error))
+print("RecordByHospcode:", json.dumps(_record_hospcode))
+
+
+filepath: str = _pathfile
+if not hdcfile.has_path(output_filename, ALL_HOSPCODE):
+    raise Exception("File not found: ", filepath)
+
+print("ProcessDate:", conf.PROCESS_DATE.isoformat())
+print("ProcessTimestamp:", conf.PROCESS_DATETIME.isoformat())
+print("ProvinceCode:", conf.PROVINCE_CODE)
+print("BudgetYear:", conf.BUDGET_YEAR)
+print("Filename:", output_filename)
+print(
+    "Filesize:",
+    "{:.2f}MB".format(hdcfile.get_size(output_filename, ALL_HOSPCODE) / 1024 / 1024),
+)
+print("Columns:", ",".join(_writer.schema.names))
+print("RecordTotal:", f"{_writer.num_rows:,}")
+print("ProcessedTime:", datetime.now() - conf.PROCESS_DATETIME)
+
+metrics.finish(
+    _writer,
+    province_code=conf.PROVINCE_CODE,
+    record_by_hospcode=_record_hospcode,
+)
+print("Metrics:", metrics.PATH)
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import tempfile
+from threading import Lock
+from typing import Callable, Optional
+
+# set by `hdcli run --incremental`, scripts append the files they read and write to it
+TRACE_ENV = "HDCUTIL_TRACE_FILE"
+
+# environment variables of the template changing the inputs and output of a script
+__TRACKED_ENV__ = [
+    "CONFIG_URI",
+    "BUDGET_YEAR",
+    "PROVINCE_CODE",
+    "OUTPUT_PARTITIONED",
+    "OUTPUT_COMPRESSION",
+]
+
+
+def file_signature(path: str) -> dict:
+    """
+    Returns the path, mtime and size of a local file, size is -1 if the file does not exist.
+
+    Args:
+        path (str): The file.
+
+    Returns:
+        dict: The signature of the file.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return dict(path=os.path.abspath(path), mtime_ns=0, size=-1)
+    return dict(path=os.path.abspath(path), mtime_ns=st.st_mtime_ns, size=st.st_size)
+
+
+def _record(kind: str, signature: dict):
+    trace_file: Optional[str] = os.environ.get(TRACE_ENV)
+    if not trace_file:
+        return
+    # one short line per write, appends of concurrent writers do not interleave
+    with open(trace_file, "a") as f:
+        f.write(json.dumps(dict(kind=kind, **signature)) + "\n")
+
+
+def record_input(path: str, etag: Optional[str] = None):
+    """
+    Records a file read by the running script when tracing is enabled.
+
+    Args:
+        path (str): The local file, or the s3 path when etag is given.
+        etag (str, optional): The ETag of an s3 object. Defaults to None is a local file.
+    """
+    if not os.environ.get(TRACE_ENV):
+        return
+    _record("input", file_signature(path) if etag is None else dict(path=path, etag=etag))
+
+
+def record_output(path: str):
+    """
+    Records a file or directory written by the running script when tracing is enabled.
+
+    Args:
+        path (str): The output path.
+    """
+    if not os.environ.get(TRACE_ENV):
+        return
+    _record("output", file_signature(path))
+
+
+def read_trace(trace_file: str) -> dict:
+    """
+    Reads the inputs and outputs recorded by a script.
+
+    Args:
+        trace_file (str): The trace file.
+
+    Returns:
+        dict: The unique "inputs" and "outputs" signatures, the last record of a path wins.
+    """
+    records: dict = dict(input=dict(), output=dict())
+    try:
+        with open(trace_file, "r") as f:
+            for line in f:
+                record: dict = json.loads(line)
+                records[record.pop("kind")][record["path"]] = record
+    except OSError:
+        pass
+    # the previous output read back by the script is not an input
+    outputs: list[str] = list(records["output"].keys())
+    inputs: list[dict] = [
+        r
+        for path, r in records["input"].items()
+        if not any(path == o or path.startswith(o + os.sep) for o in outputs)
+    ]
+    return dict(inputs=inputs, outputs=list(records["output"].values()))
+
+
+def script_key(filename: str) -> str:
+    """
+    Returns the hash of a script content and the environment variables changing its result.
+
+    Args:
+        filename (str): The script.
+
+    Returns:
+        str: The sha256 hex digest.
+    """
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        h.update(f.read())
+    for name in __TRACKED_ENV__:
+        h.update(f"{name}={os.environ.get(name, '')}\n".encode())
+    return h.hexdigest()
+
+
+class RunState:
+    def __init__(self, state_file: str, get_etag: Optional[Callable[[str], str]] = None):
+        """
+        The inputs, outputs and script hash of the last successful run of each script,
+        used by `hdcli run --incremental` to skip scripts that are up to date.
+
+        Args:
+            state_file (str): The json file of the state.
+            get_etag (Callable[[str], str], optional): Returns the current ETag of an s3 path. Defaults to None is s3 inputs are always changed.
+
+        Returns:
+            None
+        """
+        self.STATE_FILE = state_file
+        self.get_etag = get_etag
+        self._lock = Lock()
+        self.state: dict = dict()
+        try:
+            with open(state_file, "r") as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def check(self, filename: str) -> tuple[bool, str]:
+        """
+        Checks if a script must run.
+
+        Args:
+            filename (str): The script.
+
+        Returns:
+            tuple[bool, str]: True if the script must run, and the reason.
+        """
+        with self._lock:
+            last: Optional[dict] = self.state.get(os.path.abspath(filename))
+        if last is None:
+            return True, "no previous run"
+        if last["key"] != script_key(filename):
+            return True, "script or environment changed"
+        for record in last["outputs"]:
+            if file_signature(record["path"]) != record:
+                return True, f"output changed: {record['path']}"
+        for record in last["inputs"]:
+            if "etag" in record:
+                try:
+                    etag: Optional[str] = (
+                        None if self.get_etag is None else self.get_etag(record["path"])
+                    )
+                except Exception:
+                    etag = None
+                if etag != record["etag"]:
+                    return True, f"input changed: {record['path']}"
+            elif file_signature(record["path"]) != record:
+                return True, f"input changed: {record['path']}"
+        return False, "inputs and script are unchanged"
+
+    def new_trace_file(self) -> str:
+        fd, trace_file = tempfile.mkstemp(prefix="hdcutil-trace-", suffix=".jsonl")
+        os.close(fd)
+        return trace_file
+
+    def update(self, filename: str, key: str, trace_file: str, exit_code: int):
+        """
+        Records the run of a script and writes the state file atomically,
+        a failed run is removed so the script runs again.
+
+        Args:
+            filename (str): The script.
+            key (str): The script_key before the run.
+            trace_file (str): The trace file of the run, removed.
+            exit_code (int): The exit code of the run.
+        """
+        trace: dict = read_trace(trace_file)
+        os.remove(trace_file)
+        with self._lock:
+            if exit_code == 0:
+                self.state[os.path.abspath(filename)] = dict(key=key, **trace)
+            else:
+                self.state.pop(os.path.abspath(filename), None)
+            state_dir: str = os.path.dirname(os.path.abspath(self.STATE_FILE))
+            fd, tmp_path = tempfile.mkstemp(dir=state_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.state, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.STATE_FILE)
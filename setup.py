@@ -22,6 +22,7 @@ setup(
     # long_description=long_description,
     # long_description_content_type="text/markdown",
     install_requires=open("requirements.txt").readlines(),
+    extras_require={"query": ["duckdb>=0.10.0"]},
     packages=find_packages(),
     python_requires=">=3.8",
     classifiers=[
@@ -0,0 +1,115 @@
+import itertools
+import json
+import logging
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+_buckets = itertools.count()
+
+
+@pytest.fixture(scope="session")
+def s3_endpoint():
+    # a local s3 stand-in, like benchmarks/run.py
+    moto_server = pytest.importorskip("moto.server")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = moto_server.ThreadedMotoServer(
+        ip_address="127.0.0.1", port=0, verbose=False
+    )
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+
+class S3Lookup:
+    def __init__(self, endpoint: str):
+        from s3fs import S3FileSystem
+
+        self.fs = S3FileSystem(key="test", secret="test", endpoint_url=endpoint)
+        self.bucket = f"lookup-{next(_buckets)}"
+        self.fs.mkdir(self.bucket)
+        host_port: str = endpoint.split("://", 1)[1]
+        self.uri = f"s3://test:test@{host_port}/{self.bucket}/lookup?use_ssl=false"
+
+    def put(self, name: str, df: pd.DataFrame, tmp_path) -> str:
+        # uploads df as {name}.parquet, returns its ETag
+        path_local = tmp_path / f"{name}.upload.parquet"
+        df.to_parquet(path_local, index=False)
+        s3_path = f"{self.bucket}/lookup/{name}.parquet"
+        self.fs.put_file(str(path_local), s3_path)
+        return self.fs.info(s3_path, refresh=True)["ETag"]
+
+
+@pytest.fixture
+def s3_lookup(s3_endpoint) -> S3Lookup:
+    return S3Lookup(s3_endpoint)
+
+
+def chospital(n: int = 3, province: str = "14") -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "HOSCODE": [f"{10001 + i}" for i in range(n)],
+            "HOSPCODE": [f"{10001 + i}" for i in range(n)],
+            "CHW_CODE": [province] * (n - 1) + ["99"],
+            "STATUS": [1] * n,
+        }
+    )
+
+
+class BuiltScript:
+    def __init__(self, tmp_path, process: str, name: str = "s_ck"):
+        # a notebook built with the by_hospcode template, over 4 hospcodes of province 14
+        # and a local lookup; the processing code is given, it reads df_person
+        from hdcutil.build_process import build_file
+        from hdcutil.hdcfile import ALL_HOSPCODE, HDCFiles
+
+        pytest.importorskip("dacutil")
+        storage = tmp_path / "storage"
+        self.hdcfile = HDCFiles(str(storage), 2024)
+        hospcodes = ["10001", "10002", "10003", "10004"]
+        person = pd.DataFrame(
+            {
+                "HOSPCODE": [h for h in hospcodes for _ in range(3)],
+                "CID": [str(i) for i in range(12)],
+                "CK_CID": [1] * 12,
+                "SEX": ["1", "2", "2"] * 4,
+            }
+        )
+        self.hdcfile.write_data("t_person_db", ALL_HOSPCODE, person)
+        (tmp_path / "lookup").mkdir()
+        chospital(5).to_parquet(tmp_path / "lookup" / "chospital.parquet")
+        (tmp_path / "config.ini").write_text(
+            f"[storage]\nbase = {storage}\n\n[s3_lookup]\ndsn = file://{tmp_path}/lookup\n"
+        )
+
+        cells = [
+            dict(
+                cell_type="code",
+                metadata=dict(tags=["parameters"]),
+                source="df_person = hdcfile.read_person_cid(columns=['HOSPCODE', 'CID', 'SEX'])\n",
+            ),
+            dict(cell_type="code", metadata=dict(tags=["process"]), source=process),
+        ]
+        notebook = tmp_path / f"{name}.ipynb"
+        notebook.write_text(json.dumps(dict(cells=cells, metadata={})))
+        _, self.script, _ = build_file(str(notebook), str(tmp_path))
+        self.env = dict(
+            os.environ,
+            PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            CONFIG_URI=str(tmp_path / "config.ini"),
+            BUDGET_YEAR="2024",
+            PROVINCE_CODE="14",
+        )
+        self.env.pop("HDCUTIL_METRICS_FILE", None)
+        self.env.pop("HDCUTIL_CHECKPOINT_DIR", None)
+
+    def run(self, **env: str) -> int:
+        return subprocess.run(
+            [sys.executable, self.script],
+            env=dict(self.env, **env),
+            capture_output=True,
+        ).returncode
@@ -0,0 +1,67 @@
+import json
+import os
+
+import pytest
+
+from hdcutil.build_process import build, build_file
+from hdcutil.errors import BuildError
+
+
+def write_notebook(tmp_path, process: str, name: str = "s_test") -> str:
+    cells = [
+        dict(cell_type="markdown", metadata={}, source="# s_test"),
+        dict(
+            cell_type="code",
+            metadata=dict(tags=["parameters"]),
+            source=f'output_filename = "{name}"\n',
+        ),
+        dict(cell_type="code", metadata=dict(tags=["process"]), source=process),
+    ]
+    path = tmp_path / f"{name}.ipynb"
+    path.write_text(json.dumps(dict(cells=cells, metadata={}, nbformat=4)))
+    return str(path)
+
+
+def test_build(tmp_path):
+    process = "df = hdcfile.read_data('t_person_db', hospcode)\nfor i in range(2):\n    continue\n"
+    notebook = write_notebook(tmp_path, process)
+    assert "hdcfile.read_data('t_person_db', hospcode)" in build(notebook)
+    assert "def _process_hospcode" in build(
+        notebook, template_name="by_hospcode_parallel"
+    )
+
+    status, path, build_hash = build_file(notebook, str(tmp_path), bytecode=True)
+    assert (status, path) == ("success", str(tmp_path / "s_test.py"))
+    assert os.path.exists(tmp_path / "s_test.pyc")
+    assert (
+        build_file(notebook, str(tmp_path), known_hash=build_hash, bytecode=True)[0]
+        == "skipped"
+    )
+
+
+def test_build_syntax_error(tmp_path):
+    notebook = write_notebook(tmp_path, "df = 1\nif df\n    pass\n")
+    with pytest.raises(BuildError, match=r"s_test.ipynb: cell 3 line 2: .*if df"):
+        build(notebook)
+    # nothing is written
+    with pytest.raises(BuildError):
+        build_file(notebook, str(tmp_path))
+    assert os.listdir(tmp_path) == ["s_test.ipynb"]
+
+
+@pytest.mark.parametrize(
+    "process, error",
+    [
+        ("if hospcode == '1':\n    continue\n", "cell 3 line 2: 'continue' is not"),
+        ("x = 1\nglobal total\n", "cell 3 line 2: 'total' can not be shared"),
+        ("hdcfile = None\n", "cell 3 line 1: 'hdcfile' is defined outside"),
+        ("x = 1\nconf.X = 1\n", "cell 3 line 2: 'conf' is defined outside"),
+        ("x = 1\n\nALL_HOSPCODE.clear()\n", "cell 3 line 3: 'ALL_HOSPCODE.clear'"),
+    ],
+)
+def test_build_parallel_rejects(tmp_path, process, error):
+    notebook = write_notebook(tmp_path, process)
+    # the loop of by_hospcode supports it
+    build(notebook)
+    with pytest.raises(BuildError, match=error):
+        build(notebook, template_name="by_hospcode_parallel")
@@ -0,0 +1,95 @@
+import os
+
+import pandas as pd
+
+from hdcutil.cache import LRUCache
+from hdcutil.hdcfile import ALL_HOSPCODE, HDCFiles
+
+
+def test_lru_eviction():
+    cache = LRUCache(max_bytes=10)
+    assert cache.put("a", "A", 4)
+    assert cache.put("b", "B", 4)
+    assert cache.get("a") == "A"  # b is now the least recently used
+    assert cache.put("c", "C", 4)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+    assert cache.info() == dict(
+        hits=3,
+        misses=1,
+        evictions=1,
+        evicted_bytes=4,
+        items=2,
+        nbytes=8,
+        max_bytes=10,
+    )
+
+
+def test_lru_byte_budget():
+    cache = LRUCache(max_bytes=10)
+    # larger than the budget: not cached and nothing evicted
+    assert cache.put("a", "A", 6)
+    assert not cache.put("big", "BIG", 11)
+    assert cache.get("big") is None
+    assert cache.info()["evictions"] == 0
+
+    # replacing a key counts its new size only
+    assert cache.put("a", "AA", 9)
+    assert cache.nbytes == 9
+    assert cache.put("b", "B", 2)
+    assert cache.get("a") is None
+    assert cache.nbytes == 2
+
+    cache.clear()
+    assert cache.info()["items"] == 0
+    assert cache.nbytes == 0
+
+
+def test_read_cache(tmp_path):
+    hdcfile = HDCFiles(str(tmp_path), 2024, cache_bytes=2**20)
+    df = pd.DataFrame({"HOSPCODE": ["10001", "10002"], "AGE": [10, 20]})
+    hdcfile.write_data("t_person_db", ALL_HOSPCODE, df)
+
+    first = hdcfile.read_data("t_person_db")
+    first.loc[0, "AGE"] = 99
+    first["NEW"] = 1
+    # served from the cache, unchanged by the writes of the first caller
+    second = hdcfile.read_data("t_person_db")
+    assert second["AGE"].tolist() == [10, 20]
+    assert "NEW" not in second
+    assert hdcfile.cache_info()["hits"] == 1
+
+    # a rewritten file is a new key
+    df = pd.DataFrame({"HOSPCODE": ["10001", "10002", "10003"], "AGE": [30, 40, 50]})
+    hdcfile.write_data("t_person_db", ALL_HOSPCODE, df)
+    assert hdcfile.read_data("t_person_db")["AGE"].tolist() == [30, 40, 50]
+    assert hdcfile.cache_info()["misses"] == 2
+
+
+def test_shared_cache(tmp_path):
+    cache_dir = str(tmp_path / "shared")
+    hdcfile = HDCFiles(str(tmp_path), 2024, shared_cache_dir=cache_dir)
+    df = pd.DataFrame(
+        {
+            "HOSPCODE": ["10001", "10002", "10003"],
+            "SEX": ["1", "2", "1"],
+            "AGE": [1, 2, 3],
+        }
+    )
+    hdcfile.write_data("t_person_db", ALL_HOSPCODE, df)
+
+    # filtered in memory on a column that is not selected, or on OR groups
+    result = hdcfile.read_data(
+        "t_person_db", columns=["AGE"], filters=[("SEX", "==", "1")]
+    )
+    assert result.to_dict("list") == dict(AGE=[1, 3])
+    filters = [[("HOSPCODE", "==", "10002")], [("AGE", ">", 2)]]
+    result = hdcfile.read_data("t_person_db", columns=["HOSPCODE"], filters=filters)
+    assert result.to_dict("list") == dict(HOSPCODE=["10002", "10003"])
+    assert len(hdcfile.read_data("t_person_db")) == 3
+
+    # decoded once, then mapped
+    assert hdcfile.cache_info()["shared"]["misses"] == 1
+    assert len([f for f in os.listdir(cache_dir) if f.endswith(".arrow")]) == 1
@@ -0,0 +1,72 @@
+import os
+
+import pandas as pd
+
+from hdcutil.checkpoint import Checkpoint
+from hdcutil.hdcfile import ALL_HOSPCODE
+
+from conftest import BuiltScript
+
+
+def test_checkpoint(tmp_path):
+    script = tmp_path / "s_a.py"
+    script.write_text("print('s_a')\n")
+    base_dir = str(tmp_path / "checkpoint")
+    checkpoint = Checkpoint(base_dir, "s_a", "2024", "14", script=str(script))
+    assert checkpoint.save("10001", pd.DataFrame({"HOSPCODE": ["10001"], "N": [1]}))
+    assert checkpoint.save("10002", pd.DataFrame())
+    assert checkpoint.save("10003")
+
+    # the next run of the same script resumes them
+    checkpoint = Checkpoint(base_dir, "s_a", "2024", "14", script=str(script))
+    assert checkpoint.done == {"10001": "success", "10002": "ignore", "10003": "ignore"}
+    assert checkpoint.load("10001")["N"].tolist() == [1]
+    assert checkpoint.status("10004") is None
+    # other provinces are kept
+    other = Checkpoint(base_dir, "s_a", "2024", "15", script=str(script))
+    assert other.done == {}
+
+    # a changed script starts again and removes the parts of the old one
+    script.write_text("print('s_a changed')\n")
+    checkpoint = Checkpoint(base_dir, "s_a", "2024", "14", script=str(script))
+    assert checkpoint.done == {}
+    assert sorted(os.listdir(base_dir)) == sorted(
+        os.path.basename(c.RUN_DIR) for c in (checkpoint, other)
+    )
+    checkpoint.clear()
+    assert not os.path.exists(checkpoint.RUN_DIR)
+
+
+PROCESS = """\
+with open(os.environ["PROCESSED_FILE"], "a") as f:
+    f.write(hospcode + "\\n")
+if hospcode == os.environ.get("CRASH_AT"):
+    os._exit(9)
+if hospcode == "10002":
+    raise IgnoreEmptyDataFrame()
+df = df_person.loc[(df_person["HOSPCODE"] == hospcode)]
+df = df.groupby(["HOSPCODE", "SEX"], as_index=False).agg(TARGET=("CID", "count"))
+df["AREACODE"] = conf.PROVINCE_CODE
+"""
+
+
+def test_resume_after_crash(tmp_path):
+    built = BuiltScript(tmp_path, PROCESS)
+    processed = tmp_path / "processed.txt"
+    env = dict(
+        HDCUTIL_CHECKPOINT_DIR=str(tmp_path / "checkpoint"),
+        PROCESSED_FILE=str(processed),
+    )
+
+    assert built.run(CRASH_AT="10003", **env) == 9
+    assert processed.read_text().split() == ["10001", "10002", "10003"]
+    assert not built.hdcfile.has_path("s_ck", ALL_HOSPCODE)
+
+    # the rerun only processes the hospcodes after the last completed one
+    processed.unlink()
+    assert built.run(**env) == 0
+    assert processed.read_text().split() == ["10003", "10004"]
+    assert os.listdir(tmp_path / "checkpoint") == []
+    df = built.hdcfile.read_data("s_ck", ALL_HOSPCODE)
+    assert df["HOSPCODE"].unique().tolist() == ["10001", "10003", "10004"]
+    assert df["TARGET"].sum() == 9
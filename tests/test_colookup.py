@@ -0,0 +1,140 @@
+import json
+import os
+
+import pytest
+
+from hdcutil.colookup import CoLookup
+
+from conftest import chospital
+
+
+def cached_copies(cache_dir: str) -> list:
+    return sorted(
+        f for _, _, files in os.walk(cache_dir) for f in files if f.endswith(".parquet")
+    )
+
+
+def count_downloads(monkeypatch, colookup: CoLookup) -> list:
+    downloads = []
+    get_file = colookup.fs.get_file
+
+    def counted(rpath, lpath, **kwargs):
+        downloads.append(rpath)
+        return get_file(rpath, lpath, **kwargs)
+
+    monkeypatch.setattr(colookup.fs, "get_file", counted)
+    return downloads
+
+
+def test_fetch_cache_etag(s3_lookup, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    s3_lookup.put("chospital", chospital(3), tmp_path)
+    colookup = CoLookup(s3_lookup.uri, cache_dir=cache_dir)
+    downloads = count_downloads(monkeypatch, colookup)
+
+    assert len(colookup.read_pq("chospital")) == 3
+    # same ETag: revalidated, not downloaded again
+    assert len(colookup.read_pq("chospital")) == 3
+    assert len(downloads) == 1
+
+    # changed object: the new copy is downloaded and the old one removed
+    s3_lookup.put("chospital", chospital(5), tmp_path)
+    assert len(colookup.read_pq("chospital")) == 5
+    assert len(downloads) == 2
+    assert len(cached_copies(cache_dir)) == 1
+
+
+def test_fetch_cache_ttl(s3_lookup, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    s3_lookup.put("chospital", chospital(3), tmp_path)
+    colookup = CoLookup(s3_lookup.uri, cache_dir=cache_dir, cache_ttl=3600)
+    assert len(colookup.read_pq("chospital")) == 3
+
+    # within the ttl the copy is used without asking s3
+    s3_lookup.put("chospital", chospital(5), tmp_path)
+    assert len(colookup.read_pq("chospital")) == 3
+
+    # expired: revalidated and downloaded
+    for meta_file in (tmp_path / "cache").glob("*/chospital.parquet.json"):
+        meta = json.loads(meta_file.read_text())
+        meta_file.write_text(json.dumps(dict(meta, checked_at=0)))
+    assert len(colookup.read_pq("chospital")) == 5
+
+
+def test_fetch_cache_stale_when_unreachable(s3_lookup, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    s3_lookup.put("chospital", chospital(3), tmp_path)
+    colookup = CoLookup(s3_lookup.uri, cache_dir=cache_dir)
+    assert len(colookup.read_pq("chospital")) == 3
+
+    def unreachable(*args, **kwargs):
+        raise ConnectionError("s3 is unreachable")
+
+    monkeypatch.setattr(colookup.fs, "info", unreachable)
+    assert len(colookup.read_pq("chospital")) == 3
+
+    # nothing cached: the error is not hidden behind a stale copy
+    with pytest.raises(ConnectionError):
+        colookup.fetch_cache("cchangwat.parquet")
+
+
+def test_read_many(s3_lookup, tmp_path):
+    s3_lookup.put("chospital", chospital(3), tmp_path)
+    s3_lookup.put("cchangwat", chospital(2)[["CHW_CODE"]], tmp_path)
+    colookup = CoLookup(s3_lookup.uri)
+
+    dfs = colookup.read_many(
+        ["chospital", "missing", "cchangwat", "chospital"],
+        columns={"chospital": ["HOSPCODE"]},
+    )
+    # in the order of names, once each, a missing table is an empty DataFrame
+    assert list(dfs) == ["chospital", "missing", "cchangwat"]
+    assert dfs["chospital"].columns.tolist() == ["HOSPCODE"]
+    assert len(dfs["chospital"]) == 3
+    assert dfs["missing"].empty
+    assert len(dfs["cchangwat"]) == 2
+
+
+def test_pooled_fs(s3_lookup, tmp_path):
+    s3_lookup.put("chospital", chospital(3), tmp_path)
+    colookup = CoLookup(s3_lookup.uri, max_pool_connections=4)
+
+    fs = colookup.fs
+    assert fs.config_kwargs["max_pool_connections"] == 4
+    assert fs.config_kwargs["tcp_keepalive"] is True
+    # every read, sequential or threaded, goes through the same filesystem
+    assert len(colookup.read_pq("chospital")) == 3
+    assert len(colookup.read_many(["chospital", "chospital"])["chospital"]) == 3
+    assert colookup.fs is fs
+
+
+def test_get_chospital(s3_lookup, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    s3_lookup.put("chospital", chospital(4).drop(columns="HOSPCODE"), tmp_path)
+    colookup = CoLookup(s3_lookup.uri, cache_dir=cache_dir)
+
+    columns = ["HOSCODE", "STATUS", "HOSCODE"]
+    df = colookup.get_chospital("14", columns=columns)
+    # the caller's list is not changed, HOSPCODE is added from HOSCODE
+    assert columns == ["HOSCODE", "STATUS", "HOSCODE"]
+    assert df.columns.tolist() == ["HOSCODE", "STATUS", "CHW_CODE", "HOSPCODE"]
+    assert df["HOSPCODE"].tolist() == ["10001", "10002", "10003"]
+
+    # memoized in the instance, a changed result does not leak to the next caller
+    df["STATUS"] = 0
+    monkeypatch.setattr(colookup, "read_pq", None)
+    df = colookup.get_chospital("14", columns=columns)
+    assert df["STATUS"].tolist() == [1, 1, 1]
+    monkeypatch.undo()
+
+    # memoized in the cache directory for other processes, by the ETag of the table
+    colookup = CoLookup(s3_lookup.uri, cache_dir=cache_dir)
+    monkeypatch.setattr(colookup, "read_pq", None)
+    assert colookup.get_chospital("14", columns=columns).equals(df)
+    monkeypatch.undo()
+
+    s3_lookup.put("chospital", chospital(5).drop(columns="HOSPCODE"), tmp_path)
+    colookup = CoLookup(s3_lookup.uri, cache_dir=cache_dir)
+    assert len(colookup.get_chospital("14", columns=columns)) == 4
+    assert len(colookup.get_chospital()) == 5
+    assert len(os.listdir(os.path.join(cache_dir, "memo"))) == 2
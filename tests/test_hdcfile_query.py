@@ -0,0 +1,54 @@
+import pyarrow as pa
+import pytest
+
+from hdcutil.hdcfile import ALL_HOSPCODE, HDCFiles
+
+from test_hdcfile_read import person_db
+
+pytest.importorskip("duckdb")
+
+
+@pytest.fixture
+def hdcfile(tmp_path) -> HDCFiles:
+    hdcfile = HDCFiles(str(tmp_path), 2024)
+    # t_person_db in the flat file, s_hive in the hive layout, s_flat per hospcode only
+    hdcfile.write_data("t_person_db", ALL_HOSPCODE, person_db())
+    hdcfile.write_dataset("s_hive", person_db(["10001", "10002"], n=2))
+    hdcfile.write_data("s_flat", "10001", person_db(["10001"], n=1))
+    hdcfile.write_data("s_flat", "10003", person_db(["10003"], n=2))
+    return hdcfile
+
+
+def test_query_layouts(hdcfile):
+    sql = "SELECT SOURCE_HOSPCODE, count(*) AS N FROM {} GROUP BY 1 ORDER BY 1"
+    df = hdcfile.query(sql.format("t_person_db"))
+    assert df.to_dict("list") == dict(SOURCE_HOSPCODE=[ALL_HOSPCODE], N=[12])
+    df = hdcfile.query(sql.format("s_hive"))
+    assert df.to_dict("list") == dict(SOURCE_HOSPCODE=["10001", "10002"], N=[2, 2])
+    df = hdcfile.query(sql.format("s_flat"))
+    assert df.to_dict("list") == dict(SOURCE_HOSPCODE=["10001", "10003"], N=[1, 2])
+
+
+def test_query_join(hdcfile):
+    table = hdcfile.query(
+        """
+        SELECT p.HOSPCODE, count(*) AS N
+        FROM t_person_db p JOIN s_hive s USING (HOSPCODE, PID)
+        WHERE p.CK_CID > 0
+        GROUP BY p.HOSPCODE ORDER BY p.HOSPCODE
+        """,
+        output="arrow",
+    )
+    assert isinstance(table, pa.Table)
+    assert table.to_pydict() == dict(HOSPCODE=["10001", "10002"], N=[1, 1])
+    assert hdcfile.read_seconds > 0
+
+
+def test_query_pnames(hdcfile):
+    # only the pname named in sql are views, a missing one is not
+    with pytest.raises(Exception, match="s_flat"):
+        hdcfile.query("SELECT * FROM s_flat", pnames=["s_hive"])
+    with pytest.raises(Exception, match="s_missing"):
+        hdcfile.query("SELECT * FROM s_missing")
+    with pytest.raises(ValueError, match="output"):
+        hdcfile.query("SELECT 1", output="polars")
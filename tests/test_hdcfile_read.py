@@ -0,0 +1,133 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from hdcutil.hdcfile import ALL_HOSPCODE, HDCFiles
+
+
+def person_db(hospcodes=("10001", "10002", "10003"), n: int = 4) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "HOSPCODE": [h for h in hospcodes for _ in range(n)],
+            "PID": [str(i) for _ in hospcodes for i in range(n)],
+            "CK_CID": [i % 2 for _ in hospcodes for i in range(n)],
+            "AGE": list(range(len(hospcodes) * n)),
+        }
+    )
+
+
+@pytest.fixture(params=["flat", "hive"])
+def hdcfile(request, tmp_path) -> HDCFiles:
+    hdcfile = HDCFiles(str(tmp_path), 2024)
+    if request.param == "flat":
+        hdcfile.write_data("t_person_db", ALL_HOSPCODE, person_db(), row_group_size=2)
+    else:
+        hdcfile.write_dataset("t_person_db", person_db())
+    return hdcfile
+
+
+def test_read_filters(hdcfile):
+    df = hdcfile.read_data("t_person_db", filters=[("HOSPCODE", "==", "10002")])
+    assert df["HOSPCODE"].unique().tolist() == ["10002"]
+    assert len(df) == 4
+
+    # OR of ANDs, with the columns projected after filtering
+    filters = [[("HOSPCODE", "==", "10001"), ("AGE", ">", 1)], [("AGE", ">=", 11)]]
+    df = hdcfile.read_data("t_person_db", columns=["AGE"], filters=filters)
+    assert df.columns.tolist() == ["AGE"]
+    assert sorted(df["AGE"].tolist()) == [2, 3, 11]
+
+    assert hdcfile.read_data("t_person_db", filters=[("AGE", ">", 100)]).empty
+
+
+def test_read_person_filters(hdcfile):
+    df = hdcfile.read_person_db(filters=[("HOSPCODE", "in", ["10001", "10003"])])
+    assert sorted(df["HOSPCODE"].unique().tolist()) == ["10001", "10003"]
+
+    df = hdcfile.read_person_cid(columns=["PID"], filters=[("HOSPCODE", "==", "10003")])
+    # only persons with a CID, of the filtered hospcode
+    assert df["PID"].tolist() == ["1", "3"]
+
+
+def test_read_grouped(tmp_path):
+    hdcfile = HDCFiles(str(tmp_path), 2024)
+    # written unsorted, with the per-hospcode file of 10002 next to the _all_ file
+    hdcfile.write_data(
+        "t_person_db", ALL_HOSPCODE, person_db(["10003", "10001"]), sort_by=[]
+    )
+    hdcfile.write_data("t_person_db", "10002", person_db(["10002", "10001"], n=2))
+
+    grouped = hdcfile.read_grouped(
+        "t_person_db", columns=["AGE"], filters=[("AGE", "<", 7)]
+    )
+    assert grouped.keys() == ["10001", "10003"]
+    assert grouped._offsets == {"10001": (0, 3), "10003": (3, 7)}
+    assert len(grouped) == 2
+    assert grouped["10001"]["AGE"].tolist() == [4, 5, 6]
+    assert grouped["10003"]["HOSPCODE"].unique().tolist() == ["10003"]
+    assert "10002" not in grouped
+    assert grouped["10002"].empty
+
+    grouped = hdcfile.read_grouped("t_person_db", key="PID", hospcode="10002")
+    assert grouped._offsets == {"0": (0, 2), "1": (2, 4)}
+
+    assert len(hdcfile.read_grouped("missing")) == 0
+
+
+def test_read_many(tmp_path):
+    hdcfile = HDCFiles(str(tmp_path), 2024)
+    hdcfile.write_data("s_a", ALL_HOSPCODE, person_db(["10001"], n=2))
+    hdcfile.write_data("s_a", "10002", person_db(["10002"], n=1))
+    HDCFiles(str(tmp_path), 2023).write_data(
+        "s_a", ALL_HOSPCODE, person_db(["10003"], n=3).drop(columns="AGE")
+    )
+
+    sources = ["s_a", ("s_a", "10002"), ("s_a", None, 2023), ("missing", "10001")]
+    df = hdcfile.read_many(sources, add_source=True)
+    # in the order of sources, a column missing in a file is null
+    assert df["HOSPCODE"].tolist() == ["10001"] * 2 + ["10002"] + ["10003"] * 3
+    assert (
+        df["SOURCE_HOSPCODE"].tolist()
+        == [ALL_HOSPCODE] * 2 + ["10002"] + [ALL_HOSPCODE] * 3
+    )
+    assert df["SOURCE_B_YEAR"].tolist() == ["2024"] * 3 + ["2023"] * 3
+    assert df["AGE"].isna().tolist() == [False] * 3 + [True] * 3
+    assert hdcfile.rows_read == 6
+
+    df = hdcfile.read_many(
+        sources[:3], columns=["PID"], filters=[("PID", "==", "0")], max_workers=1
+    )
+    assert df["PID"].tolist() == ["0"] * 3
+    assert hdcfile.read_many(["missing"]).empty
+
+    nbytes = hdcfile.read_table("s_a").nbytes
+    assert len(hdcfile.read_many(["s_a"], max_bytes=nbytes)) == 2
+    with pytest.raises(Exception, match="larger than max_bytes"):
+        hdcfile.read_many(["s_a", ("s_a", "10002")], max_bytes=nbytes)
+
+
+def test_iter_batches(hdcfile):
+    batches = list(
+        hdcfile.iter_batches(
+            "t_person_db",
+            columns=["AGE"],
+            filters=[("AGE", ">=", 3)],
+            batch_rows=4,
+        )
+    )
+    assert all(0 < len(b) <= 4 for b in batches)
+    assert sorted(age for b in batches for age in b["AGE"]) == list(range(3, 12))
+    assert hdcfile.rows_read == 9
+
+    batches = list(hdcfile.iter_batches("t_person_db", output="arrow"))
+    assert isinstance(batches[0], pa.RecordBatch)
+    assert sum(b.num_rows for b in batches) == 12
+    assert list(hdcfile.iter_batches("missing")) == []
+
+
+def test_iter_batches_arguments(hdcfile):
+    # raised by the call, not by the first batch
+    with pytest.raises(ValueError, match="output must be pandas or arrow"):
+        hdcfile.iter_batches("t_person_db", output="polars")
+    with pytest.raises(pa.ArrowInvalid):
+        hdcfile.iter_batches("t_person_db", columns=["MISSING"])
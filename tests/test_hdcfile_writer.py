@@ -0,0 +1,69 @@
+import os
+import socket
+
+import pandas as pd
+import pytest
+
+from hdcutil.hdcfile import ALL_HOSPCODE, HDCFiles
+
+
+def write_chunks(hdcfile: HDCFiles, partitioned: bool) -> str:
+    # chunks of one hospcode each: int then float, all-None then str, swapped and extra columns
+    with hdcfile.open_writer(
+        "chunks", partitioned=partitioned, fill_column=False, row_group_size=2
+    ) as writer:
+        writer.write(
+            pd.DataFrame({"HOSPCODE": ["10001"] * 3, "A": [1, 2, 3], "B": [None] * 3})
+        )
+        writer.write(pd.DataFrame({"A": [1.5], "HOSPCODE": ["10002"], "B": ["x"]}))
+        writer.write(
+            pd.DataFrame({"HOSPCODE": ["10003"], "B": ["y"], "A": [4], "C": ["new"]})
+        )
+        writer.write(pd.DataFrame({"HOSPCODE": ["10004"], "A": [5]}))
+    return writer.PATH
+
+
+@pytest.mark.parametrize("partitioned", [False, True])
+def test_write_mismatched_chunks(tmp_path, partitioned):
+    hdcfile = HDCFiles(str(tmp_path), 2024)
+    write_chunks(hdcfile, partitioned)
+
+    df = hdcfile.read_data("chunks", ALL_HOSPCODE)
+    df = df.sort_values(["HOSPCODE", "A"]).reset_index(drop=True)
+    assert len(df) == 6
+    assert df["HOSPCODE"].tolist() == ["10001"] * 3 + ["10002", "10003", "10004"]
+    assert df["A"].tolist() == [1.0, 2.0, 3.0, 1.5, 4.0, 5.0]
+    assert df["B"].tolist()[3:5] == ["x", "y"]
+    assert df["B"].isna().sum() == 4
+    assert df["C"].tolist()[4] == "new"
+    assert df["C"].isna().sum() == 5
+
+
+def test_write_incompatible_chunk(tmp_path):
+    hdcfile = HDCFiles(str(tmp_path), 2024)
+    writer = hdcfile.open_writer("chunks", fill_column=False)
+    writer.write(pd.DataFrame({"HOSPCODE": ["10001"], "A": [1]}))
+    with pytest.raises(Exception, match="schema is not match"):
+        writer.write(pd.DataFrame({"HOSPCODE": ["10002"], "A": ["x"]}))
+    writer.abort()
+    assert not os.path.exists(writer.TMP_PATH)
+    assert not os.path.exists(writer.PATH)
+
+
+def test_sweep_staging(tmp_path):
+    hdcfile = HDCFiles(str(tmp_path), 2024)
+    path = hdcfile.get_path(pname="chunks", hospcode=ALL_HOSPCODE)
+    os.makedirs(os.path.dirname(path))
+    host = socket.gethostname()
+    # a dead process of this host, a running one and one of another host
+    dead = f"{path}.tmp-{host}-{2 ** 22 + 1}-1"
+    alive = f"{path}.tmp-{host}-{os.getpid()}-1"
+    other = f"{path}.tmp-other-host-1-1"
+    for staging in (dead, alive, other):
+        open(staging, "w").close()
+
+    write_chunks(hdcfile, False)
+
+    assert not os.path.exists(dead)
+    assert os.path.exists(alive)
+    assert os.path.exists(other)
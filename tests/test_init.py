@@ -0,0 +1,33 @@
+import subprocess
+import sys
+
+import pytest
+
+import hdcutil
+
+
+def run_python(code: str) -> str:
+    # a fresh interpreter, so modules imported by other tests do not count
+    return subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+
+def test_import_is_lazy():
+    code = "import sys, hdcutil; print('pandas' in sys.modules)"
+    assert run_python(code) == "False"
+    code = "import sys, hdcutil; hdcutil.HDCFiles; print('pandas' in sys.modules)"
+    assert run_python(code) == "True"
+
+
+def test_lazy_attributes():
+    from hdcutil.colookup import CoLookup
+    from hdcutil.hdcfile import ALL_HOSPCODE, HDCFiles, init_pandas_options
+
+    assert hdcutil.HDCFiles is HDCFiles
+    assert hdcutil.CoLookup is CoLookup
+    assert hdcutil.ALL_HOSPCODE == ALL_HOSPCODE
+    assert hdcutil.init_pandas_options is init_pandas_options
+    assert set(hdcutil.__all__) <= set(dir(hdcutil))
+    with pytest.raises(AttributeError, match="no attribute 'missing'"):
+        hdcutil.missing
@@ -0,0 +1,41 @@
+import os
+
+from hdcutil.hdcfile import ALL_HOSPCODE
+from hdcutil.metrics import aggregate, get_run_id, read_metrics
+
+from conftest import BuiltScript
+
+PROCESS = """\
+if hospcode == "10002":
+    continue
+if hospcode == "10003":
+    raise Exception("failed")
+df = df_person.loc[(df_person["HOSPCODE"] == hospcode)]
+df = df.groupby(["HOSPCODE", "SEX"], as_index=False).agg(TARGET=("CID", "count"))
+df["AREACODE"] = conf.PROVINCE_CODE
+"""
+
+
+def test_metrics(tmp_path):
+    built = BuiltScript(tmp_path, PROCESS)
+    checkpoint_dir = str(tmp_path / "checkpoint")
+    assert built.run(HDCUTIL_RUN_ID="run-1", HDCUTIL_CHECKPOINT_DIR=checkpoint_dir) == 0
+
+    # next to the output, not read back as its data
+    path = os.path.join(built.hdcfile.BASE_PATH, "2024", "s_ck", "_metrics.jsonl")
+    records = read_metrics(path)
+    assert [(r["hospcode"], r["status"]) for r in records[:-1]] == [
+        ("10001", "success"),
+        ("10002", "ignore"),
+        ("10003", "error"),
+        ("10004", "success"),
+    ]
+    assert records[2]["message"] == "failed"
+    assert records[-1]["kind"] == "run"
+    assert {r["run_id"] for r in records} == {"run-1"}
+    df = built.hdcfile.read_data("s_ck", ALL_HOSPCODE)
+    assert df["HOSPCODE"].unique().tolist() == ["10001", "10004"]
+
+    # the file of a script that did not run in this run is not aggregated
+    assert aggregate([path], run_id="run-1")["totals"]["hospcodes"] == 4
+    assert aggregate([path], run_id=get_run_id())["runs"] == []
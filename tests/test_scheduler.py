@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+from hdcutil.scheduler import build_graph, run_graph
+
+
+def write_script(tmp_path, name: str, *pnames: str) -> str:
+    path = tmp_path / f"{name}.py"
+    reads = "".join(f'hdcfile.read_data("{pname}")\n' for pname in pnames)
+    path.write_text(f'output_filename = "{name}"\n{reads}')
+    return str(path)
+
+
+def test_build_graph(tmp_path):
+    a = write_script(tmp_path, "s_a", "t_person_db")
+    b = write_script(tmp_path, "s_b", "s_a", "s_b")
+    c = write_script(tmp_path, "s_c", "s_a", "s_b")
+    broken = tmp_path / "broken.py"
+    broken.write_text("def (")
+
+    graph = build_graph([a, b, c, str(broken)])
+    # inputs without a script and reads of the own output are not dependencies
+    assert graph == {a: set(), b: {a}, c: {a, b}, str(broken): set()}
+
+
+def test_build_graph_cycle(tmp_path):
+    a = write_script(tmp_path, "s_a", "s_c")
+    b = write_script(tmp_path, "s_b", "s_a")
+    c = write_script(tmp_path, "s_c", "s_b")
+    d = write_script(tmp_path, "s_d")
+    with pytest.raises(Exception, match="Circular dependency") as error:
+        build_graph([a, b, c, d])
+    assert "s_a.py" in str(error.value)
+    assert "s_d.py" not in str(error.value)
+
+
+def test_run_graph():
+    graph = {
+        "a": set(),
+        "b": {"a"},
+        "c": {"b"},
+        "d": {"a"},
+        "e": set(),
+        "f": {"e"},
+        "g": {"c", "f"},
+    }
+    started = []
+    lock = threading.Lock()
+
+    def task(filename: str) -> int:
+        with lock:
+            started.append(filename)
+        if filename == "e":
+            raise RuntimeError("crashed")
+        return 1 if filename == "b" else 0
+
+    results = run_graph(graph, task, workers=3)
+    # downstream of b and of the crashed e are skipped, others still run
+    assert results == dict(a=0, b=1, c=None, d=0, e=-1, f=None, g=None)
+    assert sorted(started) == ["a", "b", "d", "e"]
+    assert started.index("a") < started.index("b")
+    assert started.index("a") < started.index("d")
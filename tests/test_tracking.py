@@ -0,0 +1,65 @@
+import os
+
+import pandas as pd
+
+from hdcutil.hdcfile import ALL_HOSPCODE, HDCFiles
+from hdcutil.tracking import TRACE_ENV, RunState, record_input, script_key
+
+
+def run_script(monkeypatch, state: RunState, script: str, run, exit_code: int = 0):
+    # what `hdcli run --incremental` does around a script
+    key = script_key(script)
+    trace_file = state.new_trace_file()
+    monkeypatch.setenv(TRACE_ENV, trace_file)
+    run()
+    monkeypatch.delenv(TRACE_ENV)
+    state.update(script, key, trace_file, exit_code)
+    assert not os.path.exists(trace_file)
+
+
+def test_run_state(tmp_path, monkeypatch):
+    monkeypatch.setenv("BUDGET_YEAR", "2024")
+    hdcfile = HDCFiles(str(tmp_path / "storage"), 2024)
+    hdcfile.write_data("t_person_db", ALL_HOSPCODE, pd.DataFrame({"HOSPCODE": ["1"]}))
+    script = tmp_path / "s_a.py"
+    script.write_text("print('s_a')\n")
+    state_file = str(tmp_path / "state.json")
+    etags = {"s3://lookup/chospital.parquet": "etag-1"}
+
+    def run():
+        df = hdcfile.read_data("t_person_db")
+        record_input("s3://lookup/chospital.parquet", etag="etag-1")
+        hdcfile.write_data("s_a", ALL_HOSPCODE, df)
+
+    state = RunState(state_file, get_etag=etags.get)
+    assert state.check(str(script)) == (True, "no previous run")
+    run_script(monkeypatch, state, str(script), run)
+
+    # read back from the state file, as by the next `hdcli run`
+    state = RunState(state_file, get_etag=etags.get)
+    assert state.check(str(script)) == (False, "inputs and script are unchanged")
+
+    etags["s3://lookup/chospital.parquet"] = "etag-2"
+    assert state.check(str(script)) == (
+        True,
+        "input changed: s3://lookup/chospital.parquet",
+    )
+    etags["s3://lookup/chospital.parquet"] = "etag-1"
+
+    path = hdcfile.get_path("t_person_db", ALL_HOSPCODE)
+    hdcfile.write_data("t_person_db", ALL_HOSPCODE, pd.DataFrame({"HOSPCODE": ["12"]}))
+    assert state.check(str(script)) == (True, f"input changed: {path}")
+    run_script(monkeypatch, state, str(script), run)
+    assert not state.check(str(script))[0]
+
+    os.remove(hdcfile.get_path("s_a", ALL_HOSPCODE))
+    assert state.check(str(script))[1].startswith("output changed")
+
+    run_script(monkeypatch, state, str(script), run)
+    monkeypatch.setenv("BUDGET_YEAR", "2025")
+    assert state.check(str(script)) == (True, "script or environment changed")
+    monkeypatch.setenv("BUDGET_YEAR", "2024")
+
+    # a failed run is forgotten
+    run_script(monkeypatch, state, str(script), run, exit_code=1)
+    assert RunState(state_file).check(str(script)) == (True, "no previous run")